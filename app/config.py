@@ -19,10 +19,46 @@ class Settings(BaseSettings):
     openrouter_base_url: str = "https://openrouter.ai/api/v1"
     
     # LLM Configuration
-    llm_provider: Literal["openai", "openrouter"] = "openrouter"
+    llm_provider: Literal["openai", "openrouter", "stub", "cassette"] = "openrouter"  # "stub"/"cassette" for scripted runs
     llm_model: str = "anthropic/claude-3.5-sonnet"
+    stub_llm_latency_seconds: float = 0.0  # Simulated API latency for the stub provider
     
+    # Cassette Provider (llm_provider="cassette"): record real completions, replay them offline
+    llm_cassette_mode: Literal["replay", "record"] = "replay"
+    llm_cassette_path: str = "llm_cassette.jsonl"
+    llm_cassette_upstream: Literal["openai", "openrouter"] = "openrouter"  # Provider called while recording
+    llm_cassette_latency: str = "recorded"  # "recorded", "none", "fixed:MS", "uniform:LO:HI" or "normal:MEAN:SD"
+    llm_cassette_seed: int = 0  # Seeds the latency distribution so replays are repeatable
     
+    # Model Routing (simple turns go to the fast tier, the rest to the quality tier)
+    llm_routing_enabled: bool = True
+    llm_routing_threshold: float = 0.5  # Turns scoring at or above this use the quality tier
+    llm_fast_model: str | None = None  # None uses the provider's default model
+    llm_fast_max_tokens: int = 100
+    llm_fast_temperature: float = 0.6
+    llm_fast_cost_per_1k_input: float = 0.0  # USD, for the cost metrics
+    llm_fast_cost_per_1k_output: float = 0.0
+    llm_quality_model: str | None = None
+    llm_quality_max_tokens: int = 200
+    llm_quality_temperature: float = 0.8
+    llm_quality_cost_per_1k_input: float = 0.0
+    llm_quality_cost_per_1k_output: float = 0.0
+    
+    # Shadow Traffic: replay a sample of live LLM calls on a candidate provider/model/prompt set
+    shadow_sample_rate: float = 0.0  # Fraction of live calls replayed; 0 disables
+    shadow_provider: Literal["openai", "openrouter"] | None = None  # None uses the live provider
+    shadow_model: str | None = None  # None uses the live call's model
+    shadow_prompts_dir: str | None = None  # Candidate prompt files; missing ones fall back to the live prompts
+    shadow_max_concurrency: int = 4  # Sampled calls beyond this many in-flight shadow calls are skipped
+    shadow_results_path: str = "llm_shadow.jsonl"  # Paired live/candidate results, one JSON object per line
+    
+    
+    
+    # Token Budgets (tokens per user per UTC day, by user tier)
+    token_budgets: str = "free:50000,premium:500000"  # Comma-separated tier:tokens pairs; unlisted tiers are unlimited
+    token_budget_history_messages: int = 6  # Context kept for over-budget users (who also get the fast tier)
+    token_flush_interval_seconds: float = 30.0  # Usage is aggregated in memory and written in batches
+    token_pending_max_rows: int = 10000  # User-days kept in memory while flushes fail; the oldest are dropped beyond this
     
     # WhatsApp Cloud API Configuration
     whatsapp_access_token: str | None = None
@@ -34,14 +70,80 @@ class Settings(BaseSettings):
     telegram_webhook_secret: str | None = None
     telegram_allowed_user_ids: str | None = None  # Comma-separated list of allowed Telegram user IDs
     
-    # Supabase Configuration
-    supabase_url: str
-    supabase_key: str
+    # Storage Configuration
+    storage_backend: Literal["supabase", "sqlite"] = "supabase"
+    sqlite_path: str = "chatlingo.db"
+    scenario_cache_ttl_seconds: int = 300
+    
+    # Practice Scenarios
+    scenario_min_turns_to_complete: int = 3  # Learner messages before leaving a scenario counts as completing it
+    
+    # SOS Helper (local phrase index, LLM only when nothing matches)
+    sos_phrases_path: str | None = None  # JSON phrase list; None uses app/data/sos_phrases.json
+    sos_match_threshold: float = 0.4  # Minimum match score for a local answer
+    
+    # Supabase Configuration (required when storage_backend is "supabase")
+    supabase_url: str | None = None
+    supabase_key: str | None = None
+    
+    # Shared State Configuration (keeps multiple workers/nodes consistent)
+    shared_state_backend: Literal["memory", "redis"] = "memory"
+    redis_url: str = "redis://localhost:6379/0"
+    user_cache_ttl_seconds: int = 60
+    dedup_ttl_seconds: int = 3600  # How long webhook message ids are remembered
+    dedup_pending_ttl_seconds: int = 30  # Claim on an id until its job is persisted; a lost claim frees it for redelivery
+    user_lock_ttl_seconds: int = 120  # Lock expires on its own if a worker dies mid-turn
+    user_lock_wait_seconds: float = 60.0
+    rate_limit_per_minute: int = 30  # Messages per user per minute, 0 disables
+    send_limit_per_second: int = 0  # Outbound messages per second per number/bot, across workers; 0 disables
+    tenants_path: str | None = None  # JSON list of bots/numbers served by this process; unset serves one from the settings above
+    
+    # Durable Job Queue Configuration
+    job_queue_enabled: bool = True  # Persist webhooks before acking; False runs them as plain background tasks
+    job_queue_path: str = "chatlingo_jobs.db"
+    job_workers: int = 8
+    job_visibility_timeout_seconds: int = 120  # A claimed job reappears if not finished in this time
+    job_max_attempts: int = 5
+    job_retry_base_seconds: float = 2.0
+    job_poll_interval_seconds: float = 1.0
+    shard_workers: int = 0  # >0 runs MessageProcessor in N worker processes, each owning the users that hash to it
+    
+    # Admission Control (shed new non-urgent messages when overloaded)
+    admission_enabled: bool = True
+    admission_max_backlog: int = 200  # Queued plus in-flight turns
+    admission_max_wait_seconds: float = 60.0  # Estimated wait for a new turn
+    admission_shed_action: Literal["reply", "defer"] = "reply"  # Instant busy reply, or retry later via the job queue
+    admission_defer_seconds: float = 60.0
+    admission_depth_refresh_seconds: float = 1.0  # How often the job queue depth is re-read
+    
+    # Conversation Buffer Configuration (recent history of active sessions, in memory)
+    conversation_buffer_max_bytes: int = 64 * 1024 * 1024
+    conversation_buffer_max_messages: int = 50  # Per session
+    conversation_buffer_idle_seconds: int = 1800
     
     # Application Configuration
     environment: Literal["development", "staging", "production"] = "development"
     debug: bool = True
     port: int = 8000
+    prewarm_on_startup: bool = True  # Open connections and load scenarios/prompts before reporting ready
+    shutdown_drain_timeout_seconds: float = 20.0  # Deadline for in-flight messages on shutdown
+    readiness_probe_interval_seconds: float = 15.0  # Background dependency probes behind /ready
+    readiness_probe_timeout_seconds: float = 5.0
+    readiness_failure_threshold: int = 2  # Consecutive failed probes before /ready fails
+    loop_monitor_enabled: bool = True  # Event loop lag metric and blocking-call watchdog
+    loop_monitor_interval_seconds: float = 0.25  # How often loop scheduling lag is sampled
+    loop_stall_threshold_ms: float = 100.0  # Blocking longer than this is logged with the blocking stack
+    loop_stall_log_interval_seconds: float = 60.0  # Per call site
+    loop_stall_stack_depth: int = 15  # Frames logged per stall
+    admin_token: str | None = None  # Bearer token for the /admin endpoints; unset disables them
+    export_batch_size: int = 1000  # Rows per keyset page when exporting chat history
+    profiler_max_seconds: float = 60.0  # Longest /admin/profile run
+    profiler_interval_ms: float = 10.0  # Default time between stack samples
+    
+    # Logging Configuration
+    log_format: Literal["json", "text"] = "json"
+    log_sample_rate: float = 1.0  # Fraction of per-call INFO/DEBUG logs kept; warnings and errors are always kept
+    log_queue_size: int = 10000  # Records beyond this are dropped instead of blocking the caller
     
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -63,6 +165,20 @@ class Settings(BaseSettings):
             import logging
             logging.warning("Invalid TELEGRAM_ALLOWED_USER_IDS format. Expected comma-separated integers.")
             return set()
+    
+    def get_token_budgets(self) -> dict[str, int]:
+        """Parse and return daily token budgets keyed by user tier"""
+        if not self.token_budgets:
+            return {}
+        
+        try:
+            # Parse "tier:tokens" pairs
+            pairs = (item.split(":") for item in self.token_budgets.split(",") if item.strip())
+            return {tier.strip(): int(tokens) for tier, tokens in pairs}
+        except ValueError:
+            import logging
+            logging.warning("Invalid TOKEN_BUDGETS format. Expected comma-separated tier:tokens pairs.")
+            return {}
 
 
 # Global settings instance
@@ -0,0 +1,124 @@
+"""
+Logging pipeline for Chatlingo AI
+
+Log records are handed to a bounded in-memory queue and a background listener
+thread does the formatting and the stdout writes, so request handlers never
+block on I/O. Per-call INFO/DEBUG logs from the app can be sampled; warnings
+and errors (with their tracebacks) are always kept.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.config import settings
+from app.services.metrics import metrics
+
+# Attributes every LogRecord has; anything else was passed via `extra=`
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.Handler] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SuccessLogSampler(logging.Filter):
+    """Keep only a fraction of INFO/DEBUG records from app loggers"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not record.name.startswith("app"):
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that defers formatting to the listener and drops records when the queue is full"""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Same-process queue: pass the record through untouched, the listener formats it
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+            metrics.inc("log_records_dropped")
+
+
+def setup_logging() -> None:
+    """Install the queue-based pipeline on the root logger (idempotent)"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    level = logging.DEBUG if settings.debug else logging.INFO
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if settings.log_format == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=settings.log_queue_size))
+    queue_handler.addFilter(SuccessLogSampler(settings.log_sample_rate))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    for name in ["app", "app.routers", "app.services", "uvicorn", "uvicorn.error"]:
+        logging.getLogger(name).setLevel(level)
+
+    _queue_handler = queue_handler
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records, stop the listener thread and log synchronously from then on"""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    # Records emitted after this (interpreter teardown, late library logs) would sit in the queue forever
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    for handler in _listener.handlers:
+        root.addHandler(handler)
+    if NonBlockingQueueHandler.dropped:
+        root.warning(f"[LOGGING] ⚠️ {NonBlockingQueueHandler.dropped} log records were dropped because the queue was full")
+    _listener = None
+    _queue_handler = None
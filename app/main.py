@@ -4,53 +4,144 @@ Chatlingo AI - Main FastAPI application
 Entry point for the multi-platform chatbot backend.
 """
 
-import sys
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from app.config import settings
+from app.logging_config import setup_logging
+
+# Configure logging before the routers import (and log from) the services
+setup_logging()
+
 from fastapi import FastAPI
 from fastapi.responses import JSONResponse
-from app.config import settings
 from app.routers import whatsapp_webhook
 from app.routers import telegram_webhook
-import logging
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG if settings.debug else logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    stream=sys.stdout,
-    force=True
-)
-
-for name in ["app", "app.routers", "app.services", "uvicorn", "uvicorn.error"]:
-    logging.getLogger(name).setLevel(logging.DEBUG if settings.debug else logging.INFO)
+from app.routers import admin
+from app.services import storage
+from app.services.admission import admission
+from app.services.job_queue import job_queue, JobWorkerPool
+from app.services.llm_service import llm_service
+from app.services.loop_monitor import loop_monitor
+from app.services.metrics import metrics
+from app.services.phrase_index import phrase_index
+from app.services.readiness import readiness
+from app.services.sharding import shard_supervisor
+from app.services.message_processor import JOB_HANDLERS
+from app.services.shared_state import shared_state
+from app.services.task_runner import task_runner
+from app.services.tenants import tenant_registry
+from app.services.token_accounting import token_accountant
 
 logger = logging.getLogger(__name__)
 
 logger.info(f"Chatlingo AI starting | env={settings.environment} | llm={settings.llm_provider}/{settings.llm_model}")
 
+
+async def _prewarm():
+    """Open connections and load scenarios/prompts before the app reports ready"""
+    phrase_index.ensure_loaded()
+    warmups = {"storage": storage.warmup(), "llm": llm_service.warmup()}
+    for tenant in tenant_registry.all():
+        if tenant.telegram:
+            warmups["telegram" if tenant.is_default else f"telegram:{tenant.id}"] = tenant.telegram.get_me()
+    
+    results = await asyncio.gather(*warmups.values(), return_exceptions=True)
+    for name, result in zip(warmups, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Warmup of {name} failed: {result}")
+
+
+async def _close_clients():
+    """Close pooled clients and the storage backend"""
+    closers = [storage.close(), llm_service.close(), tenant_registry.close(), shared_state.close()]
+    await asyncio.gather(*closers, return_exceptions=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop_monitor.start()
+    llm_service.provider  # Build the provider now, so bad LLM settings fail startup rather than the first turn
+    if settings.prewarm_on_startup:
+        await _prewarm()
+    
+    worker_pool = None
+    if shard_supervisor.enabled:
+        # This process only acks webhooks; the shard processes run the jobs
+        shard_supervisor.start()
+    elif settings.job_queue_enabled:
+        worker_pool = JobWorkerPool(job_queue, JOB_HANDLERS, settings.job_workers)
+        worker_pool.start()
+    token_accountant.start()
+    readiness.start()
+    logger.info("Chatlingo AI ready")
+    
+    yield
+    
+    # On SIGTERM uvicorn stops accepting connections, then runs this shutdown phase.
+    # Unfinished queued jobs stay on disk and are picked up after restart.
+    logger.info("Chatlingo AI shutting down")
+    await readiness.stop()
+    drains = [task_runner.drain(settings.shutdown_drain_timeout_seconds)]
+    if worker_pool:
+        drains.append(worker_pool.stop(settings.shutdown_drain_timeout_seconds))
+    if shard_supervisor.enabled:
+        drains.append(shard_supervisor.stop(settings.shutdown_drain_timeout_seconds))
+    await asyncio.gather(*drains)
+    await token_accountant.stop()  # Final flush of buffered token usage, before storage closes
+    await _close_clients()
+    await asyncio.to_thread(job_queue.close)
+    await loop_monitor.stop()
+    # The logging listener is stopped by its atexit hook, after uvicorn's own shutdown logs
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Chatlingo AI",
     description="Multi-platform chatbot for teaching Bangalore Kannada in Kanglish (WhatsApp & Telegram)",
     version="0.2.0",
-    debug=settings.debug
+    debug=settings.debug,
+    lifespan=lifespan
 )
 
 # Include routers
 app.include_router(whatsapp_webhook.router)
 app.include_router(telegram_webhook.router)
+app.include_router(admin.router)
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint for monitoring"""
+    """Health check endpoint for monitoring; 503 while saturated so load balancers can steer traffic away"""
+    load = await admission.saturation()
+    saturated = settings.admission_enabled and load["saturation"] >= 1.0
     return JSONResponse(
-        status_code=200,
+        status_code=503 if saturated else 200,
         content={
-            "status": "healthy",
-            "environment": settings.environment
+            "status": "saturated" if saturated else "healthy",
+            "environment": settings.environment,
+            **load,
+            "event_loop": loop_monitor.status(),
+            **({"shards": shard_supervisor.status()} if shard_supervisor.enabled else {})
         }
     )
 
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness from cached dependency probes; 503 while a critical dependency is down or during shutdown"""
+    status = readiness.status()
+    if not task_runner.accepting:
+        status = {**status, "ready": False, "failing": status["failing"] + ["draining"]}
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/metrics")
+async def metrics_snapshot():
+    """Per-process counters and latency summaries (LLM calls, tokens and cost per model tier).
+    With SHARD_WORKERS this is the ingress process only; the shard processes keep their own."""
+    return JSONResponse(status_code=200, content=metrics.snapshot())
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
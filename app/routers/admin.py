@@ -0,0 +1,79 @@
+"""
+Admin endpoints.
+
+Operational endpoints guarded by a bearer token (ADMIN_TOKEN). They are
+disabled (404) when no token is configured.
+"""
+
+import logging
+import secrets
+from datetime import datetime
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+from app.config import settings
+from app.services.export import HistoryFilter, stream_ndjson
+from app.services.profiler import ProfilerBusyError, profiler
+
+logger = logging.getLogger(__name__)
+
+
+async def require_admin(authorization: Optional[str] = Header(None)):
+    """Allow the request only with `Authorization: Bearer <ADMIN_TOKEN>`"""
+    if not settings.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(authorization or "", f"Bearer {settings.admin_token}"):
+        logger.warning("Rejected admin request with a missing or invalid token")
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_admin)]
+)
+
+
+@router.get("/export/chat-history")
+async def export_chat_history(
+    since: Optional[datetime] = Query(None, description="Inclusive lower bound on created_at"),
+    until: Optional[datetime] = Query(None, description="Exclusive upper bound on created_at"),
+    phone: Optional[str] = None,
+    scenario_id: Optional[int] = None,
+    session_id: Optional[str] = None,
+    gzip: bool = True
+):
+    """Stream matching chat history as NDJSON (gzip-compressed by default), oldest first"""
+    filters = HistoryFilter(since=since, until=until, phone=phone, scenario_id=scenario_id, session_id=session_id)
+    filename = "chat_history.ndjson.gz" if gzip else "chat_history.ndjson"
+    return StreamingResponse(
+        stream_ndjson(filters, compress=gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@router.get("/profile")
+async def profile(
+    seconds: float = Query(10.0, gt=0, description="How long to sample (capped at PROFILER_MAX_SECONDS)"),
+    interval_ms: Optional[float] = Query(None, ge=1, description="Time between samples (default PROFILER_INTERVAL_MS)"),
+    format: Literal["json", "collapsed"] = "json",
+    view: Literal["threads", "tasks"] = "threads",
+    top: int = Query(50, ge=1, description="Stacks and functions listed in the JSON summary")
+):
+    """
+    Sample this worker process's stacks for a while and return where the time went.
+    
+    `json` summarises the time held by MessageProcessor, llm_service and storage functions plus the
+    hottest thread stacks and task await chains; `collapsed` returns flamegraph.pl/speedscope input
+    for the chosen view.
+    """
+    try:
+        result = await profiler.profile(seconds, interval_ms)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "collapsed":
+        return PlainTextResponse(result.collapsed(view))
+    return result.to_dict(top)
@@ -4,9 +4,15 @@ Telegram Bot webhook endpoints.
 Handles incoming updates from Telegram Bot API.
 """
 
-from fastapi import APIRouter, Request, Header, HTTPException, BackgroundTasks
+from typing import Optional
+from fastapi import APIRouter, Request, Header, HTTPException
 from app.schemas.telegram import TelegramUpdate
+from app.services.admission import admission, BUSY_REPLY
 from app.services.message_processor import MessageProcessor
+from app.services.shared_state import shared_state
+from app.services.sharding import shard_supervisor
+from app.services.task_runner import task_runner
+from app.services.tenants import Tenant, tenant_registry
 from app.config import settings
 import logging
 
@@ -15,27 +21,47 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
+def _tenant_or_404(tenant_id: Optional[str]) -> Tenant:
+    tenant = tenant_registry.get(tenant_id)
+    if tenant is None:
+        raise HTTPException(status_code=404, detail="Unknown tenant")
+    return tenant
+
+
 @router.post("/telegram-webhook")
 async def telegram_webhook(
     update: TelegramUpdate,
-    background_tasks: BackgroundTasks,
     x_telegram_bot_api_secret_token: str = Header(None)
 ):
-    """Receive incoming Telegram updates"""
-    from app.services.telegram_service import telegram_service
+    """Receive incoming Telegram updates for the default bot"""
+    return await _handle_update(tenant_registry.default, update, x_telegram_bot_api_secret_token)
+
+
+@router.post("/telegram-webhook/{tenant_id}")
+async def tenant_telegram_webhook(
+    tenant_id: str,
+    update: TelegramUpdate,
+    x_telegram_bot_api_secret_token: str = Header(None)
+):
+    """Receive incoming Telegram updates for a tenant's bot"""
+    return await _handle_update(_tenant_or_404(tenant_id), update, x_telegram_bot_api_secret_token)
+
+
+async def _handle_update(tenant: Tenant, update: TelegramUpdate, secret_token: Optional[str]):
+    telegram_service = tenant.telegram
     
     if not telegram_service:
-        logger.error("Telegram not configured")
+        logger.error(f"Telegram not configured for tenant {tenant.id}")
         raise HTTPException(status_code=503, detail="Telegram not configured")
     
     # Verify secret token if configured
-    if settings.telegram_webhook_secret:
-        if x_telegram_bot_api_secret_token != settings.telegram_webhook_secret:
-            logger.warning("Invalid Telegram webhook secret")
+    if tenant.config.telegram_webhook_secret:
+        if secret_token != tenant.config.telegram_webhook_secret:
+            logger.warning(f"Invalid Telegram webhook secret for tenant {tenant.id}")
             raise HTTPException(status_code=403, detail="Forbidden")
     
     # Check user authorization - whitelist is MANDATORY
-    allowed_user_ids = settings.get_allowed_telegram_user_ids()
+    allowed_user_ids = set(tenant.config.telegram_allowed_user_ids)
     
     # Extract user ID from update
     user_id = None
@@ -55,15 +81,57 @@ async def telegram_webhook(
             )
         return {"status": "unauthorized"}
     
-    # Process update in background
-    background_tasks.add_task(MessageProcessor.process_telegram_update, update)
+    # While draining, reject so Telegram redelivers
+    if not task_runner.accepting:
+        raise HTTPException(status_code=503, detail="Shutting down")
+    
+    # Telegram redelivers updates it thinks were missed; process each update once (update ids are per bot)
+    delivery = f"telegram:{tenant.key(update.update_id)}"
+    if not await shared_state.claim_delivery(delivery):
+        return {"status": "ok"}
+    try:
+        await _accept(tenant, update, user_id, delivery)
+    except Exception:
+        # Not persisted: forget the update id so Telegram's redelivery is processed
+        await shared_state.release_delivery(delivery)
+        raise
+    await shared_state.confirm_delivery(delivery)
     return {"status": "ok"}
 
 
+async def _accept(tenant: Tenant, update: TelegramUpdate, user_id: Optional[int], delivery: str) -> None:
+    """Rate-limit, admit and persist (or start) an update; raises if it could not be persisted"""
+    user_key = tenant.key(user_id) if user_id else None
+    if user_key and await shared_state.is_rate_limited(user_key, tenant.rate_limit_per_minute):
+        logger.warning(f"Rate limit exceeded for Telegram user {user_key}")
+        return
+    
+    job = {"tenant": tenant.id, "update": update.model_dump(by_alias=True, exclude_none=True)}
+    
+    # Overloaded: answer instantly (or defer) instead of adding to the backlog
+    text = update.message.text if update.message else None
+    if update.message and not await admission.admit(text):
+        action = admission.shed_action
+        admission.record_shed("telegram", action)
+        if action == "defer":
+            await shard_supervisor.enqueue("telegram", job, user_key, delay=settings.admission_defer_seconds,
+                                           dedup_key=delivery)
+        else:
+            task_runner.submit(tenant.telegram.send_text_message, update.message.chat.id, BUSY_REPLY)
+        return
+    
+    # Persist before acking so the update survives a crash or redeploy.
+    # Sharded by user id (in private chats this is also the chat id MessageProcessor keys on).
+    if settings.job_queue_enabled:
+        await shard_supervisor.enqueue("telegram", job, user_key, dedup_key=delivery)
+    else:
+        task_runner.submit(MessageProcessor.process_telegram_update, update, tenant)
+
+
 @router.get("/telegram-webhook-info")
-async def get_webhook_info():
-    """Get current Telegram webhook configuration"""
-    from app.services.telegram_service import telegram_service
+async def get_webhook_info(tenant: Optional[str] = None):
+    """Get current Telegram webhook configuration (of the default bot, or the given tenant's)"""
+    telegram_service = _tenant_or_404(tenant).telegram
     
     if not telegram_service:
         raise HTTPException(status_code=400, detail="Telegram not configured")
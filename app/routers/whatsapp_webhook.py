@@ -6,14 +6,20 @@ Handles the verification and reception of WhatsApp webhooks.
 
 import json
 import logging
+from typing import Optional
 
-from fastapi import APIRouter, Query, HTTPException, Request, BackgroundTasks
+from fastapi import APIRouter, Query, HTTPException, Request
 from fastapi.responses import PlainTextResponse
 from pydantic import ValidationError
 
 from app.config import settings
 from app.schemas.whatsapp import WhatsAppWebhook
+from app.services.admission import admission, BUSY_REPLY
 from app.services.message_processor import message_processor
+from app.services.shared_state import shared_state
+from app.services.sharding import shard_supervisor
+from app.services.task_runner import task_runner
+from app.services.tenants import tenant_registry
 
 router = APIRouter(
     prefix="/whatsapp-webhook",
@@ -28,9 +34,10 @@ async def verify_webhook(
     token: str = Query(..., alias="hub.verify_token"),
     challenge: str = Query(..., alias="hub.challenge")
 ):
-    """Webhook verification endpoint for WhatsApp"""
-    if mode == "subscribe" and token == settings.whatsapp_verify_token:
-        logger.info("WhatsApp webhook verified successfully")
+    """Webhook verification endpoint for WhatsApp (any tenant's verify token is accepted)"""
+    tenant = tenant_registry.for_whatsapp_verify_token(token)
+    if mode == "subscribe" and tenant is not None:
+        logger.info(f"WhatsApp webhook verified successfully for tenant {tenant.id}")
         return PlainTextResponse(content=challenge, status_code=200)
     
     logger.warning("WhatsApp webhook verification failed")
@@ -38,7 +45,7 @@ async def verify_webhook(
 
 
 @router.post("")
-async def receive_webhook(request: Request, background_tasks: BackgroundTasks):
+async def receive_webhook(request: Request):
     """Receive incoming WhatsApp messages"""
     try:
         raw_body = await request.body()
@@ -53,5 +60,53 @@ async def receive_webhook(request: Request, background_tasks: BackgroundTasks):
         logger.error(f"Webhook validation failed: {e}")
         return {"status": "received"}
     
-    background_tasks.add_task(message_processor.process_webhook, payload)
+    # While draining, reject so WhatsApp redelivers to another instance
+    if not task_runner.accepting:
+        raise HTTPException(status_code=503, detail="Shutting down")
+    
+    # WhatsApp retries deliveries; process each message id once, across all workers
+    value = payload.entry[0].changes[0].value if payload.entry and payload.entry[0].changes else None
+    delivery = f"whatsapp:{value.messages[0].id}" if value and value.messages else None
+    if delivery and not await shared_state.claim_delivery(delivery):
+        return {"status": "received"}
+    try:
+        await _accept(raw_json, payload, value, delivery)
+    except Exception:
+        # Not persisted: forget the message id so WhatsApp's redelivery is processed
+        if delivery:
+            await shared_state.release_delivery(delivery)
+        raise
+    if delivery:
+        await shared_state.confirm_delivery(delivery)
     return {"status": "received"}
+
+
+async def _accept(raw_json: dict, payload: WhatsAppWebhook, value, delivery: Optional[str]) -> None:
+    """Rate-limit, admit and persist (or start) a webhook; raises if it could not be persisted"""
+    tenant = tenant_registry.for_whatsapp_phone_id(value.metadata.phone_number_id if value and value.metadata else None)
+    sender = None
+    if value and value.messages:
+        message = value.messages[0]
+        sender = tenant.key(message.from_)
+        if await shared_state.is_rate_limited(sender, tenant.rate_limit_per_minute):
+            logger.warning(f"Rate limit exceeded for WhatsApp user {sender}")
+            return
+        
+        # Overloaded: answer instantly (or defer) instead of adding to the backlog
+        text = message.text.body if message.type == "text" and message.text else None
+        if not await admission.admit(text):
+            action = admission.shed_action
+            admission.record_shed("whatsapp", action)
+            if action == "defer":
+                await shard_supervisor.enqueue("whatsapp", raw_json, sender, delay=settings.admission_defer_seconds,
+                                               dedup_key=delivery)
+            elif tenant.whatsapp:
+                task_runner.submit(tenant.whatsapp.send_text_message, message.from_, BUSY_REPLY)
+            return
+    
+    # Persist before acking so the message survives a crash or redeploy
+    if settings.job_queue_enabled:
+        # Status-only webhooks carry no sender and all go to shard 0
+        await shard_supervisor.enqueue("whatsapp", raw_json, sender, dedup_key=delivery)
+    else:
+        task_runner.submit(message_processor.process_webhook, payload)
@@ -1,3 +1,3 @@
-from .db import UserSchema, ScenarioSchema, ChatMessageSchema, UserProgressSchema
+from .db import UserSchema, ScenarioSchema, ChatMessageSchema, UserProgressSchema, TurnContextSchema, TokenUsageSchema, LearnerStatsSchema, LearnerScenarioStatsSchema, SosMissSchema
 from .whatsapp import WhatsAppWebhook, WhatsAppMessage
 from .telegram import TelegramUpdate
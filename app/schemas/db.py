@@ -5,7 +5,7 @@ These models represent the structure of data stored in Supabase tables.
 """
 
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 
@@ -15,6 +15,7 @@ class UserSchema(BaseModel):
     current_mode: str = Field(default='menu')
     current_scenario_id: Optional[int] = None
     current_session_id: Optional[str] = None
+    tier: str = Field(default='free')  # Selects the daily token budget
     joined_at: Optional[datetime] = None
 
 
@@ -29,6 +30,7 @@ class ScenarioSchema(BaseModel):
 
 class ChatMessageSchema(BaseModel):
     """Chat message model - represents a single message in conversation"""
+    id: Optional[int] = None
     phone_number: str
     role: str  # 'user' or 'bot'
     mode: str   # e.g., 'menu', 'roleplay'
@@ -43,4 +45,53 @@ class UserProgressSchema(BaseModel):
     phone_number: str
     scenario_id: int
     status: str  # e.g., 'in_progress', 'completed'
-    completed_at: Optional[datetime] = None
\ No newline at end of file
+    completed_at: Optional[datetime] = None
+
+
+class TokenUsageSchema(BaseModel):
+    """Token usage aggregated per user (per day in storage, summed over a range in reports)"""
+    phone_number: str
+    tier: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    calls: int = 0
+    cost_usd: float = 0.0
+
+
+class LearnerScenarioStatsSchema(BaseModel):
+    """Progress counters for one learner in one scenario"""
+    scenario_id: int
+    turns: int = 0  # Messages sent by the learner
+    sessions: int = 0  # Times the scenario was started
+    completions: int = 0
+    last_active_at: Optional[datetime] = None
+
+
+class LearnerStatsSchema(BaseModel):
+    """Progress counters for one learner, maintained as messages are written"""
+    phone_number: str
+    turns: int = 0
+    sessions: int = 0
+    completions: int = 0
+    first_active_at: Optional[datetime] = None
+    last_active_at: Optional[datetime] = None
+    scenarios: List[LearnerScenarioStatsSchema] = Field(default_factory=list)
+
+
+class SosMissSchema(BaseModel):
+    """An SOS Helper question the phrase index could not answer"""
+    query: str  # Normalized question
+    times_asked: int = 1
+    first_asked_at: Optional[datetime] = None
+    last_asked_at: Optional[datetime] = None
+
+
+class TurnContextSchema(BaseModel):
+    """Everything a turn needs, returned by begin_turn in one round trip"""
+    user: UserSchema
+    scenario: Optional[ScenarioSchema] = None
+    history: List[Dict[str, str]] = Field(default_factory=list)  # role/content pairs, oldest first
+    turn_key: Optional[str] = None  # Platform message id the turn was started for
+    replayed: bool = False  # The turn key was seen before (a retried job); the message was not saved again
+    reply: Optional[str] = None  # Reply already saved for a replayed turn
+    reply_sent: bool = False  # ...and whether it was sent
@@ -42,9 +42,16 @@ class WhatsAppMessage(BaseModel):
     interactive: Optional[InteractiveObject] = None
 
 
+class MetadataObject(BaseModel):
+    """Business number the webhook was sent to"""
+    phone_number_id: str
+    display_phone_number: Optional[str] = None
+
+
 class ValueObject(BaseModel):
     """Value object containing messages"""
     messaging_product: str
+    metadata: Optional[MetadataObject] = None
     messages: Optional[List[WhatsAppMessage]] = None
 
 
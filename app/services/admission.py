@@ -0,0 +1,105 @@
+"""
+Admission control for Chatlingo AI
+
+Sits in front of MessageProcessor. When the backlog (queued plus in-flight
+turns) or the estimated wait for a new turn crosses its threshold, new
+non-urgent messages are shed: the user gets an instant "busy" reply, or the
+message is deferred on the job queue, instead of joining the backlog.
+Menu commands and button presses are cheap and always admitted.
+"""
+
+import logging
+import time
+from typing import Optional
+
+from app.config import settings
+from app.services.job_queue import job_queue
+from app.services.metrics import metrics
+from app.services.task_runner import task_runner
+
+logger = logging.getLogger(__name__)
+
+BUSY_REPLY = "🙏 Swalpa busy ide! Lots of people are practising right now. Please try again in a minute, maadi."
+
+# Commands handled without an LLM call (see MessageProcessor)
+_CHEAP_COMMANDS = {"menu", "hi", "hello", "start", "restart", "/start", "exit", "quit", "stop", "end"}
+
+# Weight of the newest turn in the moving average of turn durations
+_EWMA_ALPHA = 0.2
+
+
+class AdmissionController:
+    """Tracks load and decides whether new work is admitted"""
+
+    def __init__(self):
+        self.avg_turn_seconds = 5.0  # Prior until real turns are observed
+        self.shed_total = 0
+        self.deferred_total = 0
+        self._depth = 0
+        self._depth_checked_at = 0.0
+
+    def observe_turn(self, seconds: float) -> None:
+        """Feed the duration of a completed turn into the wait estimate"""
+        self.avg_turn_seconds += _EWMA_ALPHA * (seconds - self.avg_turn_seconds)
+
+    async def backlog(self) -> int:
+        """Queued plus in-flight turns; the queue count is refreshed at most once per interval"""
+        if not settings.job_queue_enabled:
+            return task_runner.in_flight
+        now = time.monotonic()
+        if now - self._depth_checked_at >= settings.admission_depth_refresh_seconds:
+            stats = await job_queue.stats()
+            self._depth = stats["ready"] + stats["in_flight"]
+            self._depth_checked_at = now
+            if settings.shard_workers > 0 and stats["avg_job_seconds"] is not None:
+                # The shard processes run the turns; they publish their run times through the queue
+                self.avg_turn_seconds = stats["avg_job_seconds"]
+        return self._depth
+
+    def estimated_wait(self, backlog: int) -> float:
+        return backlog * self.avg_turn_seconds / max(settings.job_workers * max(settings.shard_workers, 1), 1)
+
+    async def saturation(self) -> dict:
+        """Load relative to the shedding thresholds (>= 1.0 means new work is being shed)"""
+        backlog = await self.backlog()
+        wait = self.estimated_wait(backlog)
+        ratio = max(backlog / max(settings.admission_max_backlog, 1),
+                    wait / max(settings.admission_max_wait_seconds, 0.001))
+        return {
+            "saturation": round(ratio, 2),
+            "backlog": backlog,
+            "estimated_wait_seconds": round(wait, 1),
+            "avg_turn_seconds": round(self.avg_turn_seconds, 2),
+            "shed_total": self.shed_total,
+            "deferred_total": self.deferred_total,
+        }
+
+    @staticmethod
+    def is_urgent(text: Optional[str]) -> bool:
+        """Button presses (no text) and menu/exit commands are cheap and always admitted"""
+        return text is None or text.lower().strip() in _CHEAP_COMMANDS
+
+    async def admit(self, text: Optional[str]) -> bool:
+        """False if this message should be shed instead of processed"""
+        if not settings.admission_enabled or self.is_urgent(text):
+            return True
+        return (await self.saturation())["saturation"] < 1.0
+
+    @property
+    def shed_action(self) -> str:
+        """'defer' needs the durable queue; without it shed work always gets the busy reply"""
+        if settings.admission_shed_action == "defer" and settings.job_queue_enabled:
+            return "defer"
+        return "reply"
+
+    def record_shed(self, platform: str, action: str) -> None:
+        if action == "defer":
+            self.deferred_total += 1
+        else:
+            self.shed_total += 1
+        metrics.inc("admission_shed", platform=platform, action=action)
+        logger.warning(f"[ADMISSION] ⚠️ Overloaded, {action} {platform} message")
+
+
+# Global instance
+admission = AdmissionController()
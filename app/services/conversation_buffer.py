@@ -0,0 +1,123 @@
+"""
+In-memory conversation buffer for Chatlingo AI
+
+Keeps the recent role/content history of active sessions so a turn does not
+have to re-read chat_history. Each session is a bounded ring of messages; the
+whole buffer is an LRU bounded by total bytes, and idle sessions expire.
+"""
+
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Rough per-message overhead of the dict and deque slot
+_MESSAGE_OVERHEAD_BYTES = 100
+
+
+def _message_size(content: str) -> int:
+    return len(content.encode("utf-8")) + _MESSAGE_OVERHEAD_BYTES
+
+
+class _Session:
+    __slots__ = ("messages", "bytes", "last_used", "version")
+
+    def __init__(self, version: Optional[str]):
+        self.messages: Deque[Dict[str, str]] = deque()
+        self.bytes = 0
+        self.last_used = time.monotonic()
+        self.version = version
+
+
+class ConversationBuffer:
+    """LRU of per-session message rings"""
+
+    def __init__(self, max_bytes: int, max_messages: int, idle_seconds: int):
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.idle_seconds = idle_seconds
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, session_id: str, version: Optional[str]) -> Optional[List[Dict[str, str]]]:
+        """Return the buffered history, or None if missing, idle-expired or stale (version changed elsewhere)"""
+        session = self._sessions.get(session_id)
+        if session is None or session.version != version or time.monotonic() - session.last_used > self.idle_seconds:
+            if session is not None:
+                self.drop(session_id)
+            self.misses += 1
+            return None
+
+        session.last_used = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        self.hits += 1
+        return list(session.messages)
+
+    def load(self, session_id: str, messages: List[Dict[str, str]], version: Optional[str]) -> None:
+        """Replace a session's buffer with history loaded from the database"""
+        self.drop(session_id)
+        session = _Session(version)
+        self._sessions[session_id] = session
+        for message in messages[-self.max_messages:]:
+            self._push(session, message["role"], message["content"])
+        self._evict()
+
+    def append(self, session_id: str, role: str, content: str, expected_version: Optional[str], new_version: Optional[str]) -> None:
+        """Append to a buffered session; if our copy was stale it is dropped and reloaded on next read"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return
+        if session.version != expected_version:
+            self.drop(session_id)
+            return
+
+        self._push(session, role, content)
+        session.version = new_version
+        session.last_used = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        self._evict()
+
+    def drop(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.bytes
+
+    def _push(self, session: _Session, role: str, content: str) -> None:
+        if len(session.messages) >= self.max_messages:
+            oldest = session.messages.popleft()
+            size = _message_size(oldest["content"])
+            session.bytes -= size
+            self._bytes -= size
+
+        session.messages.append({"role": role, "content": content})
+        size = _message_size(content)
+        session.bytes += size
+        self._bytes += size
+
+    def _evict(self) -> None:
+        """Drop idle sessions from the LRU end, then the least recently used ones until under the byte budget"""
+        now = time.monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used > self.idle_seconds or self._bytes > self.max_bytes:
+                self.drop(session_id)
+            else:
+                break
+
+
+# Global instance
+conversation_buffer = ConversationBuffer(
+    max_bytes=settings.conversation_buffer_max_bytes,
+    max_messages=settings.conversation_buffer_max_messages,
+    idle_seconds=settings.conversation_buffer_idle_seconds,
+)
@@ -0,0 +1,82 @@
+"""
+Chat history export for Chatlingo AI
+
+Streams chat_history as NDJSON, optionally gzip-compressed, one keyset page
+(ordered by created_at, id) at a time. Only the current page is held in memory,
+so exports of any size run in constant memory. Used by `cli.py --export` and
+the /admin/export endpoint.
+"""
+
+import json
+import logging
+import sys
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from app.config import settings
+from app.schemas import ChatMessageSchema
+from app.services import storage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HistoryFilter:
+    since: Optional[datetime] = None  # Inclusive
+    until: Optional[datetime] = None  # Exclusive
+    phone: Optional[str] = None
+    scenario_id: Optional[int] = None
+    session_id: Optional[str] = None
+
+
+async def iter_history_pages(filters: HistoryFilter, batch_size: Optional[int] = None) -> AsyncIterator[List[ChatMessageSchema]]:
+    """Yield matching messages page by page, oldest first"""
+    batch_size = batch_size or settings.export_batch_size
+    last = None
+    while True:
+        page = await storage.get_history_page(
+            last, batch_size, since=filters.since, until=filters.until, phone=filters.phone,
+            scenario_id=filters.scenario_id, session_id=filters.session_id,
+        )
+        if not page:
+            return
+        yield page
+        if len(page) < batch_size:
+            return
+        last = page[-1]
+
+
+async def _chunks(filters: HistoryFilter, compress: bool, batch_size: Optional[int]) -> AsyncIterator[Tuple[int, bytes]]:
+    """(rows, bytes) per page; compressed pages may be empty until the compressor has a full block"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits=31 writes a gzip container
+    async for page in iter_history_pages(filters, batch_size):
+        data = "".join(json.dumps(msg.model_dump(mode="json"), ensure_ascii=False) + "\n" for msg in page).encode("utf-8")
+        yield len(page), compressor.compress(data) if compressor else data
+    if compressor:
+        yield 0, compressor.flush()
+
+
+async def stream_ndjson(filters: HistoryFilter, compress: bool = True, batch_size: Optional[int] = None) -> AsyncIterator[bytes]:
+    """NDJSON (gzip if `compress`) byte chunks, for streaming HTTP responses"""
+    async for _, chunk in _chunks(filters, compress, batch_size):
+        if chunk:
+            yield chunk
+
+
+async def export_to_file(path: str, filters: HistoryFilter, batch_size: Optional[int] = None) -> int:
+    """Write matching messages to `path` ("-" for stdout), gzip-compressed if it ends in .gz. Returns the row count."""
+    compress = path.endswith(".gz")
+    rows = 0
+    out = sys.stdout.buffer if path == "-" else open(path, "wb")
+    try:
+        async for count, chunk in _chunks(filters, compress, batch_size):
+            out.write(chunk)
+            rows += count
+        out.flush()
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    logger.info(f"[EXPORT] ✅ Exported {rows} messages to {path}")
+    return rows
@@ -0,0 +1,371 @@
+"""
+Durable inbound job queue for Chatlingo AI
+
+Webhooks are written to a local SQLite (WAL) queue before they are acked, so
+accepted work survives crashes and redeploys. A pool of async workers claims
+jobs with a visibility timeout, retries failures with exponential backoff and
+moves jobs that keep failing to a dead-letter table.
+
+In sharded mode each job carries a hash of its user id, and every worker
+process only claims the jobs of its own shard (see app.services.sharding).
+"""
+
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    claimed_by TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    shard_key INTEGER,
+    dedup_key TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_available ON jobs(available_at, id);
+
+CREATE TABLE IF NOT EXISTS dead_letter (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    failed_at REAL NOT NULL,
+    shard_key INTEGER
+);
+
+-- Moving average of job run times across all worker processes (one row)
+CREATE TABLE IF NOT EXISTS job_timing (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    avg_seconds REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Columns added after the first release; CREATE TABLE IF NOT EXISTS does not add them to existing files
+_ADDED_COLUMNS = [
+    ("jobs", "shard_key", "INTEGER"),
+    ("jobs", "dedup_key", "TEXT"),
+    ("dead_letter", "shard_key", "INTEGER"),
+]
+
+# Created after the added columns exist; a redelivered webhook is not queued twice
+_INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs(dedup_key);
+"""
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Weight of the newest job in the moving average of job run times
+_TIMING_ALPHA = 0.2
+
+
+def _shard_filter(shard: Optional[Tuple[int, int]]) -> Tuple[str, list]:
+    """SQL condition (and params) for the jobs of shard (index, count); jobs without a shard key belong to shard 0"""
+    if shard is None:
+        return "", []
+    return "AND COALESCE(shard_key, 0) % ? = ? ", [shard[1], shard[0]]
+
+
+class JobQueue:
+    """SQLite-backed queue; all queries run on one dedicated thread that owns the connection"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-queue", initializer=self._open)
+        self._notify: Optional[asyncio.Event] = None
+
+    def _open(self) -> None:
+        self._conn = sqlite3.connect(self.path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(SCHEMA)
+        for table, column, definition in _ADDED_COLUMNS:
+            existing = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        self._conn.executescript(_INDEXES)
+        self._conn.commit()
+        logger.info(f"[QUEUE] ✅ Job queue ready at {self.path}")
+
+    async def _run(self, func: Callable, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    @property
+    def notify(self) -> asyncio.Event:
+        """Set whenever a job is enqueued in this process, so idle workers wake immediately"""
+        if self._notify is None:
+            self._notify = asyncio.Event()
+        return self._notify
+
+    # --- Producer side ---
+
+    def _enqueue(self, kind: str, payload: str, available_at: float, shard_key: Optional[int],
+                 dedup_key: Optional[str]) -> int:
+        cursor = self._conn.execute(
+            "INSERT OR IGNORE INTO jobs (kind, payload, available_at, created_at, shard_key, dedup_key) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, payload, available_at, time.time(), shard_key, dedup_key)
+        )
+        self._conn.commit()
+        if cursor.rowcount == 0:
+            # Already queued under this dedup key
+            return self._conn.execute("SELECT id FROM jobs WHERE dedup_key = ?", (dedup_key,)).fetchone()[0]
+        return cursor.lastrowid
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any], delay: float = 0.0, shard_key: Optional[int] = None,
+                      dedup_key: Optional[str] = None) -> int:
+        """Persist a job (once per dedup key while it is queued); returns once it is committed to disk"""
+        job_id = await self._run(self._enqueue, kind, json.dumps(payload, default=str), time.time() + delay,
+                                 shard_key, dedup_key)
+        self.notify.set()
+        return job_id
+
+    # --- Consumer side ---
+
+    def _claim(self, worker_id: str, shard: Optional[Tuple[int, int]]) -> Optional[dict]:
+        now = time.time()
+        where, params = _shard_filter(shard)
+        row = self._conn.execute(
+            "UPDATE jobs SET available_at = ?, attempts = attempts + 1, claimed_by = ? "
+            f"WHERE id = (SELECT id FROM jobs WHERE available_at <= ? {where}ORDER BY available_at, id LIMIT 1) "
+            "RETURNING id, kind, payload, attempts",
+            [now + settings.job_visibility_timeout_seconds, worker_id, now, *params]
+        ).fetchone()
+        self._conn.commit()
+        return dict(row) if row else None
+
+    async def claim(self, worker_id: str, shard: Optional[Tuple[int, int]] = None) -> Optional[dict]:
+        """Take the next available job (of shard (index, count), if given) and hide it for the visibility timeout"""
+        return await self._run(self._claim, worker_id, shard)
+
+    def _complete(self, job_id: int, seconds: Optional[float]) -> None:
+        self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        if seconds is not None:
+            self._conn.execute(
+                "INSERT INTO job_timing (id, avg_seconds, updated_at) VALUES (1, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET avg_seconds = avg_seconds + ? * (excluded.avg_seconds - avg_seconds), "
+                "updated_at = excluded.updated_at",
+                (seconds, time.time(), _TIMING_ALPHA)
+            )
+        self._conn.commit()
+
+    async def complete(self, job_id: int, seconds: Optional[float] = None) -> None:
+        """Remove a finished job, feeding its run time into the shared average"""
+        await self._run(self._complete, job_id, seconds)
+
+    def _fail(self, job: dict, error: str) -> bool:
+        if job["attempts"] >= settings.job_max_attempts:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dead_letter (id, kind, payload, attempts, last_error, created_at, failed_at, shard_key) "
+                "SELECT id, kind, payload, attempts, ?, created_at, ?, shard_key FROM jobs WHERE id = ?",
+                (error, time.time(), job["id"])
+            )
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job["id"],))
+            self._conn.commit()
+            return True
+
+        backoff = min(settings.job_retry_base_seconds * 2 ** (job["attempts"] - 1), 300.0)
+        backoff *= random.uniform(0.8, 1.2)
+        self._conn.execute(
+            "UPDATE jobs SET available_at = ?, claimed_by = NULL, last_error = ? WHERE id = ?",
+            (time.time() + backoff, error, job["id"])
+        )
+        self._conn.commit()
+        return False
+
+    async def fail(self, job: dict, error: str) -> bool:
+        """Schedule a retry with backoff, or dead-letter the job. Returns True if dead-lettered."""
+        return await self._run(self._fail, job, error)
+
+    def _release(self, job_id: int) -> None:
+        self._conn.execute(
+            "UPDATE jobs SET available_at = ?, attempts = MAX(attempts - 1, 0), claimed_by = NULL WHERE id = ?",
+            (time.time(), job_id)
+        )
+        self._conn.commit()
+
+    async def release(self, job_id: int) -> None:
+        """Hand an interrupted job back immediately, without counting the attempt"""
+        await self._run(self._release, job_id)
+
+    def _release_claimed(self, worker_id: str) -> int:
+        rows = self._conn.execute(
+            "SELECT id, kind, attempts FROM jobs WHERE claimed_by = ?", (worker_id,)
+        ).fetchall()
+        for row in rows:
+            self._fail(dict(row), "worker process exited")
+        return len(rows)
+
+    async def release_claimed(self, worker_id: str) -> int:
+        """Retry (or dead-letter) the jobs held by a worker process that died; the attempt counts,
+        so a message that crashes its worker every time still ends up dead-lettered"""
+        return await self._run(self._release_claimed, worker_id)
+
+    # --- Admin ---
+
+    def _stats(self, shard: Optional[Tuple[int, int]]) -> dict:
+        # A claimed job whose visibility timeout has passed counts as ready again
+        now = time.time()
+        where, params = _shard_filter(shard)
+        ready, delayed, in_flight = self._conn.execute(
+            "SELECT COALESCE(SUM(available_at <= ?), 0), "
+            "COALESCE(SUM(available_at > ? AND claimed_by IS NULL), 0), "
+            f"COALESCE(SUM(available_at > ? AND claimed_by IS NOT NULL), 0) FROM jobs WHERE 1 = 1 {where}",
+            [now, now, now, *params]
+        ).fetchone()
+        dead = self._conn.execute(f"SELECT COUNT(*) FROM dead_letter WHERE 1 = 1 {where}", params).fetchone()[0]
+        timing = self._conn.execute("SELECT avg_seconds FROM job_timing WHERE id = 1").fetchone()
+        return {"ready": ready, "delayed": delayed, "in_flight": in_flight, "dead_letter": dead,
+                "avg_job_seconds": round(timing[0], 3) if timing else None}
+
+    async def stats(self, shard: Optional[Tuple[int, int]] = None) -> dict:
+        """Job counts, of shard (index, count) if given"""
+        return await self._run(self._stats, shard)
+
+    def _list_dead_letters(self, limit: int) -> List[dict]:
+        rows = self._conn.execute(
+            "SELECT id, kind, attempts, last_error, failed_at FROM dead_letter ORDER BY failed_at DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    async def list_dead_letters(self, limit: int = 50) -> List[dict]:
+        return await self._run(self._list_dead_letters, limit)
+
+    def _replay_dead_letters(self, job_ids: Optional[List[int]]) -> int:
+        where, params = ("WHERE id IN (%s)" % ",".join("?" * len(job_ids)), job_ids) if job_ids else ("", [])
+        now = time.time()
+        cursor = self._conn.execute(
+            f"INSERT INTO jobs (kind, payload, available_at, created_at, shard_key) "
+            f"SELECT kind, payload, ?, created_at, shard_key FROM dead_letter {where} ORDER BY id",
+            [now, *params]
+        )
+        self._conn.execute(f"DELETE FROM dead_letter {where}", params)
+        self._conn.commit()
+        return cursor.rowcount
+
+    async def replay_dead_letters(self, job_ids: Optional[List[int]] = None) -> int:
+        """Move dead-lettered jobs (all, or the given ids) back onto the queue with a fresh attempt count"""
+        return await self._run(self._replay_dead_letters, job_ids)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._executor.submit(self._conn.close).result()
+        self._executor.shutdown(wait=True)
+
+
+class JobWorkerPool:
+    """Async workers consuming the job queue"""
+
+    def __init__(self, queue: JobQueue, handlers: Dict[str, JobHandler], concurrency: int,
+                 shard: Optional[Tuple[int, int]] = None, worker_id: Optional[str] = None):
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.shard = shard
+        self.worker_id = worker_id or f"{threading.get_native_id()}-{uuid.uuid4().hex[:8]}"
+        self._stopping = False
+        self._workers: List[asyncio.Task] = []
+        self._current: Dict[int, asyncio.Task] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._current)
+
+    def start(self) -> None:
+        self._workers = [asyncio.create_task(self._worker_loop(i)) for i in range(self.concurrency)]
+        logger.info(f"[QUEUE] Started {self.concurrency} job workers")
+
+    async def _worker_loop(self, index: int) -> None:
+        while not self._stopping:
+            # Clear before claiming so an enqueue that races the claim still wakes us
+            self.queue.notify.clear()
+            try:
+                job = await self.queue.claim(self.worker_id, self.shard)
+            except Exception as e:
+                logger.error(f"[QUEUE] ❌ Failed to claim job: {e}", exc_info=True)
+                await asyncio.sleep(1.0)
+                continue
+
+            if job is None:
+                # Idle: wake on a local enqueue, or poll for retries and other producers
+                try:
+                    await asyncio.wait_for(self.queue.notify.wait(), timeout=settings.job_poll_interval_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task = asyncio.create_task(self._run_job(job))
+            self._current[job["id"]] = task
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.done():
+                    raise
+            finally:
+                self._current.pop(job["id"], None)
+
+    async def _run_job(self, job: dict) -> None:
+        handler = self.handlers.get(job["kind"])
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind '{job['kind']}'")
+            await handler(json.loads(job["payload"]))
+        except asyncio.CancelledError:
+            await self.queue.release(job["id"])
+            raise
+        except Exception as e:
+            dead = await self.queue.fail(job, repr(e))
+            if dead:
+                logger.error(f"[QUEUE] ❌ Job {job['id']} ({job['kind']}) dead-lettered after {job['attempts']} attempts: {e}")
+            else:
+                logger.warning(f"[QUEUE] ⚠️ Job {job['id']} ({job['kind']}) failed (attempt {job['attempts']}), will retry: {e}")
+            return
+        await self.queue.complete(job["id"], time.perf_counter() - started)
+
+    async def stop(self, timeout: float) -> None:
+        """Keep working through queued jobs until empty or `timeout`, then hand back whatever is unfinished"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            stats = await self.queue.stats(self.shard)
+            if stats["ready"] == 0 and not self._current:
+                break
+            await asyncio.sleep(0.1)
+
+        self._stopping = True
+        self.queue.notify.set()
+        for task in self._current.values():
+            task.cancel()
+        await asyncio.gather(*self._current.values(), return_exceptions=True)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        logger.info("[QUEUE] ✅ Job workers stopped")
+
+
+# Global instance
+job_queue = JobQueue(settings.job_queue_path)
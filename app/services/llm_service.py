@@ -1,179 +1,474 @@
 """
 LLM Service for Chatlingo AI
 
-Handles interactions with LLM providers (OpenAI, OpenRouter) using a strategy pattern.
+Handles interactions with LLM providers (OpenAI, OpenRouter, local stub, record/replay cassette)
+using a strategy pattern.
 """
 
+import asyncio
+import copy
+import dataclasses
+import hashlib
+import json
 import logging
 import os
+import random
+import time
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
-from openai import AsyncOpenAI
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Awaitable, Callable, Optional, Tuple
 from app.config import settings
+from app.services.metrics import metrics
+from app.services.model_router import ModelTier, RouteDecision, model_router
+from app.services.shadow_traffic import shadow_traffic
+from app.services.tenants import current_tenant, get_current_tenant, tenant_registry
+from app.services.token_accounting import token_accountant
 
 logger = logging.getLogger(__name__)
 
-def load_prompt(filename: str) -> str:
-    """Load a prompt from the prompts directory"""
+# Token usage of the most recent completion in the current task (each asyncio task has its own copy)
+last_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("last_usage", default=None)
+
+
+def _record_usage(response: Any) -> None:
+    usage = getattr(response, "usage", None)
+    # Prompt tokens served from the provider's prefix cache (OpenAI, and OpenRouter for models that cache)
+    details = getattr(usage, "prompt_tokens_details", None)
+    last_usage.set({
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+    })
+
+# Prompt files are read once per process; only successful loads are cached
+_prompt_cache: Dict[str, str] = {}
+_PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prompts")
+
+def _read_prompt(prompt_path: str, filename: str) -> str:
+    if prompt_path in _prompt_cache:
+        return _prompt_cache[prompt_path]
     try:
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        prompt_path = os.path.join(current_dir, "..", "prompts", filename)
         logger.debug(f"[LLM] Loading prompt from: {prompt_path}")
         
         with open(prompt_path, "r", encoding="utf-8") as f:
             content = f.read().strip()
             logger.info(f"[LLM] ✅ Loaded prompt '{filename}' ({len(content)} chars)")
+            _prompt_cache[prompt_path] = content
             return content
     except Exception as e:
         logger.error(f"[LLM] ❌ Failed to load prompt {filename}: {str(e)}")
         return ""
 
+# Prompt directory that replaces the tenant's for the current task (set by shadow calls)
+prompts_dir_override: ContextVar[Optional[str]] = ContextVar("prompts_dir_override", default=None)
+
+# (tenant prompts_dir, filename) -> file to use, resolved once so a missing override is not re-checked per turn
+_prompt_paths: Dict[Tuple[str, str], str] = {}
+
+def load_prompt(filename: str) -> str:
+    """Load a prompt from the current tenant's prompts_dir if it has one, else the prompts directory"""
+    prompts_dir = prompts_dir_override.get() or get_current_tenant().config.prompts_dir
+    if not prompts_dir:
+        return _read_prompt(os.path.join(_PROMPTS_DIR, filename), filename)
+    
+    key = (prompts_dir, filename)
+    if key not in _prompt_paths:
+        override = os.path.join(prompts_dir, filename)
+        _prompt_paths[key] = override if os.path.exists(override) else os.path.join(_PROMPTS_DIR, filename)
+    return _read_prompt(_prompt_paths[key], filename)
+
+
+# Rendered scenario system prompts, keyed by the template and scenario text they were rendered from
+_scenario_prompt_cache: Dict[Tuple[str, str, str, str], str] = {}
+_SCENARIO_PROMPT_CACHE_SIZE = 1024
+
+
+def render_scenario_prompt(title: str, bot_persona: str, situation_seed: str) -> str:
+    """System prompt of a practice scenario, rendered once per distinct template and scenario text"""
+    template = load_prompt("practice_scenarios_system.txt")
+    key = (template, title, bot_persona, situation_seed)
+    if key in _scenario_prompt_cache:
+        return _scenario_prompt_cache[key]
+
+    rendered = template.format(scenario_title=title, bot_persona=bot_persona, situation_seed=situation_seed)
+    if template:
+        if len(_scenario_prompt_cache) >= _SCENARIO_PROMPT_CACHE_SIZE:
+            _scenario_prompt_cache.clear()
+        _scenario_prompt_cache[key] = rendered
+    return rendered
+
+
 class BaseLLMService(ABC):
     """Abstract base class for LLM services"""
     
     @abstractmethod
-    async def get_chat_response(self, history: List[Dict[str, str]]) -> str:
+    async def get_chat_response(self, history: List[Dict[str, str]], tier: Optional[ModelTier] = None) -> str:
         pass
 
     @abstractmethod
-    async def get_practice_scenario_response(self, history: List[Dict[str, str]], scenario: Dict[str, Any]) -> str:
+    async def get_practice_scenario_response(self, history: List[Dict[str, str]], scenario: Dict[str, Any],
+                                             tier: Optional[ModelTier] = None) -> str:
         pass
 
+    @abstractmethod
+    async def get_sos_response(self, query: str, tier: Optional[ModelTier] = None) -> str:
+        pass
+
+    # Providers cache repeated prompt prefixes, so messages run from the most to the least stable part:
+    # the shared instructions, then the scenario, then the history, which only grows at the end
+
+    @staticmethod
+    def _chat_messages(history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """System prompt plus history for random chat"""
+        return [{"role": "system", "content": load_prompt("base_system.txt")}, *history]
+
+    @staticmethod
+    def _scenario_messages(history: List[Dict[str, str]], scenario: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Scenario system prompt (shared rules first, the scenario's character last) plus history"""
+        system_prompt = render_scenario_prompt(
+            scenario.get('title', 'General Chat'),
+            scenario.get('bot_persona', 'Local Bangalorean'),
+            scenario.get('situation_seed', 'Casual conversation')
+        )
+        return [{"role": "system", "content": system_prompt}, *history]
+
+    @staticmethod
+    def _sos_messages(query: str) -> List[Dict[str, str]]:
+        """SOS prompt plus the phrase the learner needs"""
+        return [{"role": "system", "content": load_prompt("sos_system.txt")}, {"role": "user", "content": query}]
+
+    async def _create(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+                      tier: Optional[ModelTier]) -> Any:
+        """Call the chat completions API with the tier's model and settings, or the given defaults"""
+        response = await self.client.chat.completions.create(
+            model=tier.model if tier and tier.model else self.model,
+            messages=messages,
+            temperature=tier.temperature if tier else temperature,
+            max_tokens=tier.max_tokens if tier else max_tokens
+        )
+        _record_usage(response)
+        return response
+
 class OpenAIService(BaseLLMService):
     """Standard OpenAI implementation"""
     
     def __init__(self):
+        from openai import AsyncOpenAI  # Imported lazily to keep app startup fast
         self.client = AsyncOpenAI(api_key=settings.openai_api_key)
         self.model = "gpt-4o-mini" # Default for OpenAI
 
-    async def get_chat_response(self, history: List[Dict[str, str]]) -> str:
+    async def get_chat_response(self, history: List[Dict[str, str]], tier: Optional[ModelTier] = None) -> str:
         try:
-            base_system_prompt = load_prompt("base_system.txt")
-            messages = [{"role": "system", "content": base_system_prompt}]
-            messages.extend(history)
+            messages = self._chat_messages(history)
             logger.info(f"[LLM-OpenAI] Sending {len(messages)} messages to API...")
             
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=150
-            )
-            
+            response = await self._create(messages, max_tokens=150, temperature=0.7, tier=tier)
             result = response.choices[0].message.content
             logger.info(f"[LLM-OpenAI] ✅ Chat response received ({len(result)} chars)")
             return result
             
         except Exception as e:
-            logger.error(f"[LLM-OpenAI] ❌ API Error: {str(e)}")
-            import traceback
-            logger.error(f"[LLM-OpenAI] ❌ Traceback:\n{traceback.format_exc()}")
+            logger.error(f"[LLM-OpenAI] ❌ API Error: {str(e)}", exc_info=True)
             return "Ayyo! Something went wrong with my brain. Please try again later, maadi."
 
-    async def get_practice_scenario_response(self, history: List[Dict[str, str]], scenario: Dict[str, Any]) -> str:
+    async def get_practice_scenario_response(self, history: List[Dict[str, str]], scenario: Dict[str, Any],
+                                             tier: Optional[ModelTier] = None) -> str:
         logger.info(f"[LLM-OpenAI] get_practice_scenario_response: {len(history)} history, scenario='{scenario.get('title')}'")
         try:
-            practice_scenario_prompt = load_prompt("practice_scenarios_system.txt")
-            system_prompt = practice_scenario_prompt.format(
-                scenario_title=scenario.get('title', 'General Chat'),
-                bot_persona=scenario.get('bot_persona', 'Local Bangalorean'),
-                situation_seed=scenario.get('situation_seed', 'Casual conversation')
-            )
-            
-            messages = [{"role": "system", "content": system_prompt}]
-            messages.extend(history)
+            messages = self._scenario_messages(history, scenario)
             logger.info(f"[LLM-OpenAI] Sending {len(messages)} messages to API...")
             
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.8,
-                max_tokens=200
-            )
-            
+            response = await self._create(messages, max_tokens=200, temperature=0.8, tier=tier)
             result = response.choices[0].message.content
             logger.info(f"[LLM-OpenAI] ✅ Scenario response received ({len(result)} chars)")
             return result
             
         except Exception as e:
-            logger.error(f"[LLM-OpenAI] ❌ Practice Scenario Error: {str(e)}")
-            import traceback
-            logger.error(f"[LLM-OpenAI] ❌ Traceback:\n{traceback.format_exc()}")
+            logger.error(f"[LLM-OpenAI] ❌ Practice Scenario Error: {str(e)}", exc_info=True)
             return "Swalpa technical issue ide. Let's continue in a bit!"
 
+    async def get_sos_response(self, query: str, tier: Optional[ModelTier] = None) -> str:
+        try:
+            messages = self._sos_messages(query)
+            response = await self._create(messages, max_tokens=80, temperature=0.3, tier=tier)
+            result = response.choices[0].message.content
+            logger.info(f"[LLM-OpenAI] ✅ SOS response received ({len(result)} chars)")
+            return result
+            
+        except Exception as e:
+            logger.error(f"[LLM-OpenAI] ❌ SOS Error: {str(e)}", exc_info=True)
+            return "Sorry, couldn't find that phrase right now. Try saying it in simpler words?"
+
 class OpenRouterService(BaseLLMService):
     """OpenRouter implementation with custom headers and model routing"""
     
     def __init__(self):
+        from openai import AsyncOpenAI  # Imported lazily to keep app startup fast
         self.client = AsyncOpenAI(
             base_url=settings.openrouter_base_url,
             api_key=settings.openrouter_api_key,
         )
         self.model = settings.llm_model
 
-    async def get_chat_response(self, history: List[Dict[str, str]]) -> str:
+    async def get_chat_response(self, history: List[Dict[str, str]], tier: Optional[ModelTier] = None) -> str:
         try:
-            base_system_prompt = load_prompt("base_system.txt")
-            messages = [{"role": "system", "content": base_system_prompt}]
-            messages.extend(history)
+            messages = self._chat_messages(history)
             logger.info(f"[LLM-OpenRouter] Sending {len(messages)} messages to API...")
             
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=150
-            )
-            
+            response = await self._create(messages, max_tokens=150, temperature=0.7, tier=tier)
             result = response.choices[0].message.content
             return result
             
         except Exception as e:
-            logger.error(f"[LLM-OpenRouter] ❌ API Error: {str(e)}")
-            import traceback
-            logger.error(f"[LLM-OpenRouter] ❌ Traceback:\n{traceback.format_exc()}")
+            logger.error(f"[LLM-OpenRouter] ❌ API Error: {str(e)}", exc_info=True)
             return "Ayyo! Something went wrong with my brain. Please try again later."
 
-    async def get_practice_scenario_response(self, history: List[Dict[str, str]], scenario: Dict[str, Any]) -> str:
+    async def get_practice_scenario_response(self, history: List[Dict[str, str]], scenario: Dict[str, Any],
+                                             tier: Optional[ModelTier] = None) -> str:
         logger.info(f"[LLM-OpenRouter] get_practice_scenario_response: {len(history)} history, scenario='{scenario.get('title')}'")
         try:
-            practice_scenario_prompt = load_prompt("practice_scenarios_system.txt")
-            system_prompt = practice_scenario_prompt.format(
-                scenario_title=scenario.get('title', 'General Chat'),
-                bot_persona=scenario.get('bot_persona', 'Local Bangalorean'),
-                situation_seed=scenario.get('situation_seed', 'Casual conversation')
-            )
-            
-            messages = [{"role": "system", "content": system_prompt}]
-            messages.extend(history)
+            messages = self._scenario_messages(history, scenario)
             logger.info(f"[LLM-OpenRouter] Sending {len(messages)} messages to API...")
             
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.8,
-                max_tokens=200
-            )
-            
+            response = await self._create(messages, max_tokens=200, temperature=0.8, tier=tier)
             result = response.choices[0].message.content
             logger.info(f"[LLM-OpenRouter] ✅ Scenario response received ({len(result)} chars)")
             return result
             
         except Exception as e:
-            logger.error(f"[LLM-OpenRouter] ❌ Error: {str(e)}")
-            import traceback
-            logger.error(f"[LLM-OpenRouter] ❌ Traceback:\n{traceback.format_exc()}")
+            logger.error(f"[LLM-OpenRouter] ❌ Error: {str(e)}", exc_info=True)
             return "Swalpa technical issue ide. Let's continue in a bit!"
 
+    async def get_sos_response(self, query: str, tier: Optional[ModelTier] = None) -> str:
+        try:
+            messages = self._sos_messages(query)
+            response = await self._create(messages, max_tokens=80, temperature=0.3, tier=tier)
+            result = response.choices[0].message.content
+            logger.info(f"[LLM-OpenRouter] ✅ SOS response received ({len(result)} chars)")
+            return result
+            
+        except Exception as e:
+            logger.error(f"[LLM-OpenRouter] ❌ SOS Error: {str(e)}", exc_info=True)
+            return "Sorry, couldn't find that phrase right now. Try saying it in simpler words?"
+
+class StubLLMService(BaseLLMService):
+    """Local stand-in that answers without calling an API, for scripted runs and benchmarks"""
+    
+    def __init__(self):
+        self.client = None
+        self.model = "stub"
+
+    async def _reply(self, system_prompt: str, history: List[Dict[str, str]]) -> str:
+        if settings.stub_llm_latency_seconds > 0:
+            await asyncio.sleep(settings.stub_llm_latency_seconds)
+        last_user = next((m["content"] for m in reversed(history) if m["role"] == "user"), "")
+        result = f"[stub reply {len(history) + 1}] {last_user}".strip()
+        # Rough token estimate (~4 chars per token) so usage stats stay meaningful
+        prompt_chars = len(system_prompt) + sum(len(m["content"]) for m in history)
+        last_usage.set({"prompt_tokens": prompt_chars // 4, "completion_tokens": len(result) // 4})
+        return result
+
+    async def get_chat_response(self, history: List[Dict[str, str]], tier: Optional[ModelTier] = None) -> str:
+        return await self._reply(load_prompt("base_system.txt"), history)
+
+    async def get_practice_scenario_response(self, history: List[Dict[str, str]], scenario: Dict[str, Any],
+                                             tier: Optional[ModelTier] = None) -> str:
+        return await self._reply(load_prompt("practice_scenarios_system.txt"), history)
+
+    async def get_sos_response(self, query: str, tier: Optional[ModelTier] = None) -> str:
+        return await self._reply(load_prompt("sos_system.txt"), [{"role": "user", "content": query}])
+
+class CassetteLLMService(BaseLLMService):
+    """
+    Records real completions to a cassette file keyed by a hash of the prompt, and replays them offline.
+    
+    Replays are deterministic: same prompt, same reply and token usage, with either the recorded
+    latency or one drawn from a configured (seeded) distribution.
+    """
+    
+    def __init__(self, upstream: Optional[BaseLLMService] = None):
+        self.upstream = upstream  # Real provider, only when recording
+        self.client = upstream.client if upstream else None
+        self.model = upstream.model if upstream else "cassette"
+        self.path = settings.llm_cassette_path
+        self._random = random.Random(settings.llm_cassette_seed)
+        self._latency = self._parse_latency(settings.llm_cassette_latency)
+        self._entries = self._load()
+        logger.info(f"[LLM-Cassette] {'Recording to' if upstream else 'Replaying'} {self.path} ({len(self._entries)} entries)")
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        entries[entry["key"]] = entry  # Later recordings of a prompt win
+        return entries
+
+    @staticmethod
+    def _key(messages: List[Dict[str, str]], tier: Optional[ModelTier]) -> str:
+        request = {
+            "messages": messages,
+            "tier": [tier.name, tier.model, tier.max_tokens, tier.temperature] if tier else None,
+        }
+        return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _parse_latency(spec: str) -> Tuple[str, List[float]]:
+        """Replay latency: "recorded", "none", "fixed:MS", "uniform:LO:HI" or "normal:MEAN:SD" (milliseconds)"""
+        arity = {"recorded": 0, "none": 0, "fixed": 1, "uniform": 2, "normal": 2}
+        kind, *params = spec.split(":")
+        try:
+            values = [float(p) for p in params]
+        except ValueError:
+            values = None
+        if kind not in arity or values is None or len(values) != arity[kind]:
+            raise ValueError(f"Invalid LLM_CASSETTE_LATENCY '{spec}': expected \"recorded\", \"none\", "
+                             f"\"fixed:MS\", \"uniform:LO:HI\" or \"normal:MEAN:SD\"")
+        return kind, values
+
+    def _delay_ms(self, entry: Dict[str, Any]) -> float:
+        kind, values = self._latency
+        if kind == "none":
+            return 0.0
+        if kind == "fixed":
+            return values[0]
+        if kind == "uniform":
+            return self._random.uniform(values[0], values[1])
+        if kind == "normal":
+            return max(self._random.gauss(values[0], values[1]), 0.0)
+        return entry["latency_ms"]
+
+    async def _play(self, kind: str, messages: List[Dict[str, str]], tier: Optional[ModelTier],
+                    record: Callable[[], Awaitable[str]], fallback: str) -> str:
+        key = self._key(messages, tier)
+        
+        if self.upstream is not None:
+            started = time.perf_counter()
+            result = await record()
+            usage = last_usage.get()
+            if usage is None:
+                return result  # The upstream call failed; don't record its fallback reply
+            entry = {
+                "key": key,
+                "kind": kind,
+                "response": result,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                "usage": usage,
+                "recorded_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self._entries[key] = entry
+            # Small append per completion; recording runs are not latency-sensitive
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            return result
+        
+        entry = self._entries.get(key)
+        if entry is None:
+            logger.error(f"[LLM-Cassette] ❌ No recording for {kind} prompt {key[:12]} in {self.path}")
+            metrics.inc("llm_cassette_misses", kind=kind)
+            return fallback
+        await asyncio.sleep(self._delay_ms(entry) / 1000)
+        last_usage.set(dict(entry["usage"]))
+        return entry["response"]
+
+    async def get_chat_response(self, history: List[Dict[str, str]], tier: Optional[ModelTier] = None) -> str:
+        return await self._play(
+            "chat", self._chat_messages(history), tier,
+            lambda: self.upstream.get_chat_response(history, tier=tier),
+            "Ayyo! Something went wrong with my brain. Please try again later, maadi."
+        )
+
+    async def get_practice_scenario_response(self, history: List[Dict[str, str]], scenario: Dict[str, Any],
+                                             tier: Optional[ModelTier] = None) -> str:
+        return await self._play(
+            "practice_scenario", self._scenario_messages(history, scenario), tier,
+            lambda: self.upstream.get_practice_scenario_response(history, scenario, tier=tier),
+            "Swalpa technical issue ide. Let's continue in a bit!"
+        )
+
+    async def get_sos_response(self, query: str, tier: Optional[ModelTier] = None) -> str:
+        return await self._play(
+            "sos", self._sos_messages(query), tier,
+            lambda: self.upstream.get_sos_response(query, tier=tier),
+            "Sorry, couldn't find that phrase right now. Try saying it in simpler words?"
+        )
+
 class LLMService:
     """Main service wrapper that delegates to the configured provider"""
     
     def __init__(self):
-        self.provider: BaseLLMService = self._initialize_provider()
-        logger.info(f"[LLM] ✅ LLM Service initialized with provider: {settings.llm_provider}, model: {settings.llm_model}")
+        self._provider: Optional[BaseLLMService] = None
+        self._shadow_provider: Optional[BaseLLMService] = None
+
+    @property
+    def provider(self) -> BaseLLMService:
+        """Build the configured provider on first use"""
+        if self._provider is None:
+            self._provider = self._initialize_provider()
+            logger.info(f"[LLM] ✅ LLM Service initialized with provider: {settings.llm_provider}, model: {settings.llm_model}")
+            if shadow_traffic.enabled and not self._can_shadow():
+                logger.warning(f"[SHADOW] ⚠️ Shadow traffic is off: the {settings.llm_provider} provider needs a SHADOW_PROVIDER")
+        return self._provider
+
+    @staticmethod
+    def _can_shadow() -> bool:
+        """Shadow calls need an API provider: a copy of the stub is pointless, and one of a cassette would share its entries and file"""
+        return bool(settings.shadow_provider) or settings.llm_provider not in ("stub", "cassette")
+
+    @property
+    def shadow_provider(self) -> BaseLLMService:
+        """Candidate provider for shadow calls: the live one, or SHADOW_PROVIDER, with SHADOW_MODEL as its model"""
+        if self._shadow_provider is None:
+            base = self._api_provider(settings.shadow_provider) if settings.shadow_provider else self.provider
+            candidate = copy.copy(base)
+            if settings.shadow_model:
+                candidate.model = settings.shadow_model
+            self._shadow_provider = candidate
+            logger.info(f"[LLM] Shadow traffic: {settings.shadow_sample_rate:.0%} of calls to "
+                        f"{settings.shadow_provider or settings.llm_provider}/{candidate.model}"
+                        f"{f' with prompts from {settings.shadow_prompts_dir}' if settings.shadow_prompts_dir else ''}")
+        return self._shadow_provider
+
+    async def warmup(self) -> None:
+        """Load prompts, build the provider and open a connection to its API"""
+        for tenant in tenant_registry.all():
+            token = current_tenant.set(tenant)
+            for filename in ("base_system.txt", "practice_scenarios_system.txt", "sos_system.txt"):
+                load_prompt(filename)
+            current_tenant.reset(token)
+        try:
+            await self.ping()
+        except Exception as e:
+            logger.warning(f"[LLM] ⚠️ Warmup request failed: {e}")
+
+    async def ping(self) -> None:
+        """Cheap authenticated request to the provider API (raises on failure)"""
+        if self.provider.client is not None:
+            await self.provider.client.models.list()
+
+    async def close(self) -> None:
+        await shadow_traffic.close()
+        shadow_client = self._shadow_provider.client if self._shadow_provider is not None else None
+        if self._provider is not None and self._provider.client is not None:
+            await self._provider.client.close()
+        if shadow_client is not None and shadow_client is not self._provider.client:
+            await shadow_client.close()
 
     def _initialize_provider(self) -> BaseLLMService:
-        if settings.llm_provider == "openrouter":
+        if settings.llm_provider == "stub":
+            logger.info("[LLM] Using local stub provider (no API calls)")
+            return StubLLMService()
+        if settings.llm_provider == "cassette":
+            upstream = self._api_provider(settings.llm_cassette_upstream) if settings.llm_cassette_mode == "record" else None
+            return CassetteLLMService(upstream)
+        return self._api_provider(settings.llm_provider)
+
+    @staticmethod
+    def _api_provider(name: str) -> BaseLLMService:
+        if name == "openrouter":
             if not settings.openrouter_api_key:
                 logger.warning("[LLM] ⚠️ OpenRouter provider selected but no API key found. Falling back to OpenAI.")
                 return OpenAIService()
@@ -183,13 +478,119 @@ class LLMService:
             logger.info("[LLM] Using OpenAI")
             return OpenAIService()
     
-    async def get_chat_response(self, history: List[Dict[str, str]]) -> str:
+    async def get_chat_response(self, history: List[Dict[str, str]], user_id: Optional[str] = None,
+                                user_tier: Optional[str] = None) -> str:
         logger.info(f"[LLM] Delegating get_chat_response to provider")
-        return await self.provider.get_chat_response(history)
+        history, over_budget = await self._apply_budget(history, user_id, user_tier)
+        decision = self._route(history, "random_chat", None, over_budget)
+        return await self._call(decision, user_id, self.provider.get_chat_response, history)
 
-    async def get_practice_scenario_response(self, history: List[Dict[str, str]], scenario: Dict[str, Any]) -> str:
+    async def get_practice_scenario_response(self, history: List[Dict[str, str]], scenario: Dict[str, Any],
+                                             user_id: Optional[str] = None, user_tier: Optional[str] = None) -> str:
         logger.info(f"[LLM] Delegating get_practice_scenario_response to provider")
-        return await self.provider.get_practice_scenario_response(history, scenario)
+        history, over_budget = await self._apply_budget(history, user_id, user_tier)
+        decision = self._route(history, "practice_scenario", scenario, over_budget)
+        return await self._call(decision, user_id, self.provider.get_practice_scenario_response, history, scenario)
+
+    async def get_sos_response(self, query: str, user_id: Optional[str] = None, user_tier: Optional[str] = None) -> str:
+        """Kanglish for a phrase the local SOS index has no entry for"""
+        logger.info(f"[LLM] Delegating get_sos_response to provider")
+        history = [{"role": "user", "content": query}]
+        _, over_budget = await self._apply_budget(history, user_id, user_tier)
+        decision = self._route(history, "sos", None, over_budget)
+        return await self._call(decision, user_id, self.provider.get_sos_response, query)
+
+    async def _apply_budget(self, history: List[Dict[str, str]], user_id: Optional[str],
+                            user_tier: Optional[str]) -> tuple:
+        """Shorten the context of users who are over their daily token budget"""
+        if user_id is None or not await token_accountant.is_over_budget(user_id, user_tier):
+            return history, False
+        logger.info(f"[LLM] User over daily token budget (tier={user_tier or 'free'}), using reduced context")
+        metrics.inc("llm_over_budget", user_tier=user_tier or "free")
+        return history[-settings.token_budget_history_messages:], True
+
+    def _route(self, history: List[Dict[str, str]], mode: str, scenario: Optional[Dict[str, Any]],
+               over_budget: bool) -> Optional[RouteDecision]:
+        decision = model_router.route(history, mode, scenario)
+        if over_budget:
+            # Over-budget users always get the cheap tier, even when routing is off
+            return RouteDecision(model_router.fast, decision.score if decision else 0.0,
+                                 (decision.reasons if decision else []) + ["over_budget"])
+        return decision
+
+    async def _call(self, decision: Optional[RouteDecision], user_id: Optional[str], func: Any, *args) -> str:
+        """Run a provider call on the routed tier and record per-tier latency, tokens and cost"""
+        tier = decision.tier if decision else None
+        tier_name = tier.name if tier else "default"
+        if decision:
+            logger.info(f"[LLM] Routed to {tier_name} tier (score={decision.score}, {', '.join(decision.reasons) or 'simple'})")
+        
+        last_usage.set(None)
+        started = time.perf_counter()
+        result = await func(*args, tier=tier)
+        latency_ms = (time.perf_counter() - started) * 1000
+        metrics.inc("llm_calls", tier=tier_name)
+        metrics.observe("llm_latency_ms", latency_ms, tier=tier_name)
+        
+        # Providers swallow API errors and return a fallback reply; no usage means the call failed
+        usage = last_usage.get()
+        if usage is None:
+            metrics.inc("llm_failures", tier=tier_name)
+            return result
+        last_usage.set({**usage, "tier": tier_name})
+        metrics.inc("llm_prompt_tokens", usage["prompt_tokens"], tier=tier_name)
+        metrics.inc("llm_completion_tokens", usage["completion_tokens"], tier=tier_name)
+        metrics.inc("llm_cached_prompt_tokens", usage.get("cached_tokens", 0), tier=tier_name)
+        cost = 0.0
+        if tier:
+            cost = (usage["prompt_tokens"] * tier.cost_per_1k_input + usage["completion_tokens"] * tier.cost_per_1k_output) / 1000
+            metrics.inc("llm_cost_usd", cost, tier=tier_name)
+        if user_id is not None:
+            await token_accountant.record(user_id, usage["prompt_tokens"], usage["completion_tokens"], cost)
+        
+        if shadow_traffic.sample() and self._can_shadow():
+            live = {"tier": tier_name, "model": (tier.model if tier else None) or self.provider.model,
+                    "latency_ms": round(latency_ms, 1), **usage, "reply": result}
+            shadow_traffic.submit(lambda: self._shadow(func.__name__, args, tier, live))
+        return result
+
+    async def _shadow(self, method: str, args: tuple, tier: Optional[ModelTier], live: Dict[str, Any]) -> None:
+        """Replay a live call on the candidate and record both results (runs as a background task)"""
+        candidate = self.shadow_provider
+        if settings.shadow_prompts_dir:
+            prompts_dir_override.set(settings.shadow_prompts_dir)  # Only affects this task's context
+        if tier and (settings.shadow_model or settings.shadow_provider):
+            # Keep the tier's settings but use the candidate's model; another provider may not serve the live one
+            tier = dataclasses.replace(tier, model=None)
+        
+        last_usage.set(None)
+        started = time.perf_counter()
+        reply = await getattr(candidate, method)(*args, tier=tier)
+        latency_ms = (time.perf_counter() - started) * 1000
+        usage = last_usage.get()
+        metrics.inc("llm_shadow_calls", result="ok" if usage else "failed")
+        metrics.observe("llm_shadow_latency_ms", latency_ms)
+        
+        # History calls take the history first, SOS takes the query
+        request = args[0]
+        scenario = args[1] if len(args) > 1 and isinstance(args[1], dict) else None
+        await shadow_traffic.record({
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "call": method,
+            "scenario": scenario.get("title") if scenario else None,
+            "history_messages": len(request) if isinstance(request, list) else 0,
+            "input": request if isinstance(request, str)
+                     else next((m["content"] for m in reversed(request) if m["role"] == "user"), ""),
+            "live": live,
+            "shadow": {
+                "model": (tier.model if tier else None) or candidate.model,
+                "prompts_dir": settings.shadow_prompts_dir,
+                "latency_ms": round(latency_ms, 1),
+                **(usage or {}),
+                "reply": reply,
+                "failed": usage is None,
+            },
+        })
 
 # Global instance
 llm_service = LLMService()
\ No newline at end of file
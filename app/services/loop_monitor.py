@@ -0,0 +1,117 @@
+"""
+Event loop monitor for Chatlingo AI
+
+Measures how late the event loop runs a periodic callback (scheduling lag) and
+records it as the event_loop_lag_ms metric. A watchdog thread notices when the
+loop has not ticked for longer than the stall threshold, captures the stack the
+loop thread is stuck in, and logs it attributed to the innermost app frame
+(rate-limited per call site). That way, a blocking call on the hot path, such as
+sync I/O or a CPU-heavy loop, shows up while it is still blocking.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+
+from app.config import settings
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _call_site(frame) -> str:
+    """Innermost frame in app code (else the innermost frame), as module:function (file:line)"""
+    innermost, app_frame = frame, None
+    while frame is not None:
+        if frame.f_globals.get("__name__", "").startswith("app.") and app_frame is None:
+            app_frame = frame
+        frame = frame.f_back
+    frame = app_frame or innermost
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", code.co_filename)
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})"
+
+
+class LoopMonitor:
+    """Scheduling-lag sampler on the loop plus a stall watchdog thread"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._last_tick = time.monotonic()
+        self._stall_reported = False  # One report per stall
+        self._last_logged: Dict[str, float] = {}  # Call site -> when it was last logged
+        self.max_lag_ms = 0.0
+        self.stalls = 0
+
+    async def _tick_loop(self) -> None:
+        interval = settings.loop_monitor_interval_seconds
+        while True:
+            expected = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            lag_ms = max(now - expected, 0.0) * 1000
+            self._last_tick = now
+            self._stall_reported = False
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            metrics.observe("event_loop_lag_ms", lag_ms)
+            if lag_ms >= settings.loop_stall_threshold_ms:
+                metrics.observe("event_loop_stall_ms", lag_ms)
+
+    def _check(self) -> None:
+        """Runs on the watchdog thread: report the loop's stack if it has not ticked in time"""
+        blocked_ms = (time.monotonic() - self._last_tick) * 1000 - settings.loop_monitor_interval_seconds * 1000
+        if blocked_ms < settings.loop_stall_threshold_ms or self._stall_reported:
+            return
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        self._stall_reported = True
+        self.stalls += 1
+        site = _call_site(frame)
+        metrics.inc("event_loop_stalls")
+
+        now = time.monotonic()
+        if now - self._last_logged.get(site, float("-inf")) < settings.loop_stall_log_interval_seconds:
+            return
+        self._last_logged[site] = now
+        stack = "".join(traceback.format_stack(frame, limit=settings.loop_stall_stack_depth))
+        logger.warning(f"[LOOP] ⚠️ Event loop blocked for {blocked_ms:.0f}ms+ in {site}\n{stack}")
+
+    def _watch(self) -> None:
+        poll = max(settings.loop_stall_threshold_ms / 1000 / 2, 0.01)
+        while not self._stop.wait(poll):
+            try:
+                self._check()
+            except Exception as e:
+                logger.error(f"[LOOP] ❌ Watchdog error: {e}")
+
+    def start(self) -> None:
+        if not settings.loop_monitor_enabled:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._tick_loop())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def status(self) -> dict:
+        return {"max_lag_ms": round(self.max_lag_ms, 1), "stalls": self.stalls}
+
+
+# Global instance
+loop_monitor = LoopMonitor()
@@ -6,16 +6,21 @@ Includes conversation logic (scenarios, chat flows).
 """
 
 import logging
-import traceback
+import time
 import uuid
-from typing import Any
+from typing import Any, Optional
+from app.config import settings
 from app.schemas.whatsapp import WhatsAppWebhook
 from app.schemas.telegram import TelegramUpdate
-from app.services.whatsapp_service import whatsapp_service
-from app.services.telegram_service import telegram_service
+from app.schemas.db import TurnContextSchema
+from app.services.tenants import Tenant, current_tenant, get_current_tenant, tenant_registry
 from app.services.platform_adapter import get_platform_adapter
 from app.services.llm_service import llm_service
-from app.services import supabase_service
+from app.services import storage
+from app.services.shared_state import shared_state
+from app.services.admission import admission
+from app.services.metrics import metrics
+from app.services.phrase_index import phrase_index, normalize
 
 logger = logging.getLogger(__name__)
 
@@ -30,37 +35,50 @@ class MessageProcessor:
     """Core logic for processing incoming messages from WhatsApp and Telegram"""
     
     @staticmethod
-    async def process_telegram_update(update: TelegramUpdate):
-        """Process incoming Telegram update"""
+    async def process_telegram_update(update: TelegramUpdate, tenant: Optional[Tenant] = None):
+        """Process incoming Telegram update sent to a tenant's bot (the default bot if none)"""
+        started = time.perf_counter()
+        tenant = tenant or tenant_registry.default
+        current_tenant.set(tenant)
         try:
             # Handle regular message
             if update.message:
                 message = update.message
-                user_id = str(message.chat.id)
-                logger.info(f"Telegram message from {user_id}: {message.text}")
+                user_id = tenant.key(message.chat.id)
+                logger.info(f"Telegram message from {user_id}: {len(message.text or '')} chars")
                 
-                user = supabase_service.get_or_create_user(user_id)
-                platform = get_platform_adapter("telegram", telegram_service)
-                
-                if message.text:
-                    await MessageProcessor._handle_text_message(user, message.text, platform)
+                # One turn at a time per user, across all workers
+                async with shared_state.user_lock(user_id):
+                    platform = get_platform_adapter("telegram", tenant.telegram, tenant)
+                    
+                    if message.text:
+                        # Saves the message and loads user, scenario and history in one round trip
+                        # (keyed by the update id, so a retried job does not save or answer it twice)
+                        turn = await storage.begin_turn(user_id, message.text,
+                                                        turn_key=f"telegram:{tenant.key(update.update_id)}")
+                        await MessageProcessor._handle_text_message(turn, message.text, platform)
                     
             # Handle callback query (button press)
             elif update.callback_query:
                 callback = update.callback_query
-                user_id = str(callback.message.chat.id) if callback.message else str(callback.from_.id)
-                
-                await telegram_service.answer_callback_query(callback.id)
-                user = supabase_service.get_or_create_user(user_id)
-                platform = get_platform_adapter("telegram", telegram_service)
+                user_id = tenant.key(callback.message.chat.id if callback.message else callback.from_.id)
                 
-                await MessageProcessor._handle_button_callback(user, callback.data, platform)
+                await tenant.telegram.answer_callback_query(callback.id)
+                async with shared_state.user_lock(user_id):
+                    user = await storage.get_or_create_user(user_id)
+                    platform = get_platform_adapter("telegram", tenant.telegram, tenant)
+                    
+                    await MessageProcessor._handle_button_callback(user, callback.data, platform)
         
         except Exception as e:
-            logger.error(f"Error processing Telegram update: {e}\n{traceback.format_exc()}")
+            logger.error(f"Error processing Telegram update: {e}", exc_info=True)
+            raise
+        finally:
+            admission.observe_turn(time.perf_counter() - started)
     
     async def process_webhook(self, payload: WhatsAppWebhook):
         """Entry point for processing a WhatsApp webhook payload"""
+        started = time.perf_counter()
         try:
             if not payload.entry or not payload.entry[0].changes:
                 return
@@ -71,36 +89,54 @@ class MessageProcessor:
             if not value.messages or not value.messages[0]:
                 return
                 
+            # The business number the message was sent to selects the tenant
+            tenant = tenant_registry.for_whatsapp_phone_id(value.metadata.phone_number_id if value.metadata else None)
+            if tenant.whatsapp is None:
+                logger.error(f"Tenant {tenant.id} has no WhatsApp number configured")
+                return
+            current_tenant.set(tenant)
+            
             message = value.messages[0]
-            phone_number = message.from_
+            phone_number = tenant.key(message.from_)
             logger.info(f"WhatsApp message from {phone_number}: type={message.type}")
             
             # Mark message as read
-            await whatsapp_service.mark_message_as_read(message.id)
+            await tenant.whatsapp.mark_message_as_read(message.id)
             
-            # Get/create user
-            user = supabase_service.get_or_create_user(phone_number)
-            platform = get_platform_adapter("whatsapp", whatsapp_service)
-            
-            # Handle different message types
-            if message.type == "text":
-                await self._handle_text_message(user, message.text.body, platform)
-            elif message.type == "interactive":
-                await self._handle_interactive_message(user, message.interactive, platform)
+            # One turn at a time per user, across all workers
+            async with shared_state.user_lock(phone_number):
+                platform = get_platform_adapter("whatsapp", tenant.whatsapp, tenant)
+                
+                # Handle different message types
+                if message.type == "text":
+                    # Saves the message and loads user, scenario and history in one round trip
+                    # (keyed by the message id, so a retried job does not save or answer it twice)
+                    turn = await storage.begin_turn(phone_number, message.text.body, turn_key=f"whatsapp:{message.id}")
+                    await self._handle_text_message(turn, message.text.body, platform)
+                elif message.type == "interactive":
+                    user = await storage.get_or_create_user(phone_number)
+                    await self._handle_interactive_message(user, message.interactive, platform)
                 
         except Exception as e:
-            logger.error(f"Error processing webhook: {e}\n{traceback.format_exc()}")
+            logger.error(f"Error processing webhook: {e}", exc_info=True)
+            raise
+        finally:
+            admission.observe_turn(time.perf_counter() - started)
 
     @staticmethod
-    async def _handle_text_message(user: Any, text: str, platform: Any):
-        """Handle incoming text messages based on user state"""
-        user_id = user.phone_number
-        mode = user.current_mode
+    async def _handle_text_message(turn: TurnContextSchema, text: str, platform: Any):
+        """Handle incoming text messages based on user state (the message is already saved by begin_turn)"""
+        user_id = turn.user.phone_number
+        mode = turn.user.current_mode
         
-        # Save user message
-        session_id = getattr(user, 'current_session_id', None)
-        scenario_id = getattr(user, 'current_scenario_id', None)
-        supabase_service.add_message(user_id, "user", text, mode=mode, session_id=session_id, scenario_id=scenario_id)
+        # A retried job: don't answer again what was already answered
+        if turn.replayed and turn.reply is not None:
+            if turn.reply_sent:
+                logger.info(f"Turn {turn.turn_key} was already answered, skipping")
+            else:
+                await platform.send_text(user_id, turn.reply)
+                await storage.mark_turn_sent(turn.turn_key)
+            return
         
         # Global commands (including /start for Telegram)
         if text.lower() in ["menu", "hi", "hello", "start", "restart", "/start"]:
@@ -112,10 +148,13 @@ class MessageProcessor:
             await MessageProcessor._send_main_menu(user_id, platform)
             
         elif mode == "practice_scenario":
-            await MessageProcessor._handle_practice_scenario_flow(user, text, platform)
+            await MessageProcessor._handle_practice_scenario_flow(turn, text, platform)
             
         elif mode == "random_chat":
-            await MessageProcessor._handle_chat_flow(user, text, platform)
+            await MessageProcessor._handle_chat_flow(turn, platform)
+            
+        elif mode == "sos":
+            await MessageProcessor._handle_sos_flow(turn, text, platform)
             
         else:
             await MessageProcessor._send_main_menu(user_id, platform)
@@ -136,7 +175,8 @@ class MessageProcessor:
         user_id = user.phone_number
         
         if button_id == "practice_scenario_start":
-            scenarios = supabase_service.get_all_scenarios()
+            tenant = get_current_tenant()
+            scenarios = [s for s in await storage.get_all_scenarios() if tenant.allows_scenario(s.id)]
             
             if not scenarios:
                 await platform.send_text(user_id, "No scenarios found. Please contact admin.")
@@ -158,8 +198,13 @@ class MessageProcessor:
             await MessageProcessor._start_random_chat(user_id, platform)
             
         elif button_id == "sos_helper":
-            await platform.send_text(user_id, "🚑 SOS Helper coming soon! (This feature is under construction)")
-            await MessageProcessor._send_main_menu(user_id, platform)
+            # SOS questions get their own session, so they don't land in the last practice or chat session
+            await storage.update_user_mode(user_id, "sos", session_id=str(uuid.uuid4()))
+            await platform.send_text(
+                user_id,
+                "🚑 SOS Helper: type what you need to say in English (e.g. \"stop here\", \"too expensive\") "
+                "and I'll give you the Kannada. Send *menu* when you're done."
+            )
             
         elif button_id.startswith("scenario_"):
             try:
@@ -172,31 +217,32 @@ class MessageProcessor:
     @staticmethod
     async def _start_random_chat(user_id: str, platform: Any):
         """Start random chat mode"""
-        supabase_service.update_user_mode(user_id, "random_chat")
+        # Each chat gets its own session so its history does not pull in other modes
+        session_id = str(uuid.uuid4())
         
         # Generate opening using LLM
-        response_text = await llm_service.get_chat_response([])
+        response_text = await llm_service.get_chat_response([], user_id=user_id)
         
+        # Save the opening and switch the user into the chat in one round trip
+        await storage.complete_turn(user_id, response_text, "random_chat", session_id=session_id, update_user=True)
         await platform.send_text(user_id, response_text)
-        supabase_service.add_message(user_id, "assistant", response_text, mode="random_chat")
 
     @staticmethod
     async def _start_scenario(user_id: str, scenario_id: int, platform: Any):
         """Start a specific practice scenario"""
-        scenario = supabase_service.get_scenario_by_id(scenario_id)
-        if not scenario:
+        scenario = await storage.get_scenario_by_id(scenario_id)
+        if not scenario or not get_current_tenant().allows_scenario(scenario_id):
             await platform.send_text(user_id, "Scenario not found.")
             await MessageProcessor._send_main_menu(user_id, platform)
             return
             
-        # Create session and update user state
-        session_id = str(uuid.uuid4())
-        supabase_service.update_user_mode(user_id, "practice_scenario", scenario_id=scenario_id, session_id=session_id)
-        
         # Generate opening via LLM
-        response_text = await llm_service.get_practice_scenario_response([], scenario.model_dump())
-        supabase_service.add_message(user_id, "assistant", response_text, mode="practice_scenario", 
-                                    session_id=session_id, scenario_id=scenario_id)
+        response_text = await llm_service.get_practice_scenario_response([], scenario.model_dump(), user_id=user_id)
+        
+        # Create session, save the opening and update user state in one round trip
+        session_id = str(uuid.uuid4())
+        await storage.complete_turn(user_id, response_text, "practice_scenario", session_id=session_id,
+                                    scenario_id=scenario_id, update_user=True)
         
         # Send opening line with scenario title
         await platform.send_text(user_id, f"*{scenario.title}*\n\n{response_text}")
@@ -204,7 +250,7 @@ class MessageProcessor:
     @staticmethod
     async def _send_main_menu(user_id: str, platform: Any):
         """Send the main menu with buttons"""
-        supabase_service.update_user_mode(user_id, "menu")
+        await storage.update_user_mode(user_id, "menu")
         
         await platform.send_menu_buttons(
             user_id,
@@ -213,49 +259,102 @@ class MessageProcessor:
         )
 
     @staticmethod
-    async def _handle_practice_scenario_flow(user: Any, text: str, platform: Any):
+    async def _save_and_send(turn: TurnContextSchema, response_text: str, platform: Any, mode: str, **kwargs):
+        """Save the reply as the turn's reply, send it, then record it as sent so a retry won't resend it"""
+        user_id = turn.user.phone_number
+        await storage.complete_turn(user_id, response_text, mode, turn_key=turn.turn_key, **kwargs)
+        await platform.send_text(user_id, response_text)
+        if turn.turn_key:
+            await storage.mark_turn_sent(turn.turn_key)
+
+    @staticmethod
+    async def _handle_practice_scenario_flow(turn: TurnContextSchema, text: str, platform: Any):
         """Handle conversation in practice scenario mode"""
-        user_id = user.phone_number
+        user_id = turn.user.phone_number
         
         # Check for exit commands
         if text.lower().strip() in ["exit", "quit", "stop", "menu", "end"]:
+            # Only a session the learner actually practised in counts (the history ends with this exit message)
+            learner_turns = sum(1 for m in turn.history if m["role"] == "user") - 1
+            if turn.user.current_scenario_id is not None and learner_turns >= settings.scenario_min_turns_to_complete:
+                await storage.mark_scenario_complete(user_id, turn.user.current_scenario_id)
             await platform.send_text(user_id, "Ending practice session. Great job!")
             await MessageProcessor._send_main_menu(user_id, platform)
             return
 
-        scenario_id = user.current_scenario_id
-        session_id = getattr(user, 'current_session_id', None)
-        
-        scenario = supabase_service.get_scenario_by_id(scenario_id)
+        scenario = turn.scenario
         if not scenario:
             await MessageProcessor._send_main_menu(user_id, platform)
             return
 
-        # Get conversation history and generate response
-        history_objs = supabase_service.get_recent_messages(user_id, limit=50, session_id=session_id)
-        history = [{"role": msg.role, "content": msg.content} for msg in history_objs]
-        
-        response_text = await llm_service.get_practice_scenario_response(history, scenario.model_dump())
+        # Generate response from the history loaded with the turn
+        response_text = await llm_service.get_practice_scenario_response(turn.history, scenario.model_dump(),
+                                                                         user_id=user_id, user_tier=turn.user.tier)
         
         # Save and send response
-        supabase_service.add_message(user_id, "assistant", response_text, mode="practice_scenario",
-                                    session_id=session_id, scenario_id=scenario_id)
-        await platform.send_text(user_id, response_text)
+        await MessageProcessor._save_and_send(turn, response_text, platform, "practice_scenario",
+                                              session_id=turn.user.current_session_id, scenario_id=scenario.id)
 
     @staticmethod
-    async def _handle_chat_flow(user: Any, text: str, platform: Any):
-        """Handle conversation in random chat mode"""
-        user_id = user.phone_number
+    async def _handle_sos_flow(turn: TurnContextSchema, text: str, platform: Any):
+        """Answer "how do I say X" from the local phrase index; only unmatched questions go to the LLM"""
+        user_id = turn.user.phone_number
         
-        # Get history and generate response
-        history_objs = supabase_service.get_recent_messages(user_id, limit=50)
-        history = [{"role": msg.role, "content": msg.content} for msg in history_objs]
+        if text.lower().strip() in ["exit", "quit", "menu", "end"]:
+            await MessageProcessor._send_main_menu(user_id, platform)
+            return
+
+        match = phrase_index.lookup(text)
+        if match:
+            metrics.inc("sos_lookups", result="hit")
+            response_text = f"*{match.phrase.kanglish}*\n({match.phrase.intent})"
+        else:
+            metrics.inc("sos_lookups", result="miss")
+            response_text = await llm_service.get_sos_response(text, user_id=user_id, user_tier=turn.user.tier)
         
-        response_text = await llm_service.get_chat_response(history)
+        await MessageProcessor._save_and_send(turn, response_text, platform, "sos",
+                                              session_id=turn.user.current_session_id)
         
-        # Send and save
-        await platform.send_text(user_id, response_text)
-        supabase_service.add_message(user_id, "assistant", response_text, mode="random_chat")
+        if not match:
+            # Misses are counted so the most common ones can be added to the phrase file
+            try:
+                await storage.record_sos_miss(normalize(text))
+            except Exception as e:
+                logger.warning(f"Failed to record SOS miss: {e}")
+
+    @staticmethod
+    async def _handle_chat_flow(turn: TurnContextSchema, platform: Any):
+        """Handle conversation in random chat mode"""
+        user_id = turn.user.phone_number
+        
+        # Generate response from the history loaded with the turn
+        response_text = await llm_service.get_chat_response(turn.history, user_id=user_id, user_tier=turn.user.tier)
+        
+        # Save and send
+        await MessageProcessor._save_and_send(turn, response_text, platform, "random_chat",
+                                              session_id=turn.user.current_session_id)
 
 # Global instance
 message_processor = MessageProcessor()
+
+
+async def _run_whatsapp_job(payload: dict):
+    await message_processor.process_webhook(WhatsAppWebhook(**payload))
+
+
+async def _run_telegram_job(payload: dict):
+    # {"tenant": id, "update": {...}}; jobs queued before tenancy hold the bare update
+    if "update" not in payload:
+        payload = {"tenant": None, "update": payload}
+    tenant = tenant_registry.get(payload["tenant"])
+    if tenant is None:
+        logger.error(f"Dropping Telegram update for unknown tenant {payload['tenant']}")
+        return
+    await MessageProcessor.process_telegram_update(TelegramUpdate(**payload["update"]), tenant)
+
+
+# Durable job queue handlers, keyed by job kind
+JOB_HANDLERS = {
+    "whatsapp": _run_whatsapp_job,
+    "telegram": _run_telegram_job,
+}
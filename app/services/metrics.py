@@ -0,0 +1,65 @@
+"""
+In-process metrics for Chatlingo AI
+
+Counters and latency summaries kept per worker process and exposed as JSON on
+/metrics. Series are keyed by name plus labels, e.g. llm_calls{tier=fast}.
+"""
+
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict
+
+# Latency summaries keep the most recent observations per series
+_SUMMARY_WINDOW = 1000
+
+
+def _series(name: str, labels: Dict[str, str]) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in sorted(labels.items())) + "}"
+
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+class Metrics:
+    """Thread-safe counters and rolling summaries"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._summaries: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=_SUMMARY_WINDOW))
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        with self._lock:
+            self._counters[_series(name, labels)] += value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        with self._lock:
+            self._summaries[_series(name, labels)].append(value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = {k: round(v, 6) for k, v in sorted(self._counters.items())}
+            summaries = {k: list(v) for k, v in sorted(self._summaries.items())}
+        return {
+            "counters": counters,
+            "summaries": {
+                k: {
+                    "count": len(v),
+                    "p50": round(_percentile(v, 50), 2),
+                    "p95": round(_percentile(v, 95), 2),
+                    "max": round(max(v), 2) if v else 0.0,
+                }
+                for k, v in summaries.items()
+            },
+        }
+
+
+# Global instance
+metrics = Metrics()
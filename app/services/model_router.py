@@ -0,0 +1,113 @@
+"""
+Model Router for Chatlingo AI
+
+Scores each turn and picks a model tier: a fast, cheap model for simple turns
+("ok", "bye", one-word replies) and the larger quality model only when the
+turn needs it (long messages, scenario setup, likely corrections).
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+
+# Replies that never need the quality model
+_TRIVIAL_REPLIES = {
+    "ok", "okay", "k", "kk", "bye", "thanks", "thank you", "thx", "yes", "no", "yeah", "nope",
+    "haan", "howdu", "illa", "sari", "seri", "hmm", "cool", "nice", "good", "great", "👍", "🙏",
+}
+
+# Questions about the language itself, where the reply usually has to teach or correct
+_LANGUAGE_QUESTION = re.compile(
+    r"\b(how (do|to) (i |you )?say|what('?s| is| does)|meaning|mean|correct|mistake|wrong|grammar|translate)\b",
+    re.IGNORECASE,
+)
+
+# Kannada script; mixing it with Latin text often means the learner is trying something new
+_KANNADA_SCRIPT = re.compile(r"[ಀ-೿]")
+
+
+@dataclass(frozen=True)
+class ModelTier:
+    """Model and generation settings for one tier"""
+    name: str
+    model: Optional[str]  # None means the provider's default model
+    max_tokens: int
+    temperature: float
+    cost_per_1k_input: float = 0.0
+    cost_per_1k_output: float = 0.0
+
+
+@dataclass
+class RouteDecision:
+    tier: ModelTier
+    score: float
+    reasons: List[str] = field(default_factory=list)
+
+
+class ModelRouter:
+    """Scores a turn in [0, 1] and routes it to the fast or quality tier"""
+
+    def __init__(self):
+        self.fast = ModelTier(
+            name="fast",
+            model=settings.llm_fast_model,
+            max_tokens=settings.llm_fast_max_tokens,
+            temperature=settings.llm_fast_temperature,
+            cost_per_1k_input=settings.llm_fast_cost_per_1k_input,
+            cost_per_1k_output=settings.llm_fast_cost_per_1k_output,
+        )
+        self.quality = ModelTier(
+            name="quality",
+            model=settings.llm_quality_model,
+            max_tokens=settings.llm_quality_max_tokens,
+            temperature=settings.llm_quality_temperature,
+            cost_per_1k_input=settings.llm_quality_cost_per_1k_input,
+            cost_per_1k_output=settings.llm_quality_cost_per_1k_output,
+        )
+
+    def score(self, history: List[Dict[str, str]], mode: str, scenario: Optional[Dict[str, Any]] = None) -> RouteDecision:
+        last_user = next((m["content"] for m in reversed(history) if m["role"] == "user"), "")
+        text = last_user.strip()
+
+        # Openings set the scene for the whole conversation
+        if not text:
+            return RouteDecision(self.quality, 1.0, ["opening"])
+        if text.lower().strip(" .!?") in _TRIVIAL_REPLIES:
+            return RouteDecision(self.fast, 0.0, ["trivial"])
+
+        score = 0.0
+        reasons = []
+
+        words = len(text.split())
+        length_score = min(words / 20, 1.0) * 0.4
+        if length_score >= 0.1:
+            reasons.append(f"length={words}w")
+        score += length_score
+
+        if mode == "practice_scenario":
+            score += 0.15
+            reasons.append("practice")
+            # The first few exchanges of a scenario establish the persona
+            if scenario is not None and len(history) <= 4:
+                score += 0.2
+                reasons.append("scenario_start")
+
+        if _LANGUAGE_QUESTION.search(text) or _KANNADA_SCRIPT.search(text):
+            score += 0.4
+            reasons.append("correction_likely")
+
+        score = min(score, 1.0)
+        tier = self.quality if score >= settings.llm_routing_threshold else self.fast
+        return RouteDecision(tier, round(score, 2), reasons)
+
+    def route(self, history: List[Dict[str, str]], mode: str, scenario: Optional[Dict[str, Any]] = None) -> Optional[RouteDecision]:
+        """Pick a tier for this turn, or None when routing is disabled (providers use their defaults)"""
+        if not settings.llm_routing_enabled:
+            return None
+        return self.score(history, mode, scenario)
+
+
+# Global instance
+model_router = ModelRouter()
@@ -0,0 +1,141 @@
+"""
+SOS phrase index for Chatlingo AI
+
+In-memory index of English intents ("How much does this cost?") mapped to
+Kanglish phrases ("Idu eshtu?"), loaded from a JSON data file. Lookups use
+token overlap plus character trigram similarity over an inverted index, so an
+urgent "how do I say X" is answered in microseconds without an LLM call.
+"""
+
+import json
+import logging
+import os
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "sos_phrases.json")
+
+# Words that carry no intent ("how do I say ...", "what is ...")
+_STOPWORDS = {
+    "a", "an", "the", "i", "me", "my", "to", "do", "does", "is", "are", "am", "it", "this", "that",
+    "how", "say", "what", "in", "kannada", "please", "can", "you", "will", "for", "of",
+}
+_NON_WORD = re.compile(r"[^a-z0-9 ]+")
+
+
+def normalize(text: str) -> str:
+    return " ".join(_NON_WORD.sub(" ", text.lower()).split())
+
+
+def _tokens(text: str) -> Set[str]:
+    return {t for t in text.split() if t not in _STOPWORDS}
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass
+class Phrase:
+    intent: str
+    kanglish: str
+    aliases: List[str] = field(default_factory=list)
+
+
+@dataclass
+class PhraseMatch:
+    phrase: Phrase
+    score: float
+    matched: str  # The intent or alias that matched
+
+
+class PhraseIndex:
+    """Inverted trigram index over every intent and alias"""
+
+    def __init__(self):
+        self.phrases: List[Phrase] = []
+        self._keys: List[tuple] = []  # (phrase index, text, tokens, trigram count)
+        self._by_trigram: Dict[str, List[int]] = defaultdict(list)
+        self._by_token: Dict[str, List[int]] = defaultdict(list)
+        self._load_attempted = False
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self.phrases)
+
+    def ensure_loaded(self) -> None:
+        """Load the configured phrase file once; if it fails, lookups find nothing and SOS falls back to the LLM"""
+        if self._load_attempted:
+            return
+        try:
+            self.load()
+        except Exception as e:
+            logger.error(f"[SOS] ❌ Failed to load phrases: {e}")
+        self._load_attempted = True
+
+    def load(self, path: Optional[str] = None) -> int:
+        """(Re)build the index from a JSON list of {"intent", "kanglish", "aliases"}. Returns the phrase count."""
+        path = path or settings.sos_phrases_path or _DEFAULT_PATH
+        with open(path, "r", encoding="utf-8") as f:
+            phrases = [Phrase(**entry) for entry in json.load(f)]
+
+        self.__init__()
+        self._load_attempted = True
+        self.phrases = phrases
+        for index, phrase in enumerate(phrases):
+            for text in [phrase.intent, *phrase.aliases]:
+                text = normalize(text)
+                if not text:
+                    continue
+                key = len(self._keys)
+                tokens, trigrams = _tokens(text), _trigrams(text)
+                self._keys.append((index, text, tokens, len(trigrams)))
+                for gram in trigrams:
+                    self._by_trigram[gram].append(key)
+                for token in tokens:
+                    self._by_token[token].append(key)
+        logger.info(f"[SOS] ✅ Loaded {len(phrases)} phrases ({len(self._keys)} keys) from {path}")
+        return len(phrases)
+
+    def lookup(self, query: str, threshold: Optional[float] = None) -> Optional[PhraseMatch]:
+        """Best matching phrase, or None if nothing scores at least `threshold`"""
+        self.ensure_loaded()
+        threshold = settings.sos_match_threshold if threshold is None else threshold
+        text = normalize(query)
+        if not text or not self._keys:
+            return None
+        tokens, trigrams = _tokens(text), _trigrams(text)
+
+        shared_trigrams = Counter()
+        for gram in trigrams:
+            shared_trigrams.update(self._by_trigram.get(gram, ()))
+        shared_tokens = Counter()
+        for token in tokens:
+            shared_tokens.update(self._by_token.get(token, ()))
+
+        best_key, best_score = None, 0.0
+        for key, shared in shared_trigrams.items():
+            _, _, key_tokens, key_trigrams = self._keys[key]
+            dice = 2 * shared / (len(trigrams) + key_trigrams)
+            # Jaccard similarity of the content words
+            union = len(tokens) + len(key_tokens) - shared_tokens[key]
+            overlap = shared_tokens[key] / union if union else 0.0
+            score = 0.6 * dice + 0.4 * overlap
+            if score > best_score:
+                best_key, best_score = key, score
+
+        if best_key is None or best_score < threshold:
+            return None
+        index, matched, _, _ = self._keys[best_key]
+        return PhraseMatch(self.phrases[index], round(best_score, 3), matched)
+
+
+# Global instance
+phrase_index = PhraseIndex()
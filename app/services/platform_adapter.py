@@ -5,9 +5,10 @@ Simplified version - direct delegation without Protocol overhead.
 """
 
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from app.services.whatsapp_service import WhatsAppService
 from app.services.telegram_service import TelegramService
+from app.services.tenants import Tenant
 
 logger = logging.getLogger(__name__)
 
@@ -15,46 +16,70 @@ logger = logging.getLogger(__name__)
 class WhatsAppAdapter:
     """Adapter for WhatsApp messaging"""
     
-    def __init__(self, service: WhatsAppService):
+    def __init__(self, service: WhatsAppService, tenant: Optional[Tenant] = None):
         self.service = service
+        self.tenant = tenant
+    
+    def _to(self, user_id: str) -> str:
+        # User ids are scoped to the tenant; the API wants the bare phone number
+        return self.tenant.unscope(user_id) if self.tenant else user_id
+    
+    async def _wait_for_budget(self) -> None:
+        if self.tenant:
+            await self.tenant.wait_for_send_budget()
     
     async def send_text(self, user_id: str, text: str) -> None:
-        await self.service.send_text_message(user_id, text)
+        await self._wait_for_budget()
+        await self.service.send_text_message(self._to(user_id), text)
     
     async def send_menu_buttons(self, user_id: str, text: str, buttons: List[Dict[str, str]]) -> None:
-        await self.service.send_interactive_buttons(user_id, text, buttons)
+        await self._wait_for_budget()
+        await self.service.send_interactive_buttons(self._to(user_id), text, buttons)
     
     async def send_menu_list(self, user_id: str, text: str, button_text: str, items: List[Dict[str, str]]) -> None:
         sections = [{"title": "Options", "rows": items}]
-        await self.service.send_interactive_list_message(user_id, text, button_text, sections)
+        await self._wait_for_budget()
+        await self.service.send_interactive_list_message(self._to(user_id), text, button_text, sections)
 
 
 class TelegramAdapter:
     """Adapter for Telegram messaging"""
     
-    def __init__(self, service: TelegramService):
+    def __init__(self, service: TelegramService, tenant: Optional[Tenant] = None):
         self.service = service
+        self.tenant = tenant
+    
+    def _chat_id(self, user_id: str) -> int:
+        # User ids are scoped to the tenant; the API wants the bare chat id
+        return int(self.tenant.unscope(user_id) if self.tenant else user_id)
+    
+    async def _wait_for_budget(self) -> None:
+        if self.tenant:
+            await self.tenant.wait_for_send_budget()
     
     async def send_text(self, user_id: str, text: str) -> None:
-        chat_id = int(user_id)
+        chat_id = self._chat_id(user_id)
+        await self._wait_for_budget()
         await self.service.send_text_message(chat_id, text)
     
     async def send_menu_buttons(self, user_id: str, text: str, buttons: List[Dict[str, str]]) -> None:
-        chat_id = int(user_id)
+        chat_id = self._chat_id(user_id)
         inline_keyboard = [[{"text": btn["title"], "callback_data": btn["id"]}] for btn in buttons]
+        await self._wait_for_budget()
         await self.service.send_inline_keyboard(chat_id, text, inline_keyboard)
     
     async def send_menu_list(self, user_id: str, text: str, button_text: str, items: List[Dict[str, str]]) -> None:
-        chat_id = int(user_id)
+        chat_id = self._chat_id(user_id)
         inline_keyboard = [[{"text": item["title"], "callback_data": item["id"]}] for item in items]
+        await self._wait_for_budget()
         await self.service.send_inline_keyboard(chat_id, text, inline_keyboard)
 
 
-def get_platform_adapter(platform: str, service: Any):
-    """Get the appropriate platform adapter"""
+def get_platform_adapter(platform: str, service: Any, tenant: Optional[Tenant] = None):
+    """Get the appropriate platform adapter (for a tenant's service, if given)"""
     if platform == "whatsapp":
-        return WhatsAppAdapter(service)
+        return WhatsAppAdapter(service, tenant)
     elif platform == "telegram":
-        return TelegramAdapter(service)
+        return TelegramAdapter(service, tenant)
     else:
         raise ValueError(f"Unsupported platform: {platform}")
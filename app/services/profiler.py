@@ -0,0 +1,190 @@
+"""
+Sampling profiler for Chatlingo AI
+
+Samples the running process from a background thread for a fixed time, using
+only the standard library: every thread's stack via sys._current_frames(), and
+the await chain of every asyncio task on the event loop. Nothing is
+instrumented, so the app runs at normal speed; the cost is one stack walk per
+thread and task per sample, on the sampler thread. Used by /admin/profile.
+
+Results are collapsed stacks ("frame;frame;frame count" per line), the input
+format of flamegraph.pl and speedscope, plus a summary of the time held by
+the MessageProcessor, llm_service and storage backend functions.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from types import CodeType, FrameType
+from typing import Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Functions of these modules get their own summary ("which of our functions hold the time")
+FOCUS_MODULES = (
+    "app.services.message_processor",
+    "app.services.llm_service",
+    "app.services.storage",
+    "app.services.supabase_service",
+    "app.services.sqlite_service",
+)
+
+_MAX_DEPTH = 64
+
+
+class ProfilerBusyError(RuntimeError):
+    """Another profile is already running in this process"""
+
+
+@dataclass
+class ProfileResult:
+    seconds: float
+    interval_ms: float
+    samples: int = 0
+    threads: Counter = field(default_factory=Counter)  # Collapsed thread stacks -> samples
+    tasks: Counter = field(default_factory=Counter)  # Collapsed task await chains -> samples
+    focus: Counter = field(default_factory=Counter)  # Focus function -> samples it was on a stack
+
+    def collapsed(self, view: str = "threads") -> str:
+        stacks = self.tasks if view == "tasks" else self.threads
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def to_dict(self, top: int = 50) -> dict:
+        per_sample_ms = self.interval_ms if self.samples else 0.0
+        return {
+            "seconds": round(self.seconds, 2),
+            "interval_ms": self.interval_ms,
+            "samples": self.samples,
+            # A function is counted once per sample and thread/task it appears in, so shares can add up to over 100%
+            "focus": [
+                {"function": name, "samples": count, "approx_ms": round(count * per_sample_ms, 1),
+                 "share": round(count / self.samples, 3) if self.samples else 0.0}
+                for name, count in self.focus.most_common(top)
+            ],
+            "threads": [{"stack": s, "samples": c} for s, c in self.threads.most_common(top)],
+            "tasks": [{"stack": s, "samples": c} for s, c in self.tasks.most_common(top)],
+        }
+
+
+class SamplingProfiler:
+    """Time-boxed stack sampler; one profile at a time per process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._labels: Dict[CodeType, str] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def _label(self, code: CodeType, module: Optional[str]) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{module or code.co_filename}:{getattr(code, 'co_qualname', code.co_name)}"
+            self._labels[code] = label
+        return label
+
+    def _frames(self, frame: Optional[FrameType]) -> List[str]:
+        """Labels from the innermost frame outwards"""
+        labels = []
+        while frame is not None and len(labels) < _MAX_DEPTH:
+            labels.append(self._label(frame.f_code, frame.f_globals.get("__name__")))
+            frame = frame.f_back
+        return labels
+
+    def _await_chain(self, coro: object) -> List[str]:
+        """Labels of a suspended coroutine and everything it is awaiting, outermost first"""
+        labels = []
+        while coro is not None and len(labels) < _MAX_DEPTH:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+            if frame is None:
+                # A future, or a coroutine that finished; name what is being waited on
+                if labels:
+                    labels.append(f"<{type(coro).__name__.replace('FutureIter', 'Future')}>")
+                break
+            labels.append(self._label(frame.f_code, frame.f_globals.get("__name__")))
+            coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+        return labels
+
+    def _count_focus(self, labels: List[str], result: ProfileResult) -> None:
+        for label in set(labels):
+            if label.startswith(FOCUS_MODULES):
+                result.focus[label] += 1
+
+    def _sample(self, loop: Optional[asyncio.AbstractEventLoop], result: ProfileResult) -> None:
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            labels = self._frames(frame)
+            self._count_focus(labels, result)
+            result.threads[";".join([f"thread:{names.get(ident, ident)}", *reversed(labels)])] += 1
+
+        if loop is None:
+            return
+        try:
+            tasks = asyncio.all_tasks(loop)
+        except RuntimeError:
+            return  # The task set changed under us too many times; skip this sample's task view
+        for task in tasks:
+            # The running task's frames also show up on the loop thread's stack
+            labels = self._await_chain(task.get_coro())
+            if not labels:
+                continue
+            self._count_focus(labels, result)
+            result.tasks[";".join(["task", *labels])] += 1
+
+    def _run(self, loop: Optional[asyncio.AbstractEventLoop], result: ProfileResult) -> None:
+        interval = result.interval_ms / 1000
+        started = time.perf_counter()
+        deadline = started + result.seconds
+        next_at = started
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            self._sample(loop, result)
+            result.samples += 1
+            # Fixed-rate schedule; if a sample overruns, skip ahead instead of bursting
+            next_at = max(next_at + interval, time.perf_counter())
+            time.sleep(max(next_at - time.perf_counter(), 0))
+        result.seconds = time.perf_counter() - started
+
+    async def profile(self, seconds: float, interval_ms: Optional[float] = None) -> ProfileResult:
+        """Sample this process for `seconds` without blocking the event loop"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already running")
+        seconds = min(max(seconds, 0.1), settings.profiler_max_seconds)
+        interval_ms = max(interval_ms or settings.profiler_interval_ms, 1.0)
+        result = ProfileResult(seconds=seconds, interval_ms=interval_ms)
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def sampler():
+            # The lock is held until sampling stops, even if the request awaiting it is cancelled
+            try:
+                self._run(loop, result)
+            finally:
+                self._lock.release()
+                loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+
+        logger.info(f"[PROFILE] Sampling for {seconds}s every {interval_ms}ms")
+        try:
+            threading.Thread(target=sampler, name="sampling-profiler", daemon=True).start()
+        except Exception:
+            self._lock.release()
+            raise
+        await done
+        logger.info(f"[PROFILE] ✅ {result.samples} samples in {result.seconds:.1f}s")
+        return result
+
+
+# Global instance
+profiler = SamplingProfiler()
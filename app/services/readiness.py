@@ -0,0 +1,132 @@
+"""
+Readiness probes for Chatlingo AI
+
+Background probes check each dependency (storage, LLM provider, Telegram,
+shared state, job queue) at a fixed interval and cache the result, so /ready
+answers from memory and never adds load to a dependency per request.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from app.config import settings
+from app.services import storage
+from app.services.job_queue import job_queue
+from app.services.llm_service import llm_service
+from app.services.shared_state import shared_state
+from app.services.sharding import shard_supervisor
+from app.services.tenants import tenant_registry
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProbeResult:
+    status: str = "unknown"  # "ok", "fail" or "unknown" (not probed yet)
+    consecutive_failures: int = 0
+    checked_at: Optional[float] = None
+    error: Optional[str] = None
+    latencies_ms: Deque[float] = field(default_factory=lambda: deque(maxlen=10))
+
+    def to_dict(self) -> dict:
+        latencies = list(self.latencies_ms)
+        return {
+            "status": self.status,
+            "latency_ms": latencies[-1] if latencies else None,
+            "avg_latency_ms": round(sum(latencies) / len(latencies), 1) if latencies else None,
+            "consecutive_failures": self.consecutive_failures,
+            "checked_seconds_ago": round(time.time() - self.checked_at, 1) if self.checked_at else None,
+            "error": self.error,
+        }
+
+
+@dataclass
+class DependencyProbe:
+    name: str
+    check: Callable[[], Awaitable[object]]
+    critical: bool = True
+    result: ProbeResult = field(default_factory=ProbeResult)
+
+    @property
+    def healthy(self) -> bool:
+        # A single failed probe is tolerated so one slow response does not pull the instance
+        if self.result.status == "unknown":
+            return False
+        return self.result.consecutive_failures < settings.readiness_failure_threshold
+
+
+class ReadinessMonitor:
+    """Runs dependency probes in the background and caches their results"""
+
+    def __init__(self, probes: List[DependencyProbe]):
+        self.probes = probes
+        self._task: Optional[asyncio.Task] = None
+
+    async def _probe(self, probe: DependencyProbe) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(probe.check(), timeout=settings.readiness_probe_timeout_seconds)
+            probe.result.status = "ok"
+            probe.result.consecutive_failures = 0
+            probe.result.error = None
+        except Exception as e:
+            probe.result.status = "fail"
+            probe.result.consecutive_failures += 1
+            probe.result.error = repr(e) if not isinstance(e, asyncio.TimeoutError) else "timeout"
+            logger.warning(f"[READY] ⚠️ Probe {probe.name} failed ({probe.result.consecutive_failures}x): {probe.result.error}")
+        probe.result.latencies_ms.append(round((time.perf_counter() - started) * 1000, 1))
+        probe.result.checked_at = time.time()
+
+    async def probe_all(self) -> None:
+        await asyncio.gather(*(self._probe(p) for p in self.probes))
+
+    async def _loop(self) -> None:
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(settings.readiness_probe_interval_seconds)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def status(self) -> Dict[str, object]:
+        """Cached readiness: not ready while any critical dependency is unhealthy"""
+        failing = [p.name for p in self.probes if p.critical and not p.healthy]
+        return {
+            "ready": not failing,
+            "failing": failing,
+            "dependencies": {
+                p.name: {**p.result.to_dict(), "critical": p.critical} for p in self.probes
+            },
+        }
+
+
+def _default_probes() -> List[DependencyProbe]:
+    probes = [
+        DependencyProbe("storage", storage.ping),
+        DependencyProbe("llm", llm_service.ping),
+    ]
+    for tenant in tenant_registry.all():
+        if tenant.telegram:
+            name = "telegram" if tenant.is_default else f"telegram:{tenant.id}"
+            probes.append(DependencyProbe(name, tenant.telegram.get_me))
+    if settings.shared_state_backend == "redis":
+        probes.append(DependencyProbe("shared_state", shared_state.ping))
+    if settings.job_queue_enabled:
+        probes.append(DependencyProbe("job_queue", job_queue.stats))
+    if shard_supervisor.enabled:
+        probes.append(DependencyProbe("shards", shard_supervisor.check))
+    return probes
+
+
+# Global instance
+readiness = ReadinessMonitor(_default_probes())
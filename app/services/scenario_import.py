@@ -0,0 +1,120 @@
+"""
+Scenario import for Chatlingo AI
+
+Loads scenario definitions from a directory of YAML/JSON files, validates them
+against ScenarioSchema, diffs them against the scenarios table and applies the
+added and changed ones as batched upserts. Importing the same files twice
+changes nothing.
+"""
+
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from pydantic import ValidationError
+
+from app.schemas import ScenarioSchema
+from app.services import storage
+
+logger = logging.getLogger(__name__)
+
+SCENARIO_FILE_EXTENSIONS = (".yaml", ".yml", ".json")
+
+
+@dataclass
+class ScenarioDiff:
+    added: List[ScenarioSchema] = field(default_factory=list)
+    changed: List[Tuple[ScenarioSchema, ScenarioSchema]] = field(default_factory=list)  # (current, new)
+    unchanged: List[ScenarioSchema] = field(default_factory=list)
+    not_in_files: List[ScenarioSchema] = field(default_factory=list)  # Left in place, never deleted
+
+    @property
+    def to_apply(self) -> List[ScenarioSchema]:
+        return self.added + [new for _, new in self.changed]
+
+
+def _parse_file(path: str) -> object:
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("PyYAML is required for YAML scenario files (pip install pyyaml)")
+        return yaml.safe_load(f)
+
+
+def load_definitions(directory: str) -> Tuple[List[ScenarioSchema], List[str]]:
+    """
+    Read every scenario file in `directory`. Each file holds one scenario or a list of them.
+
+    Returns (scenarios, errors); any error means nothing should be applied.
+    """
+    scenarios: Dict[int, ScenarioSchema] = {}
+    sources: Dict[int, str] = {}
+    errors: List[str] = []
+
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(SCENARIO_FILE_EXTENSIONS)
+    )
+    for path in paths:
+        name = os.path.basename(path)
+        try:
+            data = _parse_file(path)
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+            continue
+
+        entries = data if isinstance(data, list) else [data]
+        for index, entry in enumerate(entries):
+            where = f"{name}[{index}]" if isinstance(data, list) else name
+            try:
+                scenario = ScenarioSchema.model_validate(entry)
+            except ValidationError as e:
+                details = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'entry'}: {err['msg']}" for err in e.errors())
+                errors.append(f"{where}: {details}")
+                continue
+            if scenario.id in scenarios:
+                errors.append(f"{where}: duplicate id {scenario.id} (also in {sources[scenario.id]})")
+                continue
+            scenarios[scenario.id] = scenario
+            sources[scenario.id] = where
+
+    if not paths:
+        errors.append(f"No {'/'.join(SCENARIO_FILE_EXTENSIONS)} files in {directory}")
+    return sorted(scenarios.values(), key=lambda s: s.id), errors
+
+
+def diff_scenarios(definitions: List[ScenarioSchema], existing: List[ScenarioSchema]) -> ScenarioDiff:
+    current = {s.id: s for s in existing}
+    diff = ScenarioDiff()
+    for scenario in definitions:
+        old = current.pop(scenario.id, None)
+        if old is None:
+            diff.added.append(scenario)
+        elif old != scenario:
+            diff.changed.append((old, scenario))
+        else:
+            diff.unchanged.append(scenario)
+    diff.not_in_files = sorted(current.values(), key=lambda s: s.id)
+    return diff
+
+
+async def plan_import(directory: str) -> Tuple[ScenarioDiff, List[str]]:
+    """Validate the files and diff them against the scenarios table (read fresh, not from the cache)"""
+    definitions, errors = load_definitions(directory)
+    storage.invalidate_scenario_cache()
+    existing = await storage.get_all_scenarios()
+    return diff_scenarios(definitions, existing), errors
+
+
+async def apply_import(diff: ScenarioDiff, batch_size: int = 500) -> int:
+    """Upsert added and changed scenarios; running workers reload their scenario cache. Returns the count."""
+    scenarios = diff.to_apply
+    if scenarios:
+        await storage.upsert_scenarios(scenarios, batch_size=batch_size)
+        logger.info(f"[SCENARIOS] ✅ Imported {len(diff.added)} new and {len(diff.changed)} changed scenarios")
+    return len(scenarios)
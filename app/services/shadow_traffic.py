@@ -0,0 +1,72 @@
+"""
+Shadow traffic for Chatlingo AI
+
+Replays a sample of live LLM calls on a candidate provider, model or prompt
+set (SHADOW_* settings) after the real reply is returned, and appends the
+paired results (latency, tokens and both replies) to SHADOW_RESULTS_PATH for
+offline comparison. Shadow calls run as background tasks capped at
+SHADOW_MAX_CONCURRENCY; a sampled call is skipped rather than queued when the
+cap is reached, so the shadow never delays or competes with the user's turn.
+Shadow calls are not charged to the user's token budget.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import threading
+from typing import Any, Awaitable, Callable, Dict, Set
+
+from app.config import settings
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowTraffic:
+    """Sampling, concurrency cap and result log for shadow LLM calls"""
+
+    def __init__(self):
+        self._tasks: Set[asyncio.Task] = set()
+        self._write_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.shadow_sample_rate > 0
+
+    def sample(self) -> bool:
+        return self.enabled and random.random() < settings.shadow_sample_rate
+
+    def submit(self, make_call: Callable[[], Awaitable[None]]) -> bool:
+        """Start a shadow call in the background unless the concurrency cap is reached"""
+        if len(self._tasks) >= settings.shadow_max_concurrency:
+            metrics.inc("llm_shadow_skipped")
+            return False
+        task = asyncio.create_task(make_call())
+        self._tasks.add(task)
+        task.add_done_callback(self._on_done)
+        return True
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"[SHADOW] ⚠️ Shadow call failed: {task.exception()!r}")
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        with self._write_lock, open(settings.shadow_results_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    async def record(self, entry: Dict[str, Any]) -> None:
+        """Append one paired result, off the event loop"""
+        await asyncio.to_thread(self._append, entry)
+
+    async def close(self) -> None:
+        """Cancel shadow calls still running; they are best-effort"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Global instance
+shadow_traffic = ShadowTraffic()
@@ -0,0 +1,222 @@
+"""
+Sharded worker processes for Chatlingo AI
+
+With SHARD_WORKERS=N the web process only acks webhooks. Each job is persisted
+on the job queue tagged with a stable hash of the user id, and N worker
+processes each run MessageProcessor for the users of one shard. A user's
+messages always reach the same process, so per-user ordering, locks and caches
+(user cache, conversation buffer) stay local to it and throughput scales with
+cores. The supervisor wakes a shard over a local IPC queue when it has new
+work and respawns worker processes that exit.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+from app.services.job_queue import job_queue
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_CHECK_INTERVAL_SECONDS = 1.0
+
+# A shard that keeps crashing soon after start is respawned with a doubling delay
+_RESPAWN_MAX_DELAY_SECONDS = 30.0
+_STABLE_AFTER_SECONDS = 60.0
+
+
+def shard_key(user_id: Optional[str]) -> int:
+    """Stable across processes and restarts, unlike hash(), which is salted per process"""
+    return zlib.crc32(str(user_id or "").encode("utf-8"))
+
+
+def _worker_id(index: int, pid: int) -> str:
+    return f"shard{index}-{pid}"
+
+
+# --- Worker process side ---
+
+def _wake_listener(wake_queue: Any, loop: asyncio.AbstractEventLoop) -> None:
+    """Forward wake-ups from the web process to the job workers of this process"""
+    while True:
+        wake_queue.get()
+        loop.call_soon_threadsafe(lambda: job_queue.notify.set())
+
+
+async def _serve_shard(index: int, count: int, wake_queue: Any) -> None:
+    # Imported here: the web process imports this module while app.main is still loading
+    from app.main import _prewarm, _close_clients
+    from app.services.job_queue import JobWorkerPool
+    from app.services.loop_monitor import loop_monitor
+    from app.services.message_processor import JOB_HANDLERS
+    from app.services.token_accounting import token_accountant
+
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    loop_monitor.start()
+
+    if settings.prewarm_on_startup:
+        await _prewarm()
+    pool = JobWorkerPool(job_queue, JOB_HANDLERS, settings.job_workers,
+                         shard=(index, count), worker_id=_worker_id(index, os.getpid()))
+    pool.start()
+    token_accountant.start()
+    threading.Thread(target=_wake_listener, args=(wake_queue, loop), name="shard-wake", daemon=True).start()
+    logger.info(f"[SHARD] ✅ Shard {index}/{count} ready (pid {os.getpid()})")
+
+    await stopping.wait()
+
+    logger.info(f"[SHARD] Shard {index} shutting down")
+    await pool.stop(settings.shutdown_drain_timeout_seconds)
+    await token_accountant.stop()
+    await _close_clients()
+    await loop_monitor.stop()
+
+
+def run_shard_worker(index: int, count: int, wake_queue: Any) -> None:
+    """Entry point of a shard worker process"""
+    # Ctrl+C reaches the whole process group; the supervisor stops workers with SIGTERM instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from app.logging_config import shutdown_logging
+    try:
+        asyncio.run(_serve_shard(index, count, wake_queue))
+    finally:
+        job_queue.close()
+        shutdown_logging()
+
+
+# --- Web process side ---
+
+class ShardSupervisor:
+    """Starts the shard worker processes, routes jobs to them and respawns them when they exit"""
+
+    def __init__(self, count: int):
+        self.count = count
+        self.restarts = 0
+        self._ctx = multiprocessing.get_context("spawn")
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * count
+        self._wake_queues: List[Any] = []
+        self._started_at = [0.0] * count
+        self._crashes = [0] * count
+        self._respawn_at = [0.0] * count
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.count > 0
+
+    def shard_for(self, user_id: Optional[str]) -> int:
+        return shard_key(user_id) % self.count
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any], user_id: Optional[str], delay: float = 0.0,
+                      dedup_key: Optional[str] = None) -> int:
+        """Persist a job for this user, and wake the user's shard if it is due now"""
+        key = shard_key(user_id)
+        job_id = await job_queue.enqueue(kind, payload, delay=delay, shard_key=key, dedup_key=dedup_key)
+        if self.enabled and not delay:
+            # Delayed jobs are found by the workers' regular poll
+            self._wake_queues[key % self.count].put_nowait(1)
+        return job_id
+
+    def _spawn(self, index: int) -> None:
+        process = self._ctx.Process(
+            target=run_shard_worker,
+            args=(index, self.count, self._wake_queues[index]),
+            name=f"chatlingo-shard-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info(f"[SHARD] Started shard {index} (pid {process.pid})")
+
+    async def _on_exit(self, index: int, process: multiprocessing.Process) -> None:
+        uptime = time.monotonic() - self._started_at[index]
+        self._crashes[index] = 1 if uptime >= _STABLE_AFTER_SECONDS else self._crashes[index] + 1
+        delay = min(2 ** (self._crashes[index] - 1), _RESPAWN_MAX_DELAY_SECONDS)
+        self._respawn_at[index] = time.monotonic() + delay
+        self._processes[index] = None
+        self.restarts += 1
+        metrics.inc("shard_restarts", shard=str(index))
+        logger.error(f"[SHARD] ❌ Shard {index} (pid {process.pid}) exited with code {process.exitcode} "
+                     f"after {uptime:.0f}s, respawning in {delay:.0f}s")
+
+        # Its claimed jobs would otherwise stay hidden until the visibility timeout
+        try:
+            released = await job_queue.release_claimed(_worker_id(index, process.pid))
+            if released:
+                logger.warning(f"[SHARD] ⚠️ Released {released} jobs held by shard {index}")
+        except Exception as e:
+            logger.error(f"[SHARD] ❌ Failed to release jobs of shard {index}: {e}")
+        process.close()
+
+    async def _monitor(self) -> None:
+        while True:
+            await asyncio.sleep(_CHECK_INTERVAL_SECONDS)
+            for index, process in enumerate(self._processes):
+                if process is not None and process.exitcode is None:
+                    continue
+                if process is not None:
+                    await self._on_exit(index, process)
+                if time.monotonic() >= self._respawn_at[index]:
+                    self._spawn(index)
+
+    def start(self) -> None:
+        self._wake_queues = [self._ctx.Queue() for _ in range(self.count)]
+        for index in range(self.count):
+            self._spawn(index)
+        self._task = asyncio.create_task(self._monitor())
+        logger.info(f"[SHARD] Started {self.count} shard workers")
+
+    async def stop(self, timeout: float) -> None:
+        """SIGTERM every shard (each drains its jobs within `timeout`), then kill stragglers"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        alive = [(i, p) for i, p in enumerate(self._processes) if p is not None and p.exitcode is None]
+        for _, process in alive:
+            process.terminate()
+        # Allow for closing clients after the drain deadline
+        deadline = time.monotonic() + timeout + 5.0
+        for index, process in alive:
+            await asyncio.to_thread(process.join, max(deadline - time.monotonic(), 0.0))
+            if process.exitcode is None:
+                logger.warning(f"[SHARD] ⚠️ Killing shard {index} (pid {process.pid}) after drain deadline")
+                process.kill()
+                await asyncio.to_thread(process.join)
+                await job_queue.release_claimed(_worker_id(index, process.pid))
+
+        for wake_queue in self._wake_queues:
+            wake_queue.close()
+        self._processes = [None] * self.count
+        logger.info("[SHARD] ✅ Shard workers stopped")
+
+    async def check(self) -> None:
+        """Readiness probe: fails while any shard process is down"""
+        down = [str(i) for i, p in enumerate(self._processes) if p is None or p.exitcode is not None]
+        if down:
+            raise RuntimeError(f"shards down: {', '.join(down)}")
+
+    def status(self) -> dict:
+        return {
+            "shards": self.count,
+            "alive": sum(1 for p in self._processes if p is not None and p.exitcode is None),
+            "restarts": self.restarts,
+        }
+
+
+# Global instance (sharding needs the durable job queue to hand work to the worker processes)
+if settings.shard_workers and not settings.job_queue_enabled:
+    logger.warning("[SHARD] ⚠️ SHARD_WORKERS needs JOB_QUEUE_ENABLED=true; running unsharded")
+shard_supervisor = ShardSupervisor(settings.shard_workers if settings.job_queue_enabled else 0)
@@ -0,0 +1,274 @@
+"""
+Shared session state for Chatlingo AI
+
+Cross-worker state used to keep multiple uvicorn workers and nodes consistent:
+cached user state, webhook dedup keys, per-user locks and rate-limit counters.
+Backed by a Redis-protocol store in production, or process memory for tests
+and single-worker runs.
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LockTimeout(Exception):
+    """Raised when a per-user lock could not be acquired in time"""
+
+
+class BaseSharedState(ABC):
+    """Abstract base class for shared state stores"""
+
+    @abstractmethod
+    async def get_json(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    async def set_json(self, key: str, value: Any, ttl: int) -> None:
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    async def add_if_absent(self, key: str, ttl: int) -> bool:
+        """Set key if it does not exist. Returns True if it was set (i.e. first time seen)."""
+        pass
+
+    @abstractmethod
+    async def incr(self, key: str, ttl: int, amount: int = 1) -> int:
+        """Increment a counter by `amount`; it expires `ttl` seconds after its first increment"""
+        pass
+
+    @abstractmethod
+    async def acquire_lock(self, key: str, ttl: int) -> Optional[str]:
+        """Try once to take a lock. Returns an owner token, or None if it is held."""
+        pass
+
+    @abstractmethod
+    async def release_lock(self, key: str, token: str) -> None:
+        pass
+
+    @abstractmethod
+    async def extend_lock(self, key: str, token: str, ttl: int) -> bool:
+        """Reset a held lock's expiry to `ttl`. Returns False if we no longer own it."""
+        pass
+
+    async def ping(self) -> None:
+        """Check the store is reachable (raises on failure)"""
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def claim_delivery(self, key: str) -> bool:
+        """
+        Claim a webhook/message key; False if it was already seen (or is being accepted elsewhere).
+
+        The claim is short-lived until confirm_delivery, so a delivery that was never persisted
+        (the process died, or release_delivery could not run) is processed when it is redelivered.
+        """
+        return await self.add_if_absent(f"dedup:{key}", settings.dedup_pending_ttl_seconds)
+
+    async def confirm_delivery(self, key: str) -> None:
+        """The delivery was persisted: remember its key for the whole dedup window"""
+        await self.set_json(f"dedup:{key}", True, settings.dedup_ttl_seconds)
+
+    async def release_delivery(self, key: str) -> None:
+        """The delivery could not be persisted: let its redelivery through"""
+        await self.delete(f"dedup:{key}")
+
+    async def is_rate_limited(self, user_id: str, limit: Optional[int] = None) -> bool:
+        """Fixed one-minute window per user; `limit` defaults to RATE_LIMIT_PER_MINUTE, 0 disables"""
+        limit = settings.rate_limit_per_minute if limit is None else limit
+        if limit <= 0:
+            return False
+        window = int(time.time() // 60)
+        count = await self.incr(f"ratelimit:{user_id}:{window}", 60)
+        return count > limit
+
+    @asynccontextmanager
+    async def user_lock(self, user_id: str) -> AsyncIterator[None]:
+        """Serialize processing for one user across all workers"""
+        key = f"lock:user:{user_id}"
+        deadline = time.monotonic() + settings.user_lock_wait_seconds
+        delay = 0.02
+        token = await self.acquire_lock(key, settings.user_lock_ttl_seconds)
+        while token is None:
+            if time.monotonic() >= deadline:
+                raise LockTimeout(f"Timed out waiting for lock on user {user_id}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            token = await self.acquire_lock(key, settings.user_lock_ttl_seconds)
+        renewer = asyncio.create_task(self._renew_lock(key, token, user_id))
+        try:
+            yield
+        finally:
+            renewer.cancel()
+            await asyncio.gather(renewer, return_exceptions=True)
+            await self.release_lock(key, token)
+
+    async def _renew_lock(self, key: str, token: str, user_id: str) -> None:
+        """Keep a lock alive while its turn runs, so a slow turn is not joined by a second worker"""
+        ttl = settings.user_lock_ttl_seconds
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                if not await self.extend_lock(key, token, ttl):
+                    logger.warning(f"[STATE] ⚠️ Lost the lock on user {user_id} during a turn")
+                    return
+            except Exception as e:
+                logger.warning(f"[STATE] ⚠️ Could not extend the lock on user {user_id}: {e}")
+
+
+class InMemorySharedState(BaseSharedState):
+    """Process-local implementation for tests and single-worker deployments"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[Any, float]] = {}
+
+    def _get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def _set(self, key: str, value: Any, ttl: int) -> None:
+        self._data[key] = (value, time.monotonic() + ttl)
+        # Opportunistic cleanup keeps expired dedup/counter keys from piling up
+        if len(self._data) > 10000:
+            now = time.monotonic()
+            for k in [k for k, (_, exp) in self._data.items() if exp <= now]:
+                del self._data[k]
+
+    async def get_json(self, key: str) -> Optional[Any]:
+        return self._get(key)
+
+    async def set_json(self, key: str, value: Any, ttl: int) -> None:
+        self._set(key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    async def add_if_absent(self, key: str, ttl: int) -> bool:
+        if self._get(key) is not None:
+            return False
+        self._set(key, True, ttl)
+        return True
+
+    async def incr(self, key: str, ttl: int, amount: int = 1) -> int:
+        item = self._data.get(key)
+        if item is None or item[1] <= time.monotonic():
+            self._set(key, amount, ttl)
+            return amount
+        count = item[0] + amount
+        self._data[key] = (count, item[1])
+        return count
+
+    async def acquire_lock(self, key: str, ttl: int) -> Optional[str]:
+        if self._get(key) is not None:
+            return None
+        token = uuid.uuid4().hex
+        self._set(key, token, ttl)
+        return token
+
+    async def release_lock(self, key: str, token: str) -> None:
+        if self._get(key) == token:
+            del self._data[key]
+
+    async def extend_lock(self, key: str, token: str, ttl: int) -> bool:
+        if self._get(key) != token:
+            return False
+        self._set(key, token, ttl)
+        return True
+
+
+# Delete the lock only if we still own it (it may have expired and been re-taken)
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Reset the lock's expiry only if we still own it
+_EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class RedisSharedState(BaseSharedState):
+    """Redis-protocol implementation shared by all workers and nodes"""
+
+    def __init__(self):
+        import redis.asyncio as redis  # Optional dependency, only needed for this backend
+        self.client = redis.from_url(settings.redis_url, decode_responses=True)
+        self._release = self.client.register_script(_RELEASE_SCRIPT)
+        self._extend = self.client.register_script(_EXTEND_SCRIPT)
+        logger.info("[STATE] Using Redis shared state")
+
+    async def get_json(self, key: str) -> Optional[Any]:
+        raw = await self.client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set_json(self, key: str, value: Any, ttl: int) -> None:
+        await self.client.set(key, json.dumps(value, default=str), ex=ttl)
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(key)
+
+    async def add_if_absent(self, key: str, ttl: int) -> bool:
+        return bool(await self.client.set(key, 1, nx=True, ex=ttl))
+
+    async def incr(self, key: str, ttl: int, amount: int = 1) -> int:
+        # SET NX starts the window with its expiry (EXPIRE NX would need Redis 7)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.set(key, 0, ex=ttl, nx=True)
+            pipe.incrby(key, amount)
+            _, count = await pipe.execute()
+        return count
+
+    async def acquire_lock(self, key: str, ttl: int) -> Optional[str]:
+        token = uuid.uuid4().hex
+        if await self.client.set(key, token, nx=True, ex=ttl):
+            return token
+        return None
+
+    async def release_lock(self, key: str, token: str) -> None:
+        await self._release(keys=[key], args=[token])
+
+    async def extend_lock(self, key: str, token: str, ttl: int) -> bool:
+        return bool(await self._extend(keys=[key], args=[token, ttl]))
+
+    async def ping(self) -> None:
+        await self.client.ping()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def _create_shared_state() -> BaseSharedState:
+    if settings.shared_state_backend == "redis":
+        return RedisSharedState()
+    return InMemorySharedState()
+
+
+# Global instance
+shared_state = _create_shared_state()
@@ -0,0 +1,763 @@
+"""
+Embedded SQLite storage backend for Chatlingo AI
+
+Implements the same operations as supabase_service on a local SQLite file,
+for single-node deployments and CI. The database runs in WAL mode and every
+query executes on one dedicated thread that owns the connection.
+Returns Pydantic models from app.schemas.
+"""
+
+import functools
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional
+
+from app.config import settings
+from app.schemas import (
+    UserSchema,
+    ScenarioSchema,
+    ChatMessageSchema,
+    UserProgressSchema,
+    TurnContextSchema,
+    TokenUsageSchema,
+    LearnerStatsSchema,
+    LearnerScenarioStatsSchema,
+    SosMissSchema
+)
+
+logger = logging.getLogger(__name__)
+
+# Mirrors schema.sql, translated to SQLite types
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    phone_number TEXT PRIMARY KEY,
+    name TEXT,
+    current_mode TEXT DEFAULT 'menu',
+    current_scenario_id INTEGER,
+    current_session_id TEXT,
+    tier TEXT DEFAULT 'free',
+    joined_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS scenarios (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    bot_persona TEXT NOT NULL,
+    situation_seed TEXT NOT NULL,
+    opening_line TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS chat_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phone_number TEXT NOT NULL REFERENCES users(phone_number),
+    role TEXT NOT NULL,
+    mode TEXT,
+    scenario_id INTEGER REFERENCES scenarios(id),
+    session_id TEXT,
+    content TEXT NOT NULL,
+    created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS user_progress (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phone_number TEXT NOT NULL REFERENCES users(phone_number),
+    scenario_id INTEGER NOT NULL REFERENCES scenarios(id),
+    status TEXT DEFAULT 'completed',
+    completed_at TEXT,
+    UNIQUE(phone_number, scenario_id)
+);
+
+CREATE TABLE IF NOT EXISTS chat_history_archive (
+    id INTEGER PRIMARY KEY,
+    phone_number TEXT NOT NULL,
+    role TEXT NOT NULL,
+    mode TEXT,
+    scenario_id INTEGER,
+    session_id TEXT,
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    archived_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS token_usage (
+    phone_number TEXT NOT NULL,
+    day TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    calls INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (phone_number, day)
+);
+
+-- Learner progress, kept up to date by the triggers below as messages and completions are written
+CREATE TABLE IF NOT EXISTS learner_stats (
+    phone_number TEXT PRIMARY KEY,
+    turns INTEGER NOT NULL DEFAULT 0,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    completions INTEGER NOT NULL DEFAULT 0,
+    first_active_at TEXT,
+    last_active_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS learner_scenario_stats (
+    phone_number TEXT NOT NULL,
+    scenario_id INTEGER NOT NULL,
+    turns INTEGER NOT NULL DEFAULT 0,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    completions INTEGER NOT NULL DEFAULT 0,
+    last_active_at TEXT,
+    PRIMARY KEY (phone_number, scenario_id)
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_learner_stats_message AFTER INSERT ON chat_history
+BEGIN
+    INSERT INTO learner_stats (phone_number, turns, sessions, first_active_at, last_active_at)
+    SELECT NEW.phone_number, NEW.role = 'user',
+           NEW.session_id IS NOT NULL AND NOT EXISTS (
+               SELECT 1 FROM chat_history WHERE phone_number = NEW.phone_number
+               AND session_id = NEW.session_id AND id <> NEW.id),
+           NEW.created_at, NEW.created_at
+    WHERE true
+    ON CONFLICT(phone_number) DO UPDATE SET
+        turns = turns + excluded.turns,
+        sessions = sessions + excluded.sessions,
+        last_active_at = MAX(COALESCE(last_active_at, ''), excluded.last_active_at);
+
+    INSERT INTO learner_scenario_stats (phone_number, scenario_id, turns, sessions, last_active_at)
+    SELECT NEW.phone_number, NEW.scenario_id, NEW.role = 'user',
+           NEW.session_id IS NOT NULL AND NOT EXISTS (
+               SELECT 1 FROM chat_history WHERE phone_number = NEW.phone_number
+               AND session_id = NEW.session_id AND id <> NEW.id),
+           NEW.created_at
+    WHERE NEW.scenario_id IS NOT NULL
+    ON CONFLICT(phone_number, scenario_id) DO UPDATE SET
+        turns = turns + excluded.turns,
+        sessions = sessions + excluded.sessions,
+        last_active_at = MAX(COALESCE(last_active_at, ''), excluded.last_active_at);
+END;
+
+-- A completion is a scenario completed for the first time (one user_progress row each, as in the backfill).
+-- Dropped and recreated so existing databases pick up changes (the recompletion trigger counted repeats).
+DROP TRIGGER IF EXISTS trg_learner_stats_recompletion;
+DROP TRIGGER IF EXISTS trg_learner_stats_completion;
+CREATE TRIGGER trg_learner_stats_completion AFTER INSERT ON user_progress
+WHEN NEW.status = 'completed'
+BEGIN
+    INSERT INTO learner_stats (phone_number, completions, first_active_at, last_active_at)
+    VALUES (NEW.phone_number, 1, NEW.completed_at, NEW.completed_at)
+    ON CONFLICT(phone_number) DO UPDATE SET
+        completions = completions + 1,
+        first_active_at = COALESCE(first_active_at, excluded.first_active_at),
+        last_active_at = MAX(COALESCE(last_active_at, ''), excluded.last_active_at);
+    INSERT INTO learner_scenario_stats (phone_number, scenario_id, completions, last_active_at)
+    VALUES (NEW.phone_number, NEW.scenario_id, 1, NEW.completed_at)
+    ON CONFLICT(phone_number, scenario_id) DO UPDATE SET
+        completions = completions + 1,
+        last_active_at = MAX(COALESCE(last_active_at, ''), excluded.last_active_at);
+END;
+
+DROP TRIGGER IF EXISTS trg_learner_stats_status;
+CREATE TRIGGER trg_learner_stats_status AFTER UPDATE OF status ON user_progress
+WHEN NEW.status = 'completed' AND OLD.status IS NOT 'completed'
+BEGIN
+    INSERT INTO learner_stats (phone_number, completions, first_active_at, last_active_at)
+    VALUES (NEW.phone_number, 1, NEW.completed_at, NEW.completed_at)
+    ON CONFLICT(phone_number) DO UPDATE SET
+        completions = completions + 1,
+        first_active_at = COALESCE(first_active_at, excluded.first_active_at),
+        last_active_at = MAX(COALESCE(last_active_at, ''), excluded.last_active_at);
+    INSERT INTO learner_scenario_stats (phone_number, scenario_id, completions, last_active_at)
+    VALUES (NEW.phone_number, NEW.scenario_id, 1, NEW.completed_at)
+    ON CONFLICT(phone_number, scenario_id) DO UPDATE SET
+        completions = completions + 1,
+        last_active_at = MAX(COALESCE(last_active_at, ''), excluded.last_active_at);
+END;
+
+CREATE TABLE IF NOT EXISTS sos_misses (
+    query TEXT PRIMARY KEY,
+    times_asked INTEGER NOT NULL DEFAULT 1,
+    first_asked_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    last_asked_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Inbound messages already saved, so a retried job neither saves nor answers them twice
+CREATE TABLE IF NOT EXISTS processed_turns (
+    turn_key TEXT PRIMARY KEY,
+    phone_number TEXT NOT NULL,
+    reply TEXT,
+    reply_sent_at TEXT,
+    created_at TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_history_lookup ON chat_history(phone_number, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_chat_history_session ON chat_history(phone_number, session_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_chat_history_export ON chat_history(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_chat_history_archive_session ON chat_history_archive(session_id);
+CREATE INDEX IF NOT EXISTS idx_token_usage_day ON token_usage(day);
+"""
+
+# Columns added after the first release; CREATE TABLE IF NOT EXISTS does not add them to existing files
+_ADDED_COLUMNS = [
+    ("users", "tier", "TEXT DEFAULT 'free'"),
+]
+
+SEED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "seed_scenarios.sql")
+
+_conn: Optional[sqlite3.Connection] = None
+_db_thread_id: Optional[int] = None
+
+
+def _init_connection() -> None:
+    """Open the connection on the DB thread, apply pragmas and create the schema."""
+    global _conn, _db_thread_id
+    _db_thread_id = threading.get_ident()
+    logger.info(f"[SQLITE] Opening database at {settings.sqlite_path}...")
+    try:
+        _conn = sqlite3.connect(settings.sqlite_path)
+        _conn.row_factory = sqlite3.Row
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute("PRAGMA foreign_keys=ON")
+        _conn.execute("PRAGMA busy_timeout=5000")
+        _conn.executescript(SCHEMA)
+        for table, column, definition in _ADDED_COLUMNS:
+            existing = {row["name"] for row in _conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                _conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+        # Seed default scenarios into a fresh database
+        if _conn.execute("SELECT COUNT(*) FROM scenarios").fetchone()[0] == 0 and os.path.exists(SEED_FILE):
+            with open(SEED_FILE, "r", encoding="utf-8") as f:
+                _conn.executescript(f.read())
+            logger.info("[SQLITE] Seeded scenarios from seed_scenarios.sql")
+
+        _conn.commit()
+        logger.info("[SQLITE] ✅ SQLite database ready")
+    except Exception as e:
+        logger.error(f"[SQLITE] ❌ Failed to open database: {e}", exc_info=True)
+        raise
+
+
+# Single worker: the connection is owned by this thread and writes are serialized
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-db", initializer=_init_connection)
+
+
+def _on_db_thread(func):
+    """Run the wrapped function on the DB thread, blocking the caller until it finishes."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if threading.get_ident() == _db_thread_id:
+            return func(*args, **kwargs)
+        return executor.submit(func, *args, **kwargs).result()
+    return wrapper
+
+
+@_on_db_thread
+def warmup() -> None:
+    """Start the DB thread, which opens the connection and creates the schema."""
+    _conn.execute("SELECT 1").fetchone()
+
+
+def close() -> None:
+    """Close the connection and stop the DB thread."""
+    if _db_thread_id is not None:
+        executor.submit(_conn.close).result()
+    executor.shutdown(wait=True)
+
+
+@_on_db_thread
+def get_or_create_user(phone: str) -> UserSchema:
+    """Get user by phone number, or create if doesn't exist."""
+    logger.info(f"[SQLITE] get_or_create_user: phone={phone}")
+    try:
+        row = _conn.execute("SELECT * FROM users WHERE phone_number = ?", (phone,)).fetchone()
+        if row:
+            user = UserSchema(**dict(row))
+            logger.info(f"[SQLITE] Found existing user: mode={user.current_mode}, scenario_id={user.current_scenario_id}")
+            return user
+
+        logger.info(f"[SQLITE] Creating new user: phone={phone}")
+        _conn.execute(
+            "INSERT INTO users (phone_number, current_mode, joined_at) VALUES (?, 'menu', ?)",
+            (phone, datetime.utcnow().isoformat())
+        )
+        _conn.commit()
+        row = _conn.execute("SELECT * FROM users WHERE phone_number = ?", (phone,)).fetchone()
+        return UserSchema(**dict(row))
+    except Exception as e:
+        _conn.rollback()
+        logger.error(f"[SQLITE] ❌ Error in get_or_create_user: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def update_user_mode(phone: str, mode: str, scenario_id: Optional[int] = None, session_id: Optional[str] = None) -> None:
+    """Update user's current mode and optionally scenario_id and session_id."""
+    logger.info(f"[SQLITE] update_user_mode: phone={phone}, mode={mode}, scenario_id={scenario_id}, session_id={session_id}")
+    try:
+        if session_id:
+            _conn.execute(
+                "UPDATE users SET current_mode = ?, current_scenario_id = ?, current_session_id = ? WHERE phone_number = ?",
+                (mode, scenario_id, session_id, phone)
+            )
+        else:
+            _conn.execute(
+                "UPDATE users SET current_mode = ?, current_scenario_id = ? WHERE phone_number = ?",
+                (mode, scenario_id, phone)
+            )
+        _conn.commit()
+        logger.info(f"[SQLITE] ✅ User mode updated")
+    except Exception as e:
+        _conn.rollback()
+        logger.error(f"[SQLITE] ❌ Error in update_user_mode: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def add_message(phone: str, role: str, content: str, mode: str = "menu", session_id: Optional[str] = None, scenario_id: Optional[int] = None) -> None:
+    """Add a message to chat history."""
+    try:
+        _conn.execute(
+            "INSERT INTO chat_history (phone_number, role, content, mode, session_id, scenario_id, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (phone, role, content, mode, session_id, scenario_id, datetime.utcnow().isoformat())
+        )
+        _conn.commit()
+        logger.info(f"[SQLITE] ✅ Message saved to chat_history")
+    except Exception as e:
+        _conn.rollback()
+        logger.error(f"[SQLITE] ❌ Error in add_message: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def get_recent_messages(phone: str, limit: int = 10, session_id: Optional[str] = None) -> List[ChatMessageSchema]:
+    """Get recent messages for a user in chronological order (oldest to newest)."""
+    try:
+        query = "SELECT phone_number, role, mode, scenario_id, content, created_at FROM chat_history WHERE phone_number = ?"
+        params: list = [phone]
+
+        if session_id:
+            query += " AND session_id = ?"
+            params.append(session_id)
+
+        query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit)
+
+        rows = _conn.execute(query, params).fetchall()
+        if not rows:
+            logger.info(f"[SQLITE] No messages found")
+            return []
+
+        messages = [ChatMessageSchema(**dict(row)) for row in rows]
+        messages.reverse()
+
+        logger.info(f"[SQLITE] ✅ Retrieved {len(messages)} messages")
+        return messages
+    except Exception as e:
+        logger.error(f"[SQLITE] ❌ Error in get_recent_messages: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def get_history_page(after_created_at: Optional[str], after_id: Optional[int], limit: int,
+                     since: Optional[str] = None, until: Optional[str] = None, phone: Optional[str] = None,
+                     scenario_id: Optional[int] = None, session_id: Optional[str] = None) -> List[ChatMessageSchema]:
+    """One page of chat history ordered by (created_at, id), starting after the given keyset cursor."""
+    try:
+        clauses, params = [], []
+        if after_created_at is not None:
+            clauses.append("(created_at, id) > (?, ?)")
+            params += [after_created_at, after_id]
+        for clause, value in (("created_at >= ?", since), ("created_at < ?", until), ("phone_number = ?", phone),
+                              ("scenario_id = ?", scenario_id), ("session_id = ?", session_id)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        rows = _conn.execute(
+            "SELECT id, phone_number, role, mode, scenario_id, session_id, content, created_at FROM chat_history "
+            f"{where}ORDER BY created_at, id LIMIT ?",
+            [*params, limit]
+        ).fetchall()
+        return [ChatMessageSchema(**dict(row)) for row in rows]
+    except Exception as e:
+        logger.error(f"[SQLITE] ❌ Error in get_history_page: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def begin_turn(phone: str, content: str, history_limit: int = 50, turn_key: Optional[str] = None) -> TurnContextSchema:
+    """
+    Upsert the user, save their message and return user state, scenario and history in one transaction.
+    
+    A turn_key seen before (a retried job) does not save the message again; the turn comes back
+    marked as replayed, with the reply saved for it, if any, and whether that was sent.
+    """
+    logger.info(f"[SQLITE] begin_turn: phone={phone}, history_limit={history_limit}")
+    try:
+        now = datetime.utcnow().isoformat()
+        _conn.execute(
+            "INSERT INTO users (phone_number, current_mode, joined_at) VALUES (?, 'menu', ?) "
+            "ON CONFLICT(phone_number) DO NOTHING",
+            (phone, now)
+        )
+        user = UserSchema(**dict(_conn.execute("SELECT * FROM users WHERE phone_number = ?", (phone,)).fetchone()))
+        
+        replayed, reply, reply_sent = False, None, False
+        if turn_key is not None:
+            replayed = _conn.execute(
+                "INSERT INTO processed_turns (turn_key, phone_number, created_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(turn_key) DO NOTHING",
+                (turn_key, phone, now)
+            ).rowcount == 0
+            if replayed:
+                row = _conn.execute("SELECT reply, reply_sent_at FROM processed_turns WHERE turn_key = ?", (turn_key,)).fetchone()
+                reply, reply_sent = row["reply"], row["reply_sent_at"] is not None
+        
+        if not replayed:
+            _conn.execute(
+                "INSERT INTO chat_history (phone_number, role, content, mode, session_id, scenario_id, created_at) "
+                "VALUES (?, 'user', ?, ?, ?, ?, ?)",
+                (phone, content, user.current_mode, user.current_session_id, user.current_scenario_id, now)
+            )
+        _conn.commit()
+        
+        scenario = None
+        if user.current_scenario_id is not None:
+            row = _conn.execute("SELECT * FROM scenarios WHERE id = ?", (user.current_scenario_id,)).fetchone()
+            scenario = ScenarioSchema(**dict(row)) if row else None
+        
+        history = []
+        if history_limit > 0 and user.current_mode != "sos":  # SOS questions stand alone
+            query = "SELECT role, content FROM chat_history WHERE phone_number = ?"
+            params: list = [phone]
+            if user.current_session_id:
+                query += " AND session_id = ?"
+                params.append(user.current_session_id)
+            query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+            params.append(history_limit)
+            history = [{"role": row["role"], "content": row["content"]} for row in _conn.execute(query, params)]
+            history.reverse()
+        
+        logger.info(f"[SQLITE] ✅ Turn started: mode={user.current_mode}, {len(history)} history{', replayed' if replayed else ''}")
+        return TurnContextSchema(user=user, scenario=scenario, history=history,
+                                 replayed=replayed, reply=reply, reply_sent=reply_sent)
+    except Exception as e:
+        _conn.rollback()
+        logger.error(f"[SQLITE] ❌ Error in begin_turn: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def complete_turn(phone: str, content: str, mode: str, session_id: Optional[str] = None,
+                  scenario_id: Optional[int] = None, update_user: bool = False,
+                  turn_key: Optional[str] = None) -> None:
+    """Save the assistant reply (as the reply of turn_key, if given) and optionally move the user to its
+    mode/scenario/session, in one transaction."""
+    try:
+        _conn.execute(
+            "INSERT INTO chat_history (phone_number, role, content, mode, session_id, scenario_id, created_at) "
+            "VALUES (?, 'assistant', ?, ?, ?, ?, ?)",
+            (phone, content, mode, session_id, scenario_id, datetime.utcnow().isoformat())
+        )
+        if turn_key is not None:
+            _conn.execute("UPDATE processed_turns SET reply = ? WHERE turn_key = ?", (content, turn_key))
+        if update_user:
+            _conn.execute(
+                "UPDATE users SET current_mode = ?, current_scenario_id = ?, "
+                "current_session_id = COALESCE(?, current_session_id) WHERE phone_number = ?",
+                (mode, scenario_id, session_id, phone)
+            )
+        _conn.commit()
+        logger.info(f"[SQLITE] ✅ Turn completed")
+    except Exception as e:
+        _conn.rollback()
+        logger.error(f"[SQLITE] ❌ Error in complete_turn: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def mark_turn_sent(turn_key: str) -> None:
+    """Record that the reply of a turn was sent to the user."""
+    try:
+        _conn.execute("UPDATE processed_turns SET reply_sent_at = ? WHERE turn_key = ?",
+                      (datetime.utcnow().isoformat(), turn_key))
+        _conn.commit()
+    except Exception as e:
+        _conn.rollback()
+        logger.error(f"[SQLITE] ❌ Error in mark_turn_sent: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def get_all_scenarios() -> List[ScenarioSchema]:
+    """Get all available roleplay scenarios."""
+    logger.info("[SQLITE] get_all_scenarios")
+    try:
+        rows = _conn.execute("SELECT * FROM scenarios ORDER BY id").fetchall()
+        if not rows:
+            logger.warning("[SQLITE] ⚠️ No scenarios found in DB")
+            return []
+
+        scenarios = [ScenarioSchema(**dict(row)) for row in rows]
+        logger.info(f"[SQLITE] ✅ Retrieved {len(scenarios)} scenarios")
+        return scenarios
+    except Exception as e:
+        logger.error(f"[SQLITE] ❌ Error in get_all_scenarios: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def get_scenario_by_id(scenario_id: int) -> Optional[ScenarioSchema]:
+    """Get a specific scenario by ID."""
+    logger.info(f"[SQLITE] get_scenario_by_id: id={scenario_id}")
+    try:
+        row = _conn.execute("SELECT * FROM scenarios WHERE id = ?", (scenario_id,)).fetchone()
+        if not row:
+            logger.warning(f"[SQLITE] ⚠️ Scenario {scenario_id} not found")
+            return None
+
+        scenario = ScenarioSchema(**dict(row))
+        logger.info(f"[SQLITE] ✅ Found scenario: '{scenario.title}'")
+        return scenario
+    except Exception as e:
+        logger.error(f"[SQLITE] ❌ Error in get_scenario_by_id: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def upsert_scenarios(rows: List[dict]) -> None:
+    """Insert or update a batch of scenarios by id."""
+    try:
+        _conn.executemany(
+            "INSERT INTO scenarios (id, title, bot_persona, situation_seed, opening_line) "
+            "VALUES (:id, :title, :bot_persona, :situation_seed, :opening_line) "
+            "ON CONFLICT(id) DO UPDATE SET title = excluded.title, bot_persona = excluded.bot_persona, "
+            "situation_seed = excluded.situation_seed, opening_line = excluded.opening_line",
+            rows
+        )
+        _conn.commit()
+        logger.info(f"[SQLITE] ✅ Upserted {len(rows)} scenarios")
+    except Exception as e:
+        _conn.rollback()
+        logger.error(f"[SQLITE] ❌ Error in upsert_scenarios: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def mark_scenario_complete(phone: str, scenario_id: int) -> None:
+    """Mark a scenario as completed for a user."""
+    try:
+        _conn.execute(
+            "INSERT INTO user_progress (phone_number, scenario_id, status, completed_at) VALUES (?, ?, 'completed', ?) "
+            "ON CONFLICT(phone_number, scenario_id) DO UPDATE SET status = excluded.status, completed_at = excluded.completed_at",
+            (phone, scenario_id, datetime.utcnow().isoformat())
+        )
+        _conn.commit()
+        logger.info(f"[SQLITE] ✅ Scenario {scenario_id} marked complete for {phone}")
+    except Exception as e:
+        _conn.rollback()
+        logger.error(f"[SQLITE] ❌ Error in mark_scenario_complete: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def record_token_usage(rows: List[dict]) -> None:
+    """Add a batch of per-user, per-day token usage deltas."""
+    try:
+        _conn.executemany(
+            "INSERT INTO token_usage (phone_number, day, prompt_tokens, completion_tokens, calls, cost_usd) "
+            "VALUES (:phone_number, :day, :prompt_tokens, :completion_tokens, :calls, :cost_usd) "
+            "ON CONFLICT(phone_number, day) DO UPDATE SET "
+            "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+            "completion_tokens = completion_tokens + excluded.completion_tokens, "
+            "calls = calls + excluded.calls, cost_usd = cost_usd + excluded.cost_usd",
+            rows
+        )
+        _conn.commit()
+        logger.info(f"[SQLITE] ✅ Recorded token usage for {len(rows)} user-days")
+    except Exception as e:
+        _conn.rollback()
+        logger.error(f"[SQLITE] ❌ Error in record_token_usage: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def get_top_token_users(since: str, limit: int = 20) -> List[TokenUsageSchema]:
+    """Heaviest token consumers since `since` (YYYY-MM-DD, inclusive)."""
+    try:
+        rows = _conn.execute(
+            "SELECT t.phone_number, u.tier, SUM(t.prompt_tokens) AS prompt_tokens, "
+            "SUM(t.completion_tokens) AS completion_tokens, SUM(t.calls) AS calls, SUM(t.cost_usd) AS cost_usd "
+            "FROM token_usage t LEFT JOIN users u ON u.phone_number = t.phone_number "
+            "WHERE t.day >= ? GROUP BY t.phone_number, u.tier "
+            "ORDER BY SUM(t.prompt_tokens + t.completion_tokens) DESC LIMIT ?",
+            (since, limit)
+        ).fetchall()
+        return [TokenUsageSchema(**dict(row)) for row in rows]
+    except Exception as e:
+        logger.error(f"[SQLITE] ❌ Error in get_top_token_users: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def get_learner_stats(phone: str) -> Optional[LearnerStatsSchema]:
+    """Progress counters for one learner (primary key lookups, no history scan)."""
+    try:
+        row = _conn.execute("SELECT * FROM learner_stats WHERE phone_number = ?", (phone,)).fetchone()
+        if not row:
+            return None
+        scenarios = _conn.execute(
+            "SELECT scenario_id, turns, sessions, completions, last_active_at FROM learner_scenario_stats "
+            "WHERE phone_number = ? ORDER BY scenario_id",
+            (phone,)
+        ).fetchall()
+        return LearnerStatsSchema(**dict(row), scenarios=[LearnerScenarioStatsSchema(**dict(s)) for s in scenarios])
+    except Exception as e:
+        logger.error(f"[SQLITE] ❌ Error in get_learner_stats: {e}", exc_info=True)
+        raise
+
+
+# Live and archived history, for rebuilding learner stats
+_ALL_HISTORY = (
+    "(SELECT id, phone_number, role, scenario_id, session_id, created_at FROM chat_history "
+    "UNION ALL SELECT id, phone_number, role, scenario_id, session_id, created_at FROM chat_history_archive)"
+)
+
+
+@_on_db_thread
+def backfill_learner_stats() -> int:
+    """Rebuild learner stats from all chat history and completed scenarios. Returns the number of learners."""
+    logger.info("[SQLITE] backfill_learner_stats")
+    try:
+        _conn.execute("DELETE FROM learner_stats")
+        _conn.execute("DELETE FROM learner_scenario_stats")
+        _conn.execute(
+            "INSERT INTO learner_stats (phone_number, turns, sessions, completions, first_active_at, last_active_at) "
+            "SELECT h.phone_number, SUM(h.role = 'user'), COUNT(DISTINCT h.session_id), "
+            "       (SELECT COUNT(*) FROM user_progress p WHERE p.phone_number = h.phone_number AND p.status = 'completed'), "
+            "       MIN(h.created_at), MAX(h.created_at) "
+            f"FROM {_ALL_HISTORY} h GROUP BY h.phone_number"
+        )
+        _conn.execute(
+            "INSERT INTO learner_scenario_stats (phone_number, scenario_id, turns, sessions, completions, last_active_at) "
+            "SELECT h.phone_number, h.scenario_id, SUM(h.role = 'user'), COUNT(DISTINCT h.session_id), "
+            "       (SELECT COUNT(*) FROM user_progress p WHERE p.phone_number = h.phone_number "
+            "        AND p.scenario_id = h.scenario_id AND p.status = 'completed'), "
+            "       MAX(h.created_at) "
+            f"FROM {_ALL_HISTORY} h WHERE h.scenario_id IS NOT NULL GROUP BY h.phone_number, h.scenario_id"
+        )
+        learners = _conn.execute("SELECT COUNT(*) FROM learner_stats").fetchone()[0]
+        _conn.commit()
+        logger.info(f"[SQLITE] ✅ Rebuilt learner stats for {learners} learners")
+        return learners
+    except Exception as e:
+        _conn.rollback()
+        logger.error(f"[SQLITE] ❌ Error in backfill_learner_stats: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def record_sos_miss(query: str) -> None:
+    """Count an SOS question the phrase index could not answer."""
+    try:
+        _conn.execute(
+            "INSERT INTO sos_misses (query) VALUES (?) "
+            "ON CONFLICT(query) DO UPDATE SET times_asked = times_asked + 1, last_asked_at = CURRENT_TIMESTAMP",
+            (query,)
+        )
+        _conn.commit()
+    except Exception as e:
+        _conn.rollback()
+        logger.error(f"[SQLITE] ❌ Error in record_sos_miss: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def get_top_sos_misses(limit: int = 20) -> List[SosMissSchema]:
+    """Most often asked SOS questions that had no phrase."""
+    try:
+        rows = _conn.execute(
+            "SELECT * FROM sos_misses ORDER BY times_asked DESC, last_asked_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [SosMissSchema(**dict(row)) for row in rows]
+    except Exception as e:
+        logger.error(f"[SQLITE] ❌ Error in get_top_sos_misses: {e}", exc_info=True)
+        raise
+
+
+_ARCHIVE_COLUMNS = "id, phone_number, role, mode, scenario_id, session_id, content, created_at"
+
+
+@_on_db_thread
+def _archive_batch(cutoff: str, batch_size: int) -> int:
+    """Move one batch of finished sessions (or sessionless rows) older than cutoff to the archive."""
+    try:
+        sessions = _conn.execute(
+            "SELECT DISTINCT old.phone_number, old.session_id FROM chat_history old "
+            "WHERE old.created_at < ? AND old.session_id IS NOT NULL AND NOT EXISTS ("
+            "    SELECT 1 FROM chat_history newer WHERE newer.phone_number = old.phone_number "
+            "    AND newer.session_id = old.session_id AND newer.created_at >= ?) "
+            "LIMIT ?",
+            (cutoff, cutoff, batch_size)
+        ).fetchall()
+        
+        if sessions:
+            _conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (phone_number TEXT, session_id TEXT)")
+            _conn.execute("DELETE FROM archive_batch")
+            _conn.executemany("INSERT INTO archive_batch VALUES (?, ?)", [tuple(row) for row in sessions])
+            where = "(phone_number, session_id) IN (SELECT phone_number, session_id FROM archive_batch)"
+            params: tuple = ()
+        else:
+            where = "id IN (SELECT id FROM chat_history WHERE session_id IS NULL AND created_at < ? LIMIT ?)"
+            params = (cutoff, batch_size * 20)
+        
+        _conn.execute(
+            f"INSERT OR IGNORE INTO chat_history_archive ({_ARCHIVE_COLUMNS}, archived_at) "
+            f"SELECT {_ARCHIVE_COLUMNS}, ? FROM chat_history WHERE {where}",
+            (datetime.utcnow().isoformat(), *params)
+        )
+        moved = _conn.execute(f"DELETE FROM chat_history WHERE {where}", params).rowcount
+        _conn.commit()
+        return moved
+    except Exception as e:
+        _conn.rollback()
+        logger.error(f"[SQLITE] ❌ Error in _archive_batch: {e}", exc_info=True)
+        raise
+
+
+@_on_db_thread
+def _prune_processed_turns(cutoff: str) -> None:
+    """Forget processed turn keys older than cutoff; their jobs are long finished."""
+    try:
+        _conn.execute("DELETE FROM processed_turns WHERE created_at < ?", (cutoff,))
+        _conn.commit()
+    except Exception as e:
+        _conn.rollback()
+        logger.error(f"[SQLITE] ❌ Error in _prune_processed_turns: {e}", exc_info=True)
+        raise
+
+
+def archive_old_sessions(cutoff: datetime, batch_size: int = 500) -> int:
+    """
+    Move sessions with no messages since `cutoff` to chat_history_archive.
+    
+    Each batch is its own transaction and DB-thread task, so live queries interleave with the job.
+    Returns the number of rows archived.
+    """
+    logger.info(f"[SQLITE] archive_old_sessions: cutoff={cutoff.isoformat()}, batch_size={batch_size}")
+    total = 0
+    while True:
+        moved = _archive_batch(cutoff.isoformat(), batch_size)
+        if moved == 0:
+            break
+        total += moved
+        logger.info(f"[SQLITE] Archived batch of {moved} rows ({total} total)")
+    _prune_processed_turns(cutoff.isoformat())
+    logger.info(f"[SQLITE] ✅ Archived {total} rows")
+    return total
@@ -0,0 +1,272 @@
+"""
+Storage facade for Chatlingo AI
+
+Selects the configured storage backend (Supabase or embedded SQLite) and exposes
+its operations as coroutines, so database work never runs on the event loop.
+"""
+
+import asyncio
+import functools
+import logging
+import time
+import uuid
+from datetime import datetime
+from types import ModuleType
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.schemas import UserSchema, ScenarioSchema, ChatMessageSchema, TurnContextSchema, TokenUsageSchema, LearnerStatsSchema, SosMissSchema
+from app.services.conversation_buffer import conversation_buffer
+from app.services.shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+_backend: Optional[ModuleType] = None
+
+# Scenarios change rarely and are read on every practice turn
+_scenario_cache: Dict[int, ScenarioSchema] = {}
+_scenario_cache_loaded_at: float = 0.0
+_scenario_cache_version: Optional[str] = None
+
+# Bumped in shared state by scenario imports, so every worker reloads its cache on next use
+_SCENARIOS_VERSION_KEY = "scenarios_version"
+_SCENARIOS_VERSION_TTL_SECONDS = 30 * 24 * 3600
+
+
+def get_backend() -> ModuleType:
+    """Import and return the configured backend module (on first use)."""
+    global _backend
+    if _backend is None:
+        if settings.storage_backend == "sqlite":
+            from app.services import sqlite_service as backend
+        else:
+            from app.services import supabase_service as backend
+        _backend = backend
+        logger.info(f"[STORAGE] Using storage backend: {settings.storage_backend}")
+    return _backend
+
+
+async def _run(func_name: str, *args, **kwargs):
+    """Run a backend function on the backend's executor (default thread pool if it has none)."""
+    backend = get_backend()
+    func = functools.partial(getattr(backend, func_name), *args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(getattr(backend, "executor", None), func)
+
+
+async def warmup() -> None:
+    """Open the backend connection and load the scenario cache."""
+    await _run("warmup")
+    await get_all_scenarios()
+
+
+async def ping() -> None:
+    """Cheap round trip to the backend (raises on failure)."""
+    await _run("warmup")
+
+
+async def close() -> None:
+    """Release backend resources, if the backend holds any."""
+    if _backend is not None and hasattr(_backend, "close"):
+        await asyncio.to_thread(_backend.close)
+
+
+def invalidate_scenario_cache() -> None:
+    global _scenario_cache_loaded_at
+    _scenario_cache.clear()
+    _scenario_cache_loaded_at = 0.0
+
+
+async def get_or_create_user(phone: str) -> UserSchema:
+    # User state is cached in the shared store so every worker sees the same copy
+    cached = await shared_state.get_json(f"user:{phone}")
+    if cached is not None:
+        return UserSchema(**cached)
+
+    user = await _run("get_or_create_user", phone)
+    await shared_state.set_json(f"user:{phone}", user.model_dump(mode="json"), settings.user_cache_ttl_seconds)
+    return user
+
+
+async def update_user_mode(phone: str, mode: str, scenario_id: Optional[int] = None, session_id: Optional[str] = None) -> None:
+    await _run("update_user_mode", phone, mode, scenario_id=scenario_id, session_id=session_id)
+    await shared_state.delete(f"user:{phone}")
+
+
+async def _bump_session_version(session_id: str) -> Tuple[Optional[str], str]:
+    """Record a write to a session. The shared version token tells other workers their buffered copy is stale."""
+    key = f"session_version:{session_id}"
+    current = await shared_state.get_json(key)
+    new = uuid.uuid4().hex
+    await shared_state.set_json(key, new, settings.conversation_buffer_idle_seconds)
+    return current, new
+
+
+async def add_message(phone: str, role: str, content: str, mode: str = "menu", session_id: Optional[str] = None, scenario_id: Optional[int] = None) -> None:
+    await _run("add_message", phone, role, content, mode=mode, session_id=session_id, scenario_id=scenario_id)
+    if session_id:
+        current, new = await _bump_session_version(session_id)
+        conversation_buffer.append(session_id, role, content, expected_version=current, new_version=new)
+
+
+async def begin_turn(phone: str, content: str, history_limit: int = 50, turn_key: Optional[str] = None) -> TurnContextSchema:
+    """
+    Save the user's message and load user state, scenario and history in one round trip.
+    
+    turn_key (the platform message id) makes a retried job idempotent: the message is saved once,
+    and the turn comes back `replayed` with the reply already saved for it, if any.
+    """
+    # If the session's history is already buffered, don't ship it back from the database
+    buffered = None
+    cached_user = await shared_state.get_json(f"user:{phone}")
+    cached_session_id = cached_user.get("current_session_id") if cached_user else None
+    if cached_session_id and history_limit <= conversation_buffer.max_messages:
+        version = await shared_state.get_json(f"session_version:{cached_session_id}")
+        buffered = conversation_buffer.get(cached_session_id, version)
+
+    turn = await _run("begin_turn", phone, content, history_limit=0 if buffered is not None else history_limit,
+                      turn_key=turn_key)
+    turn.turn_key = turn_key
+    await shared_state.set_json(f"user:{phone}", turn.user.model_dump(mode="json"), settings.user_cache_ttl_seconds)
+
+    session_id = turn.user.current_session_id
+    if turn.user.current_mode == "sos":
+        # SOS questions stand alone: no history, and the buffered copy of the session is just invalidated
+        if session_id:
+            await _bump_session_version(session_id)
+        turn.history = []
+    elif session_id:
+        current, new = await _bump_session_version(session_id)
+        if buffered is not None and session_id == cached_session_id and not turn.replayed:
+            conversation_buffer.append(session_id, "user", content, expected_version=current, new_version=new)
+            turn.history = (buffered + [{"role": "user", "content": content}])[-history_limit:]
+        elif buffered is not None:
+            # Session changed under the cached user state, or a replayed message may already be
+            # buffered; fall back to the database
+            conversation_buffer.drop(session_id)
+            turn.history = await get_session_history(phone, session_id, limit=history_limit)
+        else:
+            conversation_buffer.load(session_id, turn.history, new)
+    elif buffered is not None:
+        turn.history = await get_session_history(phone, None, limit=history_limit)
+    return turn
+
+
+async def complete_turn(phone: str, content: str, mode: str, session_id: Optional[str] = None,
+                        scenario_id: Optional[int] = None, update_user: bool = False,
+                        turn_key: Optional[str] = None) -> None:
+    """Save the assistant reply, and with update_user also move the user to its mode/scenario/session, in one round trip."""
+    await _run("complete_turn", phone, content, mode, session_id=session_id, scenario_id=scenario_id,
+               update_user=update_user, turn_key=turn_key)
+    if update_user:
+        await shared_state.delete(f"user:{phone}")
+    if session_id:
+        current, new = await _bump_session_version(session_id)
+        conversation_buffer.append(session_id, "assistant", content, expected_version=current, new_version=new)
+
+
+async def mark_turn_sent(turn_key: str) -> None:
+    """Record that a turn's reply was sent. Best-effort: at worst a retry sends it again."""
+    try:
+        await _run("mark_turn_sent", turn_key)
+    except Exception as e:
+        logger.warning(f"[STORAGE] ⚠️ Could not mark turn {turn_key} as sent: {e}")
+
+
+async def get_recent_messages(phone: str, limit: int = 10, session_id: Optional[str] = None) -> List[ChatMessageSchema]:
+    return await _run("get_recent_messages", phone, limit=limit, session_id=session_id)
+
+
+async def get_session_history(phone: str, session_id: Optional[str], limit: int = 50) -> List[Dict[str, str]]:
+    """Recent role/content history of a session (oldest first), served from the conversation buffer when possible."""
+    if not session_id:
+        messages = await get_recent_messages(phone, limit=limit)
+        return [{"role": msg.role, "content": msg.content} for msg in messages]
+
+    version = await shared_state.get_json(f"session_version:{session_id}")
+    if limit <= conversation_buffer.max_messages:
+        history = conversation_buffer.get(session_id, version)
+        if history is not None:
+            return history[-limit:]
+
+    messages = await get_recent_messages(phone, limit=max(limit, conversation_buffer.max_messages), session_id=session_id)
+    history = [{"role": msg.role, "content": msg.content} for msg in messages]
+    conversation_buffer.load(session_id, history, version)
+    return history[-limit:]
+
+
+async def get_history_page(after: Optional[ChatMessageSchema], limit: int, since: Optional[datetime] = None,
+                           until: Optional[datetime] = None, phone: Optional[str] = None,
+                           scenario_id: Optional[int] = None, session_id: Optional[str] = None) -> List[ChatMessageSchema]:
+    """Chat history ordered by (created_at, id), continuing after the last message of the previous page."""
+    return await _run(
+        "get_history_page",
+        after.created_at.isoformat() if after else None, after.id if after else None, limit,
+        since=since.isoformat() if since else None, until=until.isoformat() if until else None,
+        phone=phone, scenario_id=scenario_id, session_id=session_id,
+    )
+
+
+async def get_all_scenarios() -> List[ScenarioSchema]:
+    global _scenario_cache_loaded_at, _scenario_cache_version
+    version = await shared_state.get_json(_SCENARIOS_VERSION_KEY)
+    if (_scenario_cache and version == _scenario_cache_version
+            and time.monotonic() - _scenario_cache_loaded_at < settings.scenario_cache_ttl_seconds):
+        return list(_scenario_cache.values())
+
+    scenarios = await _run("get_all_scenarios")
+    _scenario_cache.clear()
+    _scenario_cache.update({s.id: s for s in scenarios})
+    _scenario_cache_loaded_at = time.monotonic()
+    _scenario_cache_version = version
+    return scenarios
+
+
+async def upsert_scenarios(scenarios: List[ScenarioSchema], batch_size: int = 500) -> None:
+    """Insert or update scenarios by id in batches, then make every worker reload its scenario cache."""
+    rows = [s.model_dump() for s in scenarios]
+    for start in range(0, len(rows), batch_size):
+        await _run("upsert_scenarios", rows[start:start + batch_size])
+    await shared_state.set_json(_SCENARIOS_VERSION_KEY, uuid.uuid4().hex, _SCENARIOS_VERSION_TTL_SECONDS)
+    invalidate_scenario_cache()
+
+
+async def get_scenario_by_id(scenario_id: int) -> Optional[ScenarioSchema]:
+    await get_all_scenarios()
+    if scenario_id in _scenario_cache:
+        return _scenario_cache[scenario_id]
+    # Not in the cached list (e.g. added since the last refresh)
+    return await _run("get_scenario_by_id", scenario_id)
+
+
+async def mark_scenario_complete(phone: str, scenario_id: int) -> None:
+    await _run("mark_scenario_complete", phone, scenario_id)
+
+
+async def record_token_usage(rows: List[dict]) -> None:
+    await _run("record_token_usage", rows)
+
+
+async def get_top_token_users(since: str, limit: int = 20) -> List[TokenUsageSchema]:
+    return await _run("get_top_token_users", since, limit=limit)
+
+
+async def get_learner_stats(phone: str) -> Optional[LearnerStatsSchema]:
+    return await _run("get_learner_stats", phone)
+
+
+async def backfill_learner_stats() -> int:
+    return await _run("backfill_learner_stats")
+
+
+async def record_sos_miss(query: str) -> None:
+    await _run("record_sos_miss", query)
+
+
+async def get_top_sos_misses(limit: int = 20) -> List[SosMissSchema]:
+    return await _run("get_top_sos_misses", limit=limit)
+
+
+async def archive_old_sessions(cutoff: datetime, batch_size: int = 500) -> int:
+    # Long-running: runs in a worker thread that submits one batch at a time, not on the DB thread
+    return await asyncio.to_thread(get_backend().archive_old_sessions, cutoff, batch_size)
@@ -6,7 +6,6 @@ Returns Pydantic models from app.schemas.
 """
 
 import logging
-import traceback
 from supabase import create_client, Client
 from typing import List, Optional
 from datetime import datetime
@@ -16,15 +15,35 @@ from app.schemas import (
     UserSchema,
     ScenarioSchema,
     ChatMessageSchema,
-    UserProgressSchema
+    UserProgressSchema,
+    TurnContextSchema,
+    TokenUsageSchema,
+    LearnerStatsSchema,
+    LearnerScenarioStatsSchema,
+    SosMissSchema
 )
 
 logger = logging.getLogger(__name__)
 
-# Initialize Supabase client
-logger.info("[SUPABASE] Initializing Supabase client...")
-supabase: Client = create_client(settings.supabase_url, settings.supabase_key)
-logger.info("[SUPABASE] ✅ Supabase client initialized")
+_client: Optional[Client] = None
+
+
+def get_client() -> Client:
+    """Return the Supabase client, creating it on first use."""
+    global _client
+    if _client is None:
+        if not settings.supabase_url or not settings.supabase_key:
+            raise ValueError("SUPABASE_URL and SUPABASE_KEY must be configured for the supabase storage backend")
+
+        logger.info("[SUPABASE] Initializing Supabase client...")
+        _client = create_client(settings.supabase_url, settings.supabase_key)
+        logger.info("[SUPABASE] ✅ Supabase client initialized")
+    return _client
+
+
+def warmup() -> None:
+    """Create the client and open a connection with a cheap query."""
+    get_client().table('scenarios').select('id').limit(1).execute()
 
 
 def get_or_create_user(phone: str) -> UserSchema:
@@ -32,7 +51,7 @@ def get_or_create_user(phone: str) -> UserSchema:
     logger.info(f"[SUPABASE] get_or_create_user: phone={phone}")
     try:
         # Try to get existing user
-        response = supabase.table('users').select('*').eq('phone_number', phone).execute()
+        response = get_client().table('users').select('*').eq('phone_number', phone).execute()
         
         if response.data and len(response.data) > 0:
             user = UserSchema(**response.data[0])
@@ -47,12 +66,11 @@ def get_or_create_user(phone: str) -> UserSchema:
             'joined_at': datetime.utcnow().isoformat()
         }
         
-        response = supabase.table('users').insert(new_user).execute()
+        response = get_client().table('users').insert(new_user).execute()
         user = UserSchema(**response.data[0])
         return user
     except Exception as e:
-        logger.error(f"[SUPABASE] ❌ Error in get_or_create_user: {e}")
-        logger.error(f"[SUPABASE] ❌ Traceback:\n{traceback.format_exc()}")
+        logger.error(f"[SUPABASE] ❌ Error in get_or_create_user: {e}", exc_info=True)
         raise
 
 
@@ -76,11 +94,10 @@ def update_user_mode(phone: str, mode: str, scenario_id: Optional[int] = None, s
         if session_id:
             update_data['current_session_id'] = session_id
             
-        supabase.table('users').update(update_data).eq('phone_number', phone).execute()
+        get_client().table('users').update(update_data).eq('phone_number', phone).execute()
         logger.info(f"[SUPABASE] ✅ User mode updated")
     except Exception as e:
-        logger.error(f"[SUPABASE] ❌ Error in update_user_mode: {e}")
-        logger.error(f"[SUPABASE] ❌ Traceback:\n{traceback.format_exc()}")
+        logger.error(f"[SUPABASE] ❌ Error in update_user_mode: {e}", exc_info=True)
         raise
 
 
@@ -97,11 +114,10 @@ def add_message(phone: str, role: str, content: str, mode: str = "menu", session
             'created_at': datetime.utcnow().isoformat()
         }
         
-        supabase.table('chat_history').insert(message_data).execute()
+        get_client().table('chat_history').insert(message_data).execute()
         logger.info(f"[SUPABASE] ✅ Message saved to chat_history")
     except Exception as e:
-        logger.error(f"[SUPABASE] ❌ Error in add_message: {e}")
-        logger.error(f"[SUPABASE] ❌ Traceback:\n{traceback.format_exc()}")
+        logger.error(f"[SUPABASE] ❌ Error in add_message: {e}", exc_info=True)
         raise
 
 
@@ -109,7 +125,7 @@ def get_recent_messages(phone: str, limit: int = 10, session_id: Optional[str] =
     """Get recent messages for a user in chronological order (oldest to newest)."""
     try:
         # Build query
-        query = supabase.table('chat_history')\
+        query = get_client().table('chat_history')\
             .select('phone_number, role, mode, scenario_id, content, created_at')\
             .eq('phone_number', phone)
             
@@ -136,8 +152,62 @@ def get_recent_messages(phone: str, limit: int = 10, session_id: Optional[str] =
         logger.info(f"[SUPABASE] ✅ Retrieved {len(messages)} messages")
         return messages
     except Exception as e:
-        logger.error(f"[SUPABASE] ❌ Error in get_recent_messages: {e}")
-        logger.error(f"[SUPABASE] ❌ Traceback:\n{traceback.format_exc()}")
+        logger.error(f"[SUPABASE] ❌ Error in get_recent_messages: {e}", exc_info=True)
+        raise
+
+
+def begin_turn(phone: str, content: str, history_limit: int = 50, turn_key: Optional[str] = None) -> TurnContextSchema:
+    """
+    Upsert the user, save their message and return user state, scenario and history in one RPC.
+    
+    A turn_key seen before (a retried job) does not save the message again; see begin_turn in schema.sql.
+    """
+    logger.info(f"[SUPABASE] begin_turn: phone={phone}, history_limit={history_limit}")
+    try:
+        response = get_client().rpc('begin_turn', {
+            'p_phone': phone,
+            'p_content': content,
+            'p_history_limit': history_limit,
+            'p_turn_key': turn_key
+        }).execute()
+        
+        turn = TurnContextSchema(**response.data)
+        logger.info(f"[SUPABASE] ✅ Turn started: mode={turn.user.current_mode}, {len(turn.history)} history{', replayed' if turn.replayed else ''}")
+        return turn
+    except Exception as e:
+        logger.error(f"[SUPABASE] ❌ Error in begin_turn: {e}", exc_info=True)
+        raise
+
+
+def complete_turn(phone: str, content: str, mode: str, session_id: Optional[str] = None,
+                  scenario_id: Optional[int] = None, update_user: bool = False,
+                  turn_key: Optional[str] = None) -> None:
+    """Save the assistant reply (as the reply of turn_key, if given) and optionally move the user to its
+    mode/scenario/session, in one RPC."""
+    try:
+        get_client().rpc('complete_turn', {
+            'p_phone': phone,
+            'p_content': content,
+            'p_mode': mode,
+            'p_session_id': session_id,
+            'p_scenario_id': scenario_id,
+            'p_update_user': update_user,
+            'p_turn_key': turn_key
+        }).execute()
+        logger.info(f"[SUPABASE] ✅ Turn completed")
+    except Exception as e:
+        logger.error(f"[SUPABASE] ❌ Error in complete_turn: {e}", exc_info=True)
+        raise
+
+
+def mark_turn_sent(turn_key: str) -> None:
+    """Record that the reply of a turn was sent to the user."""
+    try:
+        get_client().table('processed_turns').update({
+            'reply_sent_at': datetime.utcnow().isoformat()
+        }).eq('turn_key', turn_key).execute()
+    except Exception as e:
+        logger.error(f"[SUPABASE] ❌ Error in mark_turn_sent: {e}", exc_info=True)
         raise
 
 
@@ -145,7 +215,7 @@ def get_all_scenarios() -> List[ScenarioSchema]:
     """Get all available roleplay scenarios."""
     logger.info("[SUPABASE] get_all_scenarios")
     try:
-        response = supabase.table('scenarios').select('*').execute()
+        response = get_client().table('scenarios').select('*').execute()
         
         if not response.data:
             logger.warning("[SUPABASE] ⚠️ No scenarios found in DB")
@@ -155,8 +225,7 @@ def get_all_scenarios() -> List[ScenarioSchema]:
         logger.info(f"[SUPABASE] ✅ Retrieved {len(scenarios)} scenarios")
         return scenarios
     except Exception as e:
-        logger.error(f"[SUPABASE] ❌ Error in get_all_scenarios: {e}")
-        logger.error(f"[SUPABASE] ❌ Traceback:\n{traceback.format_exc()}")
+        logger.error(f"[SUPABASE] ❌ Error in get_all_scenarios: {e}", exc_info=True)
         raise
 
 
@@ -164,7 +233,7 @@ def get_scenario_by_id(scenario_id: int) -> Optional[ScenarioSchema]:
     """Get a specific scenario by ID."""
     logger.info(f"[SUPABASE] get_scenario_by_id: id={scenario_id}")
     try:
-        response = supabase.table('scenarios').select('*').eq('id', scenario_id).execute()
+        response = get_client().table('scenarios').select('*').eq('id', scenario_id).execute()
         
         if not response.data or len(response.data) == 0:
             logger.warning(f"[SUPABASE] ⚠️ Scenario {scenario_id} not found")
@@ -174,8 +243,17 @@ def get_scenario_by_id(scenario_id: int) -> Optional[ScenarioSchema]:
         logger.info(f"[SUPABASE] ✅ Found scenario: '{scenario.title}'")
         return scenario
     except Exception as e:
-        logger.error(f"[SUPABASE] ❌ Error in get_scenario_by_id: {e}")
-        logger.error(f"[SUPABASE] ❌ Traceback:\n{traceback.format_exc()}")
+        logger.error(f"[SUPABASE] ❌ Error in get_scenario_by_id: {e}", exc_info=True)
+        raise
+
+
+def upsert_scenarios(rows: List[dict]) -> None:
+    """Insert or update a batch of scenarios by id in one RPC."""
+    try:
+        get_client().rpc('upsert_scenarios', {'p_rows': rows}).execute()
+        logger.info(f"[SUPABASE] ✅ Upserted {len(rows)} scenarios")
+    except Exception as e:
+        logger.error(f"[SUPABASE] ❌ Error in upsert_scenarios: {e}", exc_info=True)
         raise
 
 
@@ -189,9 +267,136 @@ def mark_scenario_complete(phone: str, scenario_id: int) -> None:
             'completed_at': datetime.utcnow().isoformat()
         }
         
-        supabase.table('user_progress').upsert(progress_data).execute()
+        get_client().table('user_progress').upsert(progress_data, on_conflict='phone_number,scenario_id').execute()
         logger.info(f"[SUPABASE] ✅ Scenario {scenario_id} marked complete for {phone}")
     except Exception as e:
-        logger.error(f"[SUPABASE] ❌ Error in mark_scenario_complete: {e}")
-        logger.error(f"[SUPABASE] ❌ Traceback:\n{traceback.format_exc()}")
-        raise
\ No newline at end of file
+        logger.error(f"[SUPABASE] ❌ Error in mark_scenario_complete: {e}", exc_info=True)
+        raise
+
+
+def record_token_usage(rows: List[dict]) -> None:
+    """Add a batch of per-user, per-day token usage deltas in one RPC."""
+    try:
+        get_client().rpc('record_token_usage', {'p_rows': rows}).execute()
+        logger.info(f"[SUPABASE] ✅ Recorded token usage for {len(rows)} user-days")
+    except Exception as e:
+        logger.error(f"[SUPABASE] ❌ Error in record_token_usage: {e}", exc_info=True)
+        raise
+
+
+def get_top_token_users(since: str, limit: int = 20) -> List[TokenUsageSchema]:
+    """Heaviest token consumers since `since` (YYYY-MM-DD, inclusive)."""
+    try:
+        response = get_client().rpc('top_token_users', {'p_since': since, 'p_limit': limit}).execute()
+        return [TokenUsageSchema(**row) for row in response.data or []]
+    except Exception as e:
+        logger.error(f"[SUPABASE] ❌ Error in get_top_token_users: {e}", exc_info=True)
+        raise
+
+
+def get_history_page(after_created_at: Optional[str], after_id: Optional[int], limit: int,
+                     since: Optional[str] = None, until: Optional[str] = None, phone: Optional[str] = None,
+                     scenario_id: Optional[int] = None, session_id: Optional[str] = None) -> List[ChatMessageSchema]:
+    """One page of chat history ordered by (created_at, id), starting after the given keyset cursor."""
+    try:
+        response = get_client().rpc('export_chat_history', {
+            'p_after_created_at': after_created_at,
+            'p_after_id': after_id,
+            'p_limit': limit,
+            'p_since': since,
+            'p_until': until,
+            'p_phone': phone,
+            'p_scenario_id': scenario_id,
+            'p_session_id': session_id
+        }).execute()
+        return [ChatMessageSchema(**row) for row in response.data or []]
+    except Exception as e:
+        logger.error(f"[SUPABASE] ❌ Error in get_history_page: {e}", exc_info=True)
+        raise
+
+
+def get_learner_stats(phone: str) -> Optional[LearnerStatsSchema]:
+    """Progress counters for one learner (primary key lookups, no history scan)."""
+    try:
+        client = get_client()
+        response = client.table('learner_stats').select('*').eq('phone_number', phone).execute()
+        if not response.data:
+            return None
+        scenarios = client.table('learner_scenario_stats') \
+            .select('scenario_id, turns, sessions, completions, last_active_at') \
+            .eq('phone_number', phone) \
+            .order('scenario_id') \
+            .execute()
+        return LearnerStatsSchema(**response.data[0],
+                                  scenarios=[LearnerScenarioStatsSchema(**row) for row in scenarios.data or []])
+    except Exception as e:
+        logger.error(f"[SUPABASE] ❌ Error in get_learner_stats: {e}", exc_info=True)
+        raise
+
+
+def backfill_learner_stats() -> int:
+    """Rebuild learner stats from all chat history and completions in one RPC. Returns the number of learners."""
+    logger.info("[SUPABASE] backfill_learner_stats")
+    try:
+        response = get_client().rpc('backfill_learner_stats', {}).execute()
+        learners = response.data or 0
+        logger.info(f"[SUPABASE] ✅ Rebuilt learner stats for {learners} learners")
+        return learners
+    except Exception as e:
+        logger.error(f"[SUPABASE] ❌ Error in backfill_learner_stats: {e}", exc_info=True)
+        raise
+
+
+def record_sos_miss(query: str) -> None:
+    """Count an SOS question the phrase index could not answer."""
+    try:
+        get_client().rpc('record_sos_miss', {'p_query': query}).execute()
+    except Exception as e:
+        logger.error(f"[SUPABASE] ❌ Error in record_sos_miss: {e}", exc_info=True)
+        raise
+
+
+def get_top_sos_misses(limit: int = 20) -> List[SosMissSchema]:
+    """Most often asked SOS questions that had no phrase."""
+    try:
+        response = get_client().table('sos_misses') \
+            .select('*') \
+            .order('times_asked', desc=True) \
+            .order('last_asked_at', desc=True) \
+            .limit(limit) \
+            .execute()
+        return [SosMissSchema(**row) for row in response.data or []]
+    except Exception as e:
+        logger.error(f"[SUPABASE] ❌ Error in get_top_sos_misses: {e}", exc_info=True)
+        raise
+
+
+def archive_old_sessions(cutoff: datetime, batch_size: int = 500) -> int:
+    """
+    Move sessions with no messages since `cutoff` to chat_history_archive, then drop emptied partitions.
+    
+    Each RPC call moves one batch in the database, so rows never pass through the app.
+    Returns the number of rows archived.
+    """
+    logger.info(f"[SUPABASE] archive_old_sessions: cutoff={cutoff.isoformat()}, batch_size={batch_size}")
+    try:
+        total = 0
+        while True:
+            response = get_client().rpc('archive_chat_sessions', {
+                'p_cutoff': cutoff.isoformat(),
+                'p_batch_size': batch_size
+            }).execute()
+            moved = response.data or 0
+            if moved == 0:
+                break
+            total += moved
+            logger.info(f"[SUPABASE] Archived batch of {moved} rows ({total} total)")
+        
+        dropped = get_client().rpc('drop_empty_chat_history_partitions', {'p_cutoff': cutoff.isoformat()}).execute().data
+        get_client().rpc('ensure_chat_history_partitions', {'p_months_ahead': 3}).execute()
+        get_client().table('processed_turns').delete().lt('created_at', cutoff.isoformat()).execute()
+        logger.info(f"[SUPABASE] ✅ Archived {total} rows, dropped {dropped} empty partitions")
+        return total
+    except Exception as e:
+        logger.error(f"[SUPABASE] ❌ Error in archive_old_sessions: {e}", exc_info=True)
+        raise
@@ -0,0 +1,60 @@
+"""
+Background task runner for Chatlingo AI
+
+Tracks the message-processing tasks started by the webhooks so the app can
+stop taking new work on shutdown and drain in-flight work with a deadline.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Set
+
+logger = logging.getLogger(__name__)
+
+
+class TaskRunner:
+    """Runs coroutines as tracked asyncio tasks"""
+
+    def __init__(self):
+        self.accepting = True
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def submit(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> bool:
+        """Start func(*args, **kwargs) in the background. Returns False once draining has begun."""
+        if not self.accepting:
+            return False
+
+        task = asyncio.create_task(func(*args, **kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_done)
+        return True
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        # The task itself logs the details; just record that it did not complete
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"[TASKS] ⚠️ Background task failed: {task.exception()!r}")
+
+    async def drain(self, timeout: float) -> None:
+        """Stop accepting work and wait up to `timeout` seconds for in-flight tasks"""
+        self.accepting = False
+        if not self._tasks:
+            return
+
+        logger.info(f"[TASKS] Draining {len(self._tasks)} in-flight tasks (timeout={timeout}s)...")
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning(f"[TASKS] ⚠️ Cancelling {len(pending)} tasks still running after drain deadline")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        else:
+            logger.info(f"[TASKS] ✅ Drained {len(done)} tasks")
+
+
+# Global instance
+task_runner = TaskRunner()
@@ -4,22 +4,32 @@ Telegram Bot API service for sending messages and managing bot interactions.
 
 import httpx
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
 
 class TelegramService:
-    """Service for interacting with Telegram Bot API"""
+    """Service for interacting with Telegram Bot API (one per bot)"""
     
-    def __init__(self):
-        if not settings.telegram_bot_token:
+    def __init__(self, bot_token: Optional[str] = None):
+        # Without a token this is the default tenant's client, from TELEGRAM_BOT_TOKEN
+        if bot_token is None:
+            bot_token = settings.telegram_bot_token
+        if not bot_token:
             raise ValueError("TELEGRAM_BOT_TOKEN not configured")
         
-        self.bot_token = settings.telegram_bot_token
+        self.bot_token = bot_token
         self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Pooled HTTP client, created on first use"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=30.0)
+        return self._client
     
     async def send_text_message(self, chat_id: int, text: str, parse_mode: str = "Markdown") -> dict:
         """Send a text message to a Telegram chat"""
@@ -122,9 +132,23 @@ class TelegramService:
             logger.error(f"Error getting webhook info: {e}")
             raise
     
+    async def get_me(self) -> dict:
+        """Get basic information about the bot (also used to warm the connection)"""
+        url = f"{self.base_url}/getMe"
+        
+        try:
+            response = await self.client.get(url)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.error(f"Error getting bot info: {e}")
+            raise
+    
     async def close(self):
         """Close the HTTP client"""
-        await self.client.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
 
 # Global instance
@@ -0,0 +1,202 @@
+"""
+Tenants for Chatlingo AI
+
+One process can serve several branded bots. Each tenant is a WhatsApp business
+number and/or a Telegram bot with its own API credentials, its own pooled HTTP
+clients, inbound rate limit, outbound send budget, prompt overrides and
+scenario set. Tenants are read from TENANTS_PATH (a JSON list) and must carry
+their own credentials. Without it there is a single "default" tenant, built
+from the WHATSAPP_*/TELEGRAM_* settings, so single-bot deployments work as
+before.
+
+Webhooks pick the tenant (WhatsApp by the payload's phone_number_id, Telegram
+by the webhook path). The tenant being served is kept in `current_tenant` for
+the rest of the turn.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from app.config import settings
+from app.services.metrics import metrics
+from app.services.shared_state import shared_state
+from app.services.telegram_service import TelegramService, telegram_service
+from app.services.whatsapp_service import WhatsAppService, whatsapp_service
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT_ID = "default"
+
+
+class TenantConfig(BaseModel):
+    """One bot/number, as listed in TENANTS_PATH"""
+    id: str
+    whatsapp_phone_id: Optional[str] = None
+    whatsapp_access_token: Optional[str] = None
+    whatsapp_verify_token: Optional[str] = None
+    telegram_bot_token: Optional[str] = None
+    telegram_webhook_secret: Optional[str] = None
+    telegram_allowed_user_ids: List[int] = Field(default_factory=list)  # Required for Telegram, like TELEGRAM_ALLOWED_USER_IDS
+    rate_limit_per_minute: Optional[int] = None  # None uses RATE_LIMIT_PER_MINUTE
+    send_limit_per_second: Optional[int] = None  # None uses SEND_LIMIT_PER_SECOND
+    prompts_dir: Optional[str] = None  # Prompt files here replace those of app/prompts; missing ones fall back
+    scenario_ids: Optional[List[int]] = None  # Scenarios offered by this bot; None offers all
+
+
+class Tenant:
+    """A tenant's configuration plus its API clients (created on first use)"""
+
+    def __init__(self, config: TenantConfig, whatsapp: Optional[WhatsAppService] = None,
+                 telegram: Optional[TelegramService] = None):
+        self.config = config
+        self.id = config.id
+        self._whatsapp = whatsapp
+        self._telegram = telegram
+
+    @property
+    def is_default(self) -> bool:
+        return self.id == DEFAULT_TENANT_ID
+
+    @property
+    def whatsapp(self) -> Optional[WhatsAppService]:
+        if self._whatsapp is None and self.config.whatsapp_phone_id:
+            self._whatsapp = WhatsAppService(self.config.whatsapp_phone_id, self.config.whatsapp_access_token)
+        return self._whatsapp
+
+    @property
+    def telegram(self) -> Optional[TelegramService]:
+        if self._telegram is None and self.config.telegram_bot_token:
+            self._telegram = TelegramService(self.config.telegram_bot_token)
+        return self._telegram
+
+    @property
+    def rate_limit_per_minute(self) -> int:
+        limit = self.config.rate_limit_per_minute
+        return settings.rate_limit_per_minute if limit is None else limit
+
+    @property
+    def send_limit_per_second(self) -> int:
+        limit = self.config.send_limit_per_second
+        return settings.send_limit_per_second if limit is None else limit
+
+    async def wait_for_send_budget(self) -> None:
+        """Pace outbound messages to the tenant's send budget, shared by all workers (one-second windows)"""
+        limit = self.send_limit_per_second
+        if limit <= 0:
+            return
+        while True:
+            now = time.time()
+            window = int(now)
+            if await shared_state.incr(f"sendbudget:{self.id}:{window}", 2) <= limit:
+                return
+            metrics.inc("tenant_sends_delayed", tenant=self.id)
+            await asyncio.sleep(window + 1 - now)
+
+    def key(self, value: object) -> str:
+        """
+        Scope a platform id (user, chat, update) to this tenant for storage, locks and shared state.
+
+        The default tenant keeps bare ids, so data written before tenancy stays valid.
+        """
+        return str(value) if self.is_default else f"{self.id}:{value}"
+
+    def unscope(self, key: str) -> str:
+        """Platform id of a scoped key (the inverse of `key`)"""
+        return key if self.is_default else key.removeprefix(f"{self.id}:")
+
+    def allows_scenario(self, scenario_id: int) -> bool:
+        return self.config.scenario_ids is None or scenario_id in self.config.scenario_ids
+
+    async def close(self) -> None:
+        if self._whatsapp is not None:
+            await self._whatsapp.close()
+        if self._telegram is not None:
+            await self._telegram.close()
+
+
+class TenantRegistry:
+    """All tenants of this process, indexed by id and WhatsApp phone number id"""
+
+    def __init__(self):
+        self._tenants: Dict[str, Tenant] = {}
+        self._by_phone_id: Dict[str, Tenant] = {}
+        self.default: Optional[Tenant] = None
+        self.load()
+
+    def load(self) -> None:
+        if settings.tenants_path:
+            with open(settings.tenants_path, "r", encoding="utf-8") as f:
+                configs = [TenantConfig(**entry) for entry in json.load(f)]
+            if not configs:
+                raise ValueError(f"No tenants in {settings.tenants_path}")
+            for config in configs:
+                self._check_credentials(config)
+            tenants = [Tenant(c) for c in configs]
+        else:
+            config = TenantConfig(
+                id=DEFAULT_TENANT_ID,
+                whatsapp_phone_id=settings.whatsapp_phone_id,
+                whatsapp_verify_token=settings.whatsapp_verify_token,
+                telegram_bot_token=settings.telegram_bot_token,
+                telegram_webhook_secret=settings.telegram_webhook_secret,
+                telegram_allowed_user_ids=sorted(settings.get_allowed_telegram_user_ids()),
+            )
+            # The single tenant uses the module-level clients
+            tenants = [Tenant(config, whatsapp_service, telegram_service)]
+
+        self._tenants.clear()
+        self._by_phone_id.clear()
+        for tenant in tenants:
+            if tenant.id in self._tenants:
+                raise ValueError(f"Duplicate tenant id: {tenant.id}")
+            self._tenants[tenant.id] = tenant
+            if tenant.config.whatsapp_phone_id:
+                self._by_phone_id[tenant.config.whatsapp_phone_id] = tenant
+        # Payloads that name no known number go to "default" if there is one, else the first tenant
+        self.default = self._tenants.get(DEFAULT_TENANT_ID, tenants[0])
+        if settings.tenants_path:
+            logger.info(f"[TENANTS] ✅ Loaded {len(tenants)} tenants from {settings.tenants_path}")
+
+    @staticmethod
+    def _check_credentials(config: TenantConfig) -> None:
+        """Tenants from TENANTS_PATH never borrow the WHATSAPP_*/TELEGRAM_* credentials"""
+        if not config.whatsapp_phone_id and not config.telegram_bot_token:
+            raise ValueError(f"Tenant {config.id} has neither whatsapp_phone_id nor telegram_bot_token")
+        if config.whatsapp_phone_id and not config.whatsapp_access_token:
+            raise ValueError(f"Tenant {config.id} has a whatsapp_phone_id but no whatsapp_access_token")
+        if config.whatsapp_access_token and not config.whatsapp_phone_id:
+            raise ValueError(f"Tenant {config.id} has a whatsapp_access_token but no whatsapp_phone_id")
+
+    def get(self, tenant_id: Optional[str]) -> Optional[Tenant]:
+        """Tenant by id; None (no id given) is the default tenant"""
+        return self.default if tenant_id is None else self._tenants.get(tenant_id)
+
+    def for_whatsapp_phone_id(self, phone_id: Optional[str]) -> Tenant:
+        return self._by_phone_id.get(phone_id or "", self.default)
+
+    def for_whatsapp_verify_token(self, token: str) -> Optional[Tenant]:
+        return next((t for t in self._tenants.values() if t.config.whatsapp_verify_token == token), None)
+
+    def all(self) -> List[Tenant]:
+        return list(self._tenants.values())
+
+    async def close(self) -> None:
+        for tenant in self._tenants.values():
+            await tenant.close()
+
+
+# Global instance
+tenant_registry = TenantRegistry()
+
+# Tenant of the turn being processed (each asyncio task has its own copy)
+current_tenant: ContextVar[Optional[Tenant]] = ContextVar("current_tenant", default=None)
+
+
+def get_current_tenant() -> Tenant:
+    return current_tenant.get() or tenant_registry.default
@@ -0,0 +1,112 @@
+"""
+Token accounting for Chatlingo AI
+
+Records LLM token usage per user and UTC day. Usage is aggregated in memory
+and flushed to the token_usage table in batches; a running daily total per
+user is kept in shared state so every worker enforces the same budget.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from app.config import settings
+from app.services import storage
+from app.services.metrics import metrics
+from app.services.shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+# Daily counters outlive their day a little so late turns near midnight still see them
+_COUNTER_TTL_SECONDS = 2 * 24 * 3600
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+class TokenAccountant:
+    """Aggregates per-user token usage and checks daily budgets"""
+
+    def __init__(self):
+        self.budgets = settings.get_token_budgets()
+        self._pending: Dict[Tuple[str, str], dict] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    async def record(self, user_id: str, prompt_tokens: int, completion_tokens: int, cost_usd: float) -> None:
+        day = _today()
+        row = self._pending.setdefault((user_id, day), {
+            "phone_number": user_id, "day": day,
+            "prompt_tokens": 0, "completion_tokens": 0, "calls": 0, "cost_usd": 0.0,
+        })
+        row["prompt_tokens"] += prompt_tokens
+        row["completion_tokens"] += completion_tokens
+        row["calls"] += 1
+        row["cost_usd"] += cost_usd
+        await shared_state.incr(f"tokens:{user_id}:{day}", _COUNTER_TTL_SECONDS, prompt_tokens + completion_tokens)
+
+    async def used_today(self, user_id: str) -> int:
+        return int(await shared_state.get_json(f"tokens:{user_id}:{_today()}") or 0)
+
+    async def is_over_budget(self, user_id: str, tier: Optional[str]) -> bool:
+        """True once the user has used their tier's daily budget (tiers without a budget are unlimited)"""
+        budget = self.budgets.get(tier or "free")
+        if not budget:
+            return False
+        return await self.used_today(user_id) >= budget
+
+    async def flush(self) -> int:
+        """Write pending usage in one batch. Returns the number of user-days written."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            rows = list(pending.values())
+            try:
+                await storage.record_token_usage(rows)
+            except Exception as e:
+                # Keep the deltas for the next flush, merged with anything recorded meanwhile (oldest first)
+                for key, row in self._pending.items():
+                    current = pending.setdefault(key, {**row, "prompt_tokens": 0, "completion_tokens": 0, "calls": 0, "cost_usd": 0.0})
+                    for field in ("prompt_tokens", "completion_tokens", "calls", "cost_usd"):
+                        current[field] += row[field]
+                self._pending = pending
+                logger.warning(f"[TOKENS] ⚠️ Failed to flush token usage for {len(rows)} user-days, will retry: {e}")
+                self._drop_oldest()
+                return 0
+            logger.info(f"[TOKENS] ✅ Flushed token usage for {len(rows)} user-days")
+            return len(rows)
+
+    def _drop_oldest(self) -> None:
+        """Bound the usage kept across failed flushes; budgets are unaffected (they use the shared counters)"""
+        excess = len(self._pending) - settings.token_pending_max_rows
+        if excess <= 0:
+            return
+        for key in list(self._pending)[:excess]:
+            del self._pending[key]
+        metrics.inc("token_usage_rows_dropped", excess)
+        logger.warning(f"[TOKENS] ⚠️ Dropped token usage for the {excess} oldest user-days, over TOKEN_PENDING_MAX_ROWS")
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.token_flush_interval_seconds)
+            await self.flush()
+
+    def start(self) -> None:
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Stop the periodic flush and write whatever is still pending"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+
+# Global instance
+token_accountant = TokenAccountant()
@@ -12,28 +12,45 @@ from app.config import settings
 logger = logging.getLogger(__name__)
 
 class WhatsAppService:
-    """Service for interacting with WhatsApp Cloud API"""
+    """Service for interacting with WhatsApp Cloud API (one per business phone number)"""
     
-    def __init__(self):
-        self.base_url = f"https://graph.facebook.com/v22.0/{settings.whatsapp_phone_id}"
+    def __init__(self, phone_id: Optional[str] = None, access_token: Optional[str] = None):
+        # Without arguments this is the default tenant's client, from the WHATSAPP_* settings
+        if phone_id is None:
+            phone_id, access_token = settings.whatsapp_phone_id, settings.whatsapp_access_token
+        self.phone_id = phone_id
+        self.base_url = f"https://graph.facebook.com/v22.0/{self.phone_id}"
         self.headers = {
-            "Authorization": f"Bearer {settings.whatsapp_access_token}",
+            "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
         }
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Pooled HTTP client, created on first use"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=30.0)
+        return self._client
+    
+    async def close(self):
+        """Close the HTTP client"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
     
     async def _send_request(self, endpoint: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Internal method to send requests to WhatsApp API"""
         url = f"{self.base_url}/{endpoint}"
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, headers=self.headers, json=payload)
-                
-                if response.status_code not in [200, 201]:
-                    logger.error(f"WhatsApp API error: {response.status_code} - {response.text}")
-                    return None
-                
-                return response.json()
+            response = await self.client.post(url, headers=self.headers, json=payload)
+            
+            if response.status_code not in [200, 201]:
+                logger.error(f"WhatsApp API error: {response.status_code} - {response.text}")
+                return None
+            
+            return response.json()
                 
         except httpx.TimeoutException:
             logger.error(f"WhatsApp request timeout: {endpoint}")
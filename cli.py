@@ -13,134 +13,207 @@ Usage:
         python cli.py --start 1                   # Start scenario 1, returns session_id
         python cli.py --session <id> --message "hello"  # Send message
         python cli.py --session <id> --exit       # End session
+        python cli.py --name coffee --start 1     # Named sessions can run side by side
+
+    Warm daemon (services stay loaded between commands):
+        python cli.py --daemon                    # Serve on /tmp/chatlingo_cli.sock
+        python cli_client.py --name coffee --start 1
+        python cli_client.py --name coffee --message "ondu coffee kodi"
+
+    Storage backend (defaults to STORAGE_BACKEND from .env):
+        python cli.py --storage sqlite --sqlite-path /tmp/chatlingo.db --list
+
+    Job queue:
+        python cli.py --queue-stats               # Show queue depth and dead letters
+        python cli.py --replay-dead-letters       # Re-queue all dead-lettered jobs
+        python cli.py --replay-dead-letters 12 15 # Re-queue specific jobs
+
+    Maintenance:
+        python cli.py --token-report --days 7     # Top LLM token consumers this week
+        python cli.py --learner-stats 919876543210  # One learner's progress
+        python cli.py --backfill-learner-stats    # Count existing history into learner stats (once)
+        python cli.py --archive-older-than 90     # Move sessions idle for 90+ days to the archive
+        python cli.py --sos "too expensive"       # Look up a phrase in the SOS index
+        python cli.py --sos-misses --top 50       # SOS questions with no phrase, most asked first
+        python cli.py --shadow-report             # Live vs candidate model/prompts from shadow traffic
+
+    Export (NDJSON, gzip when the file ends in .gz, "-" for stdout):
+        python cli.py --export history.ndjson.gz --since 2025-01-01 --until 2025-02-01
+        python cli.py --export - --user 919876543210 --scenario 1
+
+    Scenario import (YAML/JSON files, one scenario or a list per file, upserted by id):
+        python cli.py --import-scenarios scenarios/ --dry-run   # Validate and show the diff only
+        python cli.py --import-scenarios scenarios/ --prerender # Apply and preview prompt sizes
+
+    Scripted conversations (prompt regression checks / throughput benchmark):
+        python cli.py --script convos.json --parallel 8 --output results.json
+        python cli.py --script convos.json --storage sqlite --llm-provider stub   # Local stand-ins
+
+        convos.json is a list of {"name": ..., "scenario_id": 1, "turns": ["hello", ...]}
 """
 
 import asyncio
 import argparse
 import json
 import os
+import statistics
+import time
 import uuid
+from datetime import datetime, timedelta
 
-from app.services import supabase_service
-from app.services.llm_service import llm_service
+from app.config import settings
+from app.services import storage
+from app.services.llm_service import llm_service, last_usage
+from app.services.token_accounting import token_accountant
 
-# File to persist session info for non-interactive mode
+# Files to persist session info for non-interactive mode ("default" keeps the original path)
 SESSION_FILE = "/tmp/chatlingo_session.json"
+DEFAULT_SESSION_NAME = "default"
+
+# Unix socket of the warm daemon (see --daemon and cli_client.py)
+DAEMON_SOCKET = "/tmp/chatlingo_cli.sock"
+
+
+def _session_file(name: str) -> str:
+    if name == DEFAULT_SESSION_NAME:
+        return SESSION_FILE
+    return f"/tmp/chatlingo_session_{name}.json"
 
 
-def save_session(data: dict):
+def save_session(data: dict, name: str = DEFAULT_SESSION_NAME):
     """Save session data to temp file"""
-    with open(SESSION_FILE, "w") as f:
+    with open(_session_file(name), "w") as f:
         json.dump(data, f)
 
 
-def load_session() -> dict:
+def load_session(name: str = DEFAULT_SESSION_NAME) -> dict:
     """Load session data from temp file"""
-    if os.path.exists(SESSION_FILE):
-        with open(SESSION_FILE, "r") as f:
+    path = _session_file(name)
+    if os.path.exists(path):
+        with open(path, "r") as f:
             return json.load(f)
     return {}
 
 
-def clear_session():
+def clear_session(name: str = DEFAULT_SESSION_NAME):
     """Clear session file"""
-    if os.path.exists(SESSION_FILE):
-        os.remove(SESSION_FILE)
+    path = _session_file(name)
+    if os.path.exists(path):
+        os.remove(path)
 
 
-async def list_scenarios():
-    """List available scenarios"""
-    scenarios = supabase_service.get_all_scenarios()
+# --- Conversation steps (shared by the one-shot commands and the daemon) ---
+
+def _format_scenarios(scenarios: list) -> str:
     if not scenarios:
-        print("No scenarios found.")
-        return
-    
-    print("\n📋 Available Scenarios:")
-    for s in scenarios:
-        print(f"  {s.id}. {s.title} - {s.situation_seed}")
-    print("\nUse --start <id> to begin a scenario")
+        return "No scenarios found."
+    lines = ["\n📋 Available Scenarios:"]
+    lines += [f"  {s.id}. {s.title} - {s.situation_seed}" for s in scenarios]
+    lines.append("\nUse --start <id> to begin a scenario")
+    return "\n".join(lines)
 
 
-async def start_scenario(scenario_id: int, phone: str):
-    """Start a new scenario session"""
-    scenario = supabase_service.get_scenario_by_id(scenario_id)
-    if not scenario:
-        print(f"❌ Scenario {scenario_id} not found")
-        return
-    
+async def _open_session(scenario, phone: str) -> tuple:
+    """Create a session for `phone`, generate the opening line and switch the user into it"""
     # Ensure user exists
-    supabase_service.get_or_create_user(phone)
+    await storage.get_or_create_user(phone)
     
-    # Create session and update user state
     session_id = str(uuid.uuid4())
-    supabase_service.update_user_mode(phone, "practice_scenario", scenario_id=scenario.id, session_id=session_id)
-    
-    # Generate opening via LLM
     opening = await llm_service.get_practice_scenario_response([], scenario.model_dump())
-    supabase_service.add_message(phone, "assistant", opening, mode="practice_scenario", 
-                                session_id=session_id, scenario_id=scenario.id)
+    await storage.complete_turn(phone, opening, "practice_scenario", session_id=session_id,
+                                scenario_id=scenario.id, update_user=True)
     
-    # Save session info
-    save_session({
+    session = {
         "session_id": session_id,
         "scenario_id": scenario.id,
         "scenario_title": scenario.title,
         "bot_persona": scenario.bot_persona,
         "phone": phone
-    })
+    }
+    return session, opening
+
+
+async def _session_turn(session: dict, message: str):
+    """Save the user's message, generate the reply and save it. Returns (scenario, reply)."""
+    scenario = await storage.get_scenario_by_id(session["scenario_id"])
+    if not scenario:
+        return None, None
     
-    print(f"\n🎪 Starting: {scenario.title}")
-    print(f"📍 {scenario.situation_seed}")
-    print("-" * 40)
-    print(f"\n🤖 {scenario.bot_persona}:\n{opening}")
-    print("\n" + "-" * 40)
-    print("💡 Reply with: --message \"your message\"")
-    print("🚪 Exit with: --exit")
+    # Explicit session ids (not the user's current session) so named sessions can share a phone
+    phone, session_id = session["phone"], session["session_id"]
+    await storage.add_message(phone, "user", message, mode="practice_scenario",
+                                session_id=session_id, scenario_id=scenario.id)
+    
+    history = await storage.get_session_history(phone, session_id, limit=50)
+    response = await llm_service.get_practice_scenario_response(history, scenario.model_dump())
+    
+    await storage.add_message(phone, "assistant", response, mode="practice_scenario",
+                                session_id=session_id, scenario_id=scenario.id)
+    return scenario, response
+
+
+def _format_opening(scenario, opening: str) -> str:
+    return "\n".join([
+        f"\n🎪 Starting: {scenario.title}",
+        f"📍 {scenario.situation_seed}",
+        "-" * 40,
+        f"\n🤖 {scenario.bot_persona}:\n{opening}",
+        "\n" + "-" * 40,
+        "💡 Reply with: --message \"your message\"",
+        "🚪 Exit with: --exit",
+    ])
+
+
+def _format_reply(scenario, message: str, response: str) -> str:
+    return "\n".join([
+        f"\n👤 You: {message}",
+        "-" * 40,
+        f"\n🤖 {scenario.bot_persona}:\n{response}",
+        "\n" + "-" * 40,
+    ])
+
+
+async def list_scenarios():
+    """List available scenarios"""
+    print(_format_scenarios(await storage.get_all_scenarios()))
+
+
+async def start_scenario(scenario_id: int, phone: str, name: str = DEFAULT_SESSION_NAME):
+    """Start a new scenario session"""
+    scenario = await storage.get_scenario_by_id(scenario_id)
+    if not scenario:
+        print(f"❌ Scenario {scenario_id} not found")
+        return
+    
+    session, opening = await _open_session(scenario, phone)
+    save_session(session, name)
+    print(_format_opening(scenario, opening))
 
 
-async def send_message(message: str, phone: str):
+async def send_message(message: str, name: str = DEFAULT_SESSION_NAME):
     """Send a message in current session"""
-    session = load_session()
+    session = load_session(name)
     if not session:
         print("❌ No active session. Use --start <scenario_id> first.")
         return
     
-    scenario = supabase_service.get_scenario_by_id(session["scenario_id"])
+    scenario, response = await _session_turn(session, message)
     if not scenario:
         print("❌ Scenario not found")
         return
-    
-    session_id = session["session_id"]
-    
-    # Save user message
-    supabase_service.add_message(phone, "user", message, mode="practice_scenario", 
-                                session_id=session_id, scenario_id=scenario.id)
-    
-    # Get conversation history and generate response
-    history_objs = supabase_service.get_recent_messages(phone, limit=50, session_id=session_id)
-    history = [{"role": msg.role, "content": msg.content} for msg in history_objs]
-    
-    response = await llm_service.get_practice_scenario_response(history, scenario.model_dump())
-    
-    # Save assistant response
-    supabase_service.add_message(phone, "assistant", response, mode="practice_scenario",
-                                session_id=session_id, scenario_id=scenario.id)
-    
-    print(f"\n👤 You: {message}")
-    print("-" * 40)
-    print(f"\n🤖 {scenario.bot_persona}:\n{response}")
-    print("\n" + "-" * 40)
+    print(_format_reply(scenario, message, response))
+
+
+def _format_end(session: dict) -> str:
+    if not session:
+        return "No active session to end."
+    return f"\n👋 Ending session for: {session.get('scenario_title', 'Unknown')}\n✅ Session ended. Hogibarti!"
 
 
-async def end_session():
+async def end_session(name: str = DEFAULT_SESSION_NAME):
     """End current session"""
-    session = load_session()
-    if session:
-        print(f"\n👋 Ending session for: {session.get('scenario_title', 'Unknown')}")
-        clear_session()
-        print("✅ Session ended. Hogibarti!")
-    else:
-        print("No active session to end.")
+    print(_format_end(load_session(name)))
+    clear_session(name)
 
 
 async def interactive_mode(phone: str):
@@ -149,7 +222,7 @@ async def interactive_mode(phone: str):
     print("-" * 40)
     
     # Fetch scenarios from database
-    scenarios = supabase_service.get_all_scenarios()
+    scenarios = await storage.get_all_scenarios()
     if not scenarios:
         print("No scenarios found in database.")
         return
@@ -162,7 +235,7 @@ async def interactive_mode(phone: str):
     # Select scenario
     try:
         choice = int(input("\nEnter scenario number: "))
-        scenario = supabase_service.get_scenario_by_id(choice)
+        scenario = await storage.get_scenario_by_id(choice)
         if not scenario:
             print("Invalid scenario")
             return
@@ -176,15 +249,15 @@ async def interactive_mode(phone: str):
     print("Type 'exit' to quit\n")
     
     # Ensure user exists in DB
-    supabase_service.get_or_create_user(phone)
+    await storage.get_or_create_user(phone)
     
     # Create session and update user state
     session_id = str(uuid.uuid4())
-    supabase_service.update_user_mode(phone, "practice_scenario", scenario_id=scenario.id, session_id=session_id)
+    await storage.update_user_mode(phone, "practice_scenario", scenario_id=scenario.id, session_id=session_id)
     
     # Generate opening
     opening = await llm_service.get_practice_scenario_response([], scenario.model_dump())
-    supabase_service.add_message(phone, "assistant", opening, mode="practice_scenario",
+    await storage.add_message(phone, "assistant", opening, mode="practice_scenario",
                                 session_id=session_id, scenario_id=scenario.id)
     print(f"🤖 {scenario.bot_persona}: {opening}\n")
     
@@ -196,22 +269,406 @@ async def interactive_mode(phone: str):
             break
         
         # Save user message first
-        supabase_service.add_message(phone, "user", user_input, mode="practice_scenario",
+        await storage.add_message(phone, "user", user_input, mode="practice_scenario",
                                     session_id=session_id, scenario_id=scenario.id)
         
         # Get history and generate response
-        history_objs = supabase_service.get_recent_messages(phone, limit=50, session_id=session_id)
-        history = [{"role": msg.role, "content": msg.content} for msg in history_objs]
+        history = await storage.get_session_history(phone, session_id, limit=50)
         
         response = await llm_service.get_practice_scenario_response(history, scenario.model_dump())
         
         # Save assistant response
-        supabase_service.add_message(phone, "assistant", response, mode="practice_scenario",
+        await storage.add_message(phone, "assistant", response, mode="practice_scenario",
                                     session_id=session_id, scenario_id=scenario.id)
         
         print(f"\n🤖 {scenario.bot_persona}: {response}\n")
 
 
+async def queue_stats():
+    """Show job queue depth and the most recent dead letters"""
+    from app.services.job_queue import job_queue
+    
+    stats = await job_queue.stats()
+    print("\n📬 Job queue:")
+    for key, value in stats.items():
+        print(f"  {key}: {value}")
+    
+    dead_letters = await job_queue.list_dead_letters(limit=20)
+    if dead_letters:
+        print("\n☠️  Recent dead letters:")
+        for job in dead_letters:
+            print(f"  #{job['id']} {job['kind']} attempts={job['attempts']} error={job['last_error']}")
+
+
+async def replay_dead_letters(job_ids: list):
+    """Move dead-lettered jobs back onto the queue"""
+    from app.services.job_queue import job_queue
+    
+    count = await job_queue.replay_dead_letters(job_ids or None)
+    print(f"✅ Re-queued {count} job(s). Running app instances will pick them up.")
+
+
+async def token_report(days: int, top: int):
+    """Show the users who used the most LLM tokens over the last `days` days"""
+    await token_accountant.flush()
+    since = (datetime.utcnow() - timedelta(days=days - 1)).date().isoformat()
+    rows = await storage.get_top_token_users(since, limit=top)
+    if not rows:
+        print(f"No token usage recorded since {since}.")
+        return
+    
+    budgets = settings.get_token_budgets()
+    print(f"\n🪙 Top {len(rows)} token consumers since {since}:")
+    print(f"  {'user':<24} {'tier':<10} {'prompt':>10} {'completion':>10} {'calls':>7} {'cost $':>9}  budget/day")
+    for row in rows:
+        budget = budgets.get(row.tier or "free")
+        print(f"  {row.phone_number:<24} {row.tier or '-':<10} {row.prompt_tokens:>10} {row.completion_tokens:>10} "
+              f"{row.calls:>7} {row.cost_usd:>9.4f}  {budget or 'unlimited'}")
+
+
+def _format_date(value) -> str:
+    return f"{value:%Y-%m-%d %H:%M}" if value else "-"
+
+
+async def learner_stats(phone: str):
+    """Show one learner's progress from the incrementally maintained stats"""
+    stats = await storage.get_learner_stats(phone)
+    if not stats:
+        print(f"No stats for {phone}. (Existing history is counted by --backfill-learner-stats.)")
+        return
+    
+    titles = {s.id: s.title for s in await storage.get_all_scenarios()}
+    print(f"\n📈 Learner {stats.phone_number}")
+    print(f"  turns: {stats.turns}   sessions: {stats.sessions}   completions: {stats.completions}")
+    print(f"  first active: {_format_date(stats.first_active_at)}   last active: {_format_date(stats.last_active_at)}")
+    if stats.scenarios:
+        print(f"\n  {'scenario':<30} {'turns':>6} {'started':>8} {'completed':>10}  last active")
+        for s in stats.scenarios:
+            title = titles.get(s.scenario_id, f"#{s.scenario_id}")[:30]
+            print(f"  {title:<30} {s.turns:>6} {s.sessions:>8} {s.completions:>10}  {_format_date(s.last_active_at)}")
+
+
+async def backfill_learner_stats():
+    """Rebuild learner stats from all existing (live and archived) history"""
+    print("📈 Rebuilding learner stats from chat history...")
+    learners = await storage.backfill_learner_stats()
+    print(f"✅ Rebuilt stats for {learners} learners")
+
+
+async def sos_lookup(query: str):
+    """Look a question up in the SOS phrase index, as the SOS Helper would"""
+    from app.services.phrase_index import phrase_index
+    
+    phrase_index.ensure_loaded()
+    started = time.perf_counter()
+    match = phrase_index.lookup(query)
+    elapsed_us = (time.perf_counter() - started) * 1_000_000
+    if not match:
+        print(f"No phrase matches (threshold {settings.sos_match_threshold}); the SOS Helper would ask the LLM.")
+        return
+    print(f"🚑 {match.phrase.kanglish}\n   {match.phrase.intent}")
+    print(f"   score {match.score} via \"{match.matched}\" ({elapsed_us:.0f} µs)")
+
+
+async def sos_misses(top: int):
+    """SOS questions the phrase index could not answer, most asked first"""
+    misses = await storage.get_top_sos_misses(limit=top)
+    if not misses:
+        print("No SOS misses recorded.")
+        return
+    
+    print(f"\n🚑 Top {len(misses)} SOS questions with no phrase")
+    print(f"  {'asked':>6}  {'last asked':<16}  question")
+    for m in misses:
+        print(f"  {m.times_asked:>6}  {_format_date(m.last_asked_at):<16}  {m.query}")
+
+
+def shadow_report(path: str):
+    """Compare live and candidate latency and tokens from recorded shadow traffic"""
+    if not os.path.exists(path):
+        print(f"No shadow results at {path} (set SHADOW_SAMPLE_RATE to record some).")
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    if not entries:
+        print(f"No shadow results in {path}.")
+        return
+    
+    print(f"\n👥 {len(entries)} shadowed calls from {path}")
+    print(f"  {'call':<34} {'side':<7} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} {'prompt':>8} {'compl.':>7} {'cached':>7} {'failed':>6}")
+    calls = sorted({e["call"] for e in entries})
+    for call in calls:
+        for side in ("live", "shadow"):
+            rows = [e[side] for e in entries if e["call"] == call]
+            ok = [r for r in rows if not r.get("failed")]
+            latencies = [r["latency_ms"] for r in ok]
+            prompt, completion, cached = (round(sum(r.get(key, 0) for r in ok) / len(ok)) if ok else 0
+                                          for key in ("prompt_tokens", "completion_tokens", "cached_tokens"))
+            print(f"  {call:<34} {side:<7} {len(rows):>5} {_percentile(latencies, 50):>8} {_percentile(latencies, 95):>8} "
+                  f"{prompt:>8} {completion:>7} {cached:>7} {len(rows) - len(ok):>6}")
+    models = sorted({f"{e['live']['model']} -> {e['shadow']['model']}" for e in entries})
+    print(f"  Models: {', '.join(models)}")
+    print("  Replies are paired per line in the file for side-by-side review.")
+
+
+async def export_history(path: str, filters, batch_size: int):
+    """Stream matching chat history to an NDJSON file"""
+    from app.services.export import export_to_file
+    
+    rows = await export_to_file(path, filters, batch_size=batch_size)
+    if path != "-":
+        print(f"✅ Exported {rows} messages to {path}")
+
+
+async def import_scenarios(directory: str, dry_run: bool, prerender: bool):
+    """Validate scenario files, diff them against the table and upsert what changed"""
+    from app.services.scenario_import import plan_import, apply_import
+    from app.services.llm_service import render_scenario_prompt
+    
+    if not os.path.isdir(directory):
+        print(f"❌ Not a directory: {directory}")
+        return
+    
+    diff, errors = await plan_import(directory)
+    if errors:
+        print(f"❌ {len(errors)} invalid scenario definitions, nothing imported:")
+        for error in errors:
+            print(f"  {error}")
+        return
+    
+    print(f"\n📥 Scenarios in {directory}")
+    for s in diff.added:
+        print(f"  + {s.id:>4}  {s.title}")
+    for old, new in diff.changed:
+        fields = [name for name in type(new).model_fields if getattr(old, name) != getattr(new, name)]
+        print(f"  ~ {new.id:>4}  {new.title}  ({', '.join(fields)})")
+    print(f"  {len(diff.added)} new, {len(diff.changed)} changed, {len(diff.unchanged)} unchanged")
+    if diff.not_in_files:
+        ids = ", ".join(str(s.id) for s in diff.not_in_files)
+        print(f"  ⚠️ {len(diff.not_in_files)} scenarios in the database are not in the files (kept): {ids}")
+    
+    if prerender:
+        print(f"\n  {'id':>4} {'prompt chars':>13} {'~tokens':>8}")
+        for s in diff.added + [new for _, new in diff.changed] + diff.unchanged:
+            prompt = render_scenario_prompt(s.title, s.bot_persona, s.situation_seed)
+            print(f"  {s.id:>4} {len(prompt):>13} {len(prompt) // 4:>8}")
+    
+    if dry_run:
+        print("\nDry run, nothing imported.")
+        return
+    
+    applied = await apply_import(diff)
+    if applied:
+        print(f"\n✅ Imported {applied} scenarios. Running instances reload them on their next turn "
+              f"(with the memory state backend, within SCENARIO_CACHE_TTL_SECONDS).")
+    else:
+        print("\n✅ Scenarios already up to date")
+
+
+async def archive_sessions(days: int, batch_size: int):
+    """Move sessions with no activity in the last `days` days to cold storage"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    print(f"📦 Archiving sessions idle since {cutoff:%Y-%m-%d} (batch size {batch_size})...")
+    moved = await storage.archive_old_sessions(cutoff, batch_size=batch_size)
+    print(f"✅ Archived {moved} messages")
+
+
+async def _run_script_conversation(index: int, convo: dict) -> dict:
+    """Play one scripted conversation through the same storage/LLM path as a webhook turn"""
+    phone = f"script_{index}_{uuid.uuid4().hex[:8]}"
+    result = {"name": convo.get("name", f"conversation_{index}"), "scenario_id": convo["scenario_id"],
+              "phone": phone, "transcript": [], "turns": [], "error": None}
+    try:
+        scenario = await storage.get_scenario_by_id(convo["scenario_id"])
+        if not scenario:
+            raise ValueError(f"Scenario {convo['scenario_id']} not found")
+        
+        # Opening line
+        await storage.get_or_create_user(phone)
+        session_id = str(uuid.uuid4())
+        last_usage.set(None)
+        started = time.perf_counter()
+        opening = await llm_service.get_practice_scenario_response([], scenario.model_dump(), user_id=phone)
+        await storage.complete_turn(phone, opening, "practice_scenario", session_id=session_id,
+                                    scenario_id=scenario.id, update_user=True)
+        result["opening_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        result["transcript"].append({"role": "assistant", "content": opening})
+        
+        for text in convo.get("turns", []):
+            last_usage.set(None)
+            started = time.perf_counter()
+            turn = await storage.begin_turn(phone, text)
+            llm_started = time.perf_counter()
+            response = await llm_service.get_practice_scenario_response(turn.history, scenario.model_dump(),
+                                                                      user_id=phone, user_tier=turn.user.tier)
+            llm_ms = (time.perf_counter() - llm_started) * 1000
+            await storage.complete_turn(phone, response, "practice_scenario",
+                                        session_id=session_id, scenario_id=scenario.id)
+            total_ms = (time.perf_counter() - started) * 1000
+            
+            usage = last_usage.get() or {}
+            result["transcript"].append({"role": "user", "content": text})
+            result["transcript"].append({"role": "assistant", "content": response})
+            result["turns"].append({
+                "latency_ms": round(total_ms, 1),
+                "llm_ms": round(llm_ms, 1),
+                "storage_ms": round(total_ms - llm_ms, 1),
+                "history_messages": len(turn.history),
+                "tier": usage.get("tier"),
+                "prompt_tokens": usage.get("prompt_tokens", 0),
+                "completion_tokens": usage.get("completion_tokens", 0),
+                "cached_tokens": usage.get("cached_tokens", 0),
+            })
+    except Exception as e:
+        result["error"] = repr(e)
+    return result
+
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return round(statistics.quantiles(values, n=100, method="inclusive")[int(pct) - 1], 1)
+
+
+async def run_script(path: str, parallel: int, output: str):
+    """Run scripted conversations concurrently and write transcripts and per-turn stats to JSON"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    conversations = data["conversations"] if isinstance(data, dict) else data
+    if not conversations:
+        print("❌ No conversations in script")
+        return
+    
+    print(f"\n🎬 Running {len(conversations)} conversations ({parallel} at a time)...")
+    semaphore = asyncio.Semaphore(parallel)
+    
+    async def run_one(index: int, convo: dict) -> dict:
+        async with semaphore:
+            return await _run_script_conversation(index, convo)
+    
+    started = time.perf_counter()
+    results = await asyncio.gather(*(run_one(i, c) for i, c in enumerate(conversations)))
+    wall_seconds = time.perf_counter() - started
+    await token_accountant.flush()
+    
+    turns = [t for r in results for t in r["turns"]]
+    latencies = [t["latency_ms"] for t in turns]
+    summary = {
+        "conversations": len(results),
+        "failed": sum(1 for r in results if r["error"]),
+        "turns": len(turns),
+        "parallel": parallel,
+        "storage_backend": settings.storage_backend,
+        "llm_provider": settings.llm_provider,
+        "wall_seconds": round(wall_seconds, 2),
+        "turns_per_second": round(len(turns) / wall_seconds, 2) if wall_seconds else 0.0,
+        "latency_ms": {
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "max": max(latencies, default=0.0),
+        },
+        "llm_ms_p50": _percentile([t["llm_ms"] for t in turns], 50),
+        "storage_ms_p50": _percentile([t["storage_ms"] for t in turns], 50),
+        "prompt_tokens": sum(t["prompt_tokens"] for t in turns),
+        "completion_tokens": sum(t["completion_tokens"] for t in turns),
+        "cached_tokens": sum(t["cached_tokens"] for t in turns),
+    }
+    
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary, "conversations": results}, f, indent=2, ensure_ascii=False)
+    
+    print(f"✅ {summary['turns']} turns in {summary['wall_seconds']}s ({summary['turns_per_second']} turns/s), "
+          f"p50 {summary['latency_ms']['p50']}ms, p95 {summary['latency_ms']['p95']}ms")
+    for r in results:
+        if r["error"]:
+            print(f"  ❌ {r['name']}: {r['error']}")
+    print(f"📄 Results written to {output}")
+
+
+async def run_daemon(socket_path: str):
+    """Keep services warm and serve one-shot commands from cli_client.py over a Unix socket"""
+    if os.path.exists(socket_path):
+        try:
+            _, writer = await asyncio.open_unix_connection(socket_path)
+            writer.close()
+            print(f"❌ A daemon is already listening on {socket_path}")
+            return
+        except OSError:
+            os.remove(socket_path)  # Stale socket from a daemon that did not shut down cleanly
+    
+    print("🔥 Warming up storage and LLM clients...")
+    await storage.warmup()
+    await llm_service.warmup()
+    
+    sessions: dict = {}  # name -> session, so turns skip the session file
+    locks: dict = {}  # name -> lock, one turn at a time per session
+    stop = asyncio.Event()
+    
+    async def handle_command(request: dict) -> str:
+        cmd = request.get("cmd")
+        name = request.get("name") or DEFAULT_SESSION_NAME
+        
+        if cmd == "list":
+            return _format_scenarios(await storage.get_all_scenarios())
+        if cmd == "sessions":
+            if not sessions:
+                return "No active sessions."
+            return "\n".join(f"  {n}: {s['scenario_title']} ({s['phone']})" for n, s in sorted(sessions.items()))
+        if cmd == "start":
+            scenario = await storage.get_scenario_by_id(int(request["scenario_id"]))
+            if not scenario:
+                return f"❌ Scenario {request['scenario_id']} not found"
+            session, opening = await _open_session(scenario, request.get("phone") or "cli_test_user")
+            sessions[name] = session
+            save_session(session, name)
+            return _format_opening(scenario, opening)
+        if cmd == "message":
+            session = sessions.get(name) or load_session(name)
+            if not session:
+                return "❌ No active session. Use --start <scenario_id> first."
+            sessions[name] = session
+            scenario, response = await _session_turn(session, request["text"])
+            if not scenario:
+                return "❌ Scenario not found"
+            return _format_reply(scenario, request["text"], response)
+        if cmd == "exit":
+            session = sessions.pop(name, None) or load_session(name)
+            clear_session(name)
+            return _format_end(session)
+        if cmd == "shutdown":
+            stop.set()
+            return "👋 Daemon stopping."
+        raise ValueError(f"Unknown command: {cmd}")
+    
+    async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(await reader.readline())
+            lock = locks.setdefault(request.get("name") or DEFAULT_SESSION_NAME, asyncio.Lock())
+            async with lock:
+                response = {"ok": True, "output": await handle_command(request)}
+        except Exception as e:
+            response = {"ok": False, "output": f"❌ {e!r}"}
+        writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+    
+    server = await asyncio.start_unix_server(handle_client, path=socket_path)
+    os.chmod(socket_path, 0o600)
+    print(f"✅ Daemon ready on {socket_path} (stop with: python cli_client.py --shutdown)")
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        await storage.close()
+        await llm_service.close()
+
+
 async def main():
     parser = argparse.ArgumentParser(description="Chatlingo CLI")
     parser.add_argument(
@@ -219,6 +676,11 @@ async def main():
         default="cli_test_user",
         help="Phone number/identifier for DB tracking"
     )
+    parser.add_argument(
+        "--name",
+        default=DEFAULT_SESSION_NAME,
+        help="Session name, so several sessions can run side by side (default: 'default')"
+    )
     parser.add_argument(
         "--list",
         action="store_true",
@@ -242,22 +704,228 @@ async def main():
         dest="end_session",
         help="End current session"
     )
+    parser.add_argument(
+        "--storage",
+        choices=["supabase", "sqlite"],
+        help="Storage backend to use (overrides STORAGE_BACKEND)"
+    )
+    parser.add_argument(
+        "--sqlite-path",
+        metavar="PATH",
+        help="SQLite database file for the sqlite backend (overrides SQLITE_PATH)"
+    )
+    parser.add_argument(
+        "--llm-provider",
+        choices=["openai", "openrouter", "stub", "cassette"],
+        help="LLM provider to use (overrides LLM_PROVIDER); 'stub' and 'cassette' (replay) make no API calls"
+    )
+    parser.add_argument(
+        "--script",
+        metavar="FILE",
+        help="Run the scripted conversations in FILE (JSON) and write transcripts and stats"
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=4,
+        metavar="N",
+        help="Conversations run concurrently with --script (default: 4)"
+    )
+    parser.add_argument(
+        "--output",
+        default="script_results.json",
+        metavar="FILE",
+        help="Where --script writes its results (default: script_results.json)"
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Run a warm daemon that serves cli_client.py commands over a Unix socket"
+    )
+    parser.add_argument(
+        "--socket",
+        default=DAEMON_SOCKET,
+        metavar="PATH",
+        help=f"Unix socket for --daemon (default: {DAEMON_SOCKET})"
+    )
+    parser.add_argument(
+        "--queue-stats",
+        action="store_true",
+        help="Show job queue depth and recent dead letters"
+    )
+    parser.add_argument(
+        "--replay-dead-letters",
+        nargs="*",
+        type=int,
+        metavar="JOB_ID",
+        help="Re-queue dead-lettered jobs (all if no ids are given)"
+    )
+    parser.add_argument(
+        "--token-report",
+        action="store_true",
+        help="List the top token consumers (see --days and --top)"
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Days covered by --token-report, including today (default: 1)"
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=20,
+        metavar="N",
+        help="Rows listed by --token-report and --sos-misses (default: 20)"
+    )
+    parser.add_argument(
+        "--learner-stats",
+        metavar="PHONE",
+        help="Show a learner's progress (turns, sessions, completions per scenario)"
+    )
+    parser.add_argument(
+        "--backfill-learner-stats",
+        action="store_true",
+        help="Rebuild learner stats from existing chat history (run once after upgrading)"
+    )
+    parser.add_argument(
+        "--sos",
+        metavar="QUERY",
+        help="Look up QUERY in the SOS phrase index and show the match and its score"
+    )
+    parser.add_argument(
+        "--sos-misses",
+        action="store_true",
+        help="List SOS questions the phrase index could not answer (use --top for how many)"
+    )
+    parser.add_argument(
+        "--shadow-report",
+        nargs="?",
+        const=settings.shadow_results_path,
+        metavar="FILE",
+        help="Compare live and candidate latency/tokens from shadow traffic (default: SHADOW_RESULTS_PATH)"
+    )
+    parser.add_argument(
+        "--archive-older-than",
+        type=int,
+        metavar="DAYS",
+        help="Archive sessions with no messages in the last DAYS days"
+    )
+    parser.add_argument(
+        "--archive-batch-size",
+        type=int,
+        default=500,
+        metavar="N",
+        help="Sessions moved per archival batch (default: 500)"
+    )
+    
+    parser.add_argument(
+        "--export",
+        metavar="FILE",
+        help="Export chat history as NDJSON (gzip if FILE ends in .gz, '-' for stdout)"
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.fromisoformat,
+        metavar="DATE",
+        help="Export messages created at or after DATE (YYYY-MM-DD or ISO timestamp)"
+    )
+    parser.add_argument(
+        "--until",
+        type=datetime.fromisoformat,
+        metavar="DATE",
+        help="Export messages created before DATE"
+    )
+    parser.add_argument(
+        "--user",
+        metavar="PHONE",
+        help="Export only this user's messages"
+    )
+    parser.add_argument(
+        "--scenario",
+        type=int,
+        metavar="SCENARIO_ID",
+        help="Export only messages of this scenario"
+    )
+    parser.add_argument(
+        "--session-id",
+        metavar="ID",
+        help="Export only messages of this session"
+    )
+    parser.add_argument(
+        "--export-batch-size",
+        type=int,
+        default=settings.export_batch_size,
+        metavar="N",
+        help=f"Rows fetched per page during --export (default: {settings.export_batch_size})"
+    )
+    
+    parser.add_argument(
+        "--import-scenarios",
+        metavar="DIR",
+        help="Import scenario definitions from the YAML/JSON files in DIR (upserted by id)"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="With --import-scenarios, validate and show the diff without writing"
+    )
+    parser.add_argument(
+        "--prerender",
+        action="store_true",
+        help="With --import-scenarios, render each scenario's system prompt and show its size"
+    )
     
     args = parser.parse_args()
     
-    # Use saved phone from session if exists
-    session = load_session()
-    phone = session.get("phone", args.phone)
+    # Storage is imported lazily, so overrides apply before first use
+    if args.storage:
+        settings.storage_backend = args.storage
+    if args.sqlite_path:
+        settings.sqlite_path = args.sqlite_path
+    if args.llm_provider:
+        settings.llm_provider = args.llm_provider
     
     # Non-interactive commands
-    if args.list:
+    if args.daemon:
+        await run_daemon(args.socket)
+    elif args.script:
+        await run_script(args.script, max(args.parallel, 1), args.output)
+    elif args.queue_stats:
+        await queue_stats()
+    elif args.replay_dead_letters is not None:
+        await replay_dead_letters(args.replay_dead_letters)
+    elif args.token_report:
+        await token_report(max(args.days, 1), args.top)
+    elif args.learner_stats:
+        await learner_stats(args.learner_stats)
+    elif args.backfill_learner_stats:
+        await backfill_learner_stats()
+    elif args.sos:
+        await sos_lookup(args.sos)
+    elif args.sos_misses:
+        await sos_misses(args.top)
+    elif args.shadow_report:
+        shadow_report(args.shadow_report)
+    elif args.export:
+        from app.services.export import HistoryFilter
+        filters = HistoryFilter(since=args.since, until=args.until, phone=args.user,
+                                scenario_id=args.scenario, session_id=args.session_id)
+        await export_history(args.export, filters, max(args.export_batch_size, 1))
+    elif args.import_scenarios:
+        await import_scenarios(args.import_scenarios, args.dry_run, args.prerender)
+    elif args.archive_older_than is not None:
+        await archive_sessions(args.archive_older_than, args.archive_batch_size)
+    elif args.list:
         await list_scenarios()
     elif args.start:
-        await start_scenario(args.start, args.phone)
+        await start_scenario(args.start, args.phone, args.name)
     elif args.message:
-        await send_message(args.message, phone)
+        # The session's own phone is used, whatever --phone says
+        await send_message(args.message, args.name)
     elif args.end_session:
-        await end_session()
+        await end_session(args.name)
     else:
         # Default: interactive mode
         await interactive_mode(args.phone)
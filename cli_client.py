@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Thin client for the Chatlingo CLI daemon
+
+Sends one command to a running `python cli.py --daemon` over its Unix socket
+and prints the reply. Uses only the standard library, so it starts instantly.
+
+Usage:
+    python cli_client.py --list                          # List scenarios
+    python cli_client.py --name coffee --start 1         # Start scenario 1 as session "coffee"
+    python cli_client.py --name coffee --message "hello" # Send message
+    python cli_client.py --name coffee --exit            # End session
+    python cli_client.py --sessions                      # Sessions held by the daemon
+    python cli_client.py --shutdown                      # Stop the daemon
+"""
+
+import argparse
+import json
+import socket
+import sys
+
+# Keep in sync with cli.DAEMON_SOCKET (not imported: cli.py loads the app services)
+DAEMON_SOCKET = "/tmp/chatlingo_cli.sock"
+
+
+def send_command(request: dict, socket_path: str) -> dict:
+    """Send one JSON request line and read one JSON response line"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        with sock.makefile("r", encoding="utf-8") as f:
+            return json.loads(f.readline())
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Chatlingo CLI daemon client")
+    parser.add_argument("--socket", default=DAEMON_SOCKET, metavar="PATH", help="Daemon socket path")
+    parser.add_argument("--name", default="default", help="Session name (default: 'default')")
+    parser.add_argument("--phone", default="cli_test_user", help="Phone number/identifier for a new session")
+
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--list", action="store_true", help="List available scenarios")
+    group.add_argument("--start", type=int, metavar="SCENARIO_ID", help="Start a scenario by ID")
+    group.add_argument("--message", type=str, metavar="TEXT", help="Send a message in the named session")
+    group.add_argument("--exit", action="store_true", dest="end_session", help="End the named session")
+    group.add_argument("--sessions", action="store_true", help="List sessions held by the daemon")
+    group.add_argument("--shutdown", action="store_true", help="Stop the daemon")
+
+    args = parser.parse_args()
+
+    if args.list:
+        request = {"cmd": "list"}
+    elif args.start is not None:
+        request = {"cmd": "start", "name": args.name, "scenario_id": args.start, "phone": args.phone}
+    elif args.message is not None:
+        request = {"cmd": "message", "name": args.name, "text": args.message}
+    elif args.end_session:
+        request = {"cmd": "exit", "name": args.name}
+    elif args.sessions:
+        request = {"cmd": "sessions"}
+    else:
+        request = {"cmd": "shutdown"}
+
+    try:
+        response = send_command(request, args.socket)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"❌ No daemon on {args.socket}. Start one with: python cli.py --daemon", file=sys.stderr)
+        return 1
+
+    print(response["output"])
+    return 0 if response["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+-- Migration 001: session-scoped index, monthly partitioning of chat_history and archival
+--
+-- Converts an existing (unpartitioned) chat_history table in place. Run once in the
+-- Supabase SQL editor during a quiet period; new databases get this from schema.sql.
+
+BEGIN;
+
+-- 1. Move the old table aside and create the partitioned replacement
+ALTER TABLE chat_history RENAME TO chat_history_legacy;
+ALTER INDEX IF EXISTS idx_chat_history_lookup RENAME TO idx_chat_history_legacy_lookup;
+-- The old id identity owns chat_history_id_seq and keeps that name through the table rename
+ALTER SEQUENCE IF EXISTS chat_history_id_seq RENAME TO chat_history_legacy_id_seq;
+
+CREATE SEQUENCE chat_history_id_seq;
+
+CREATE TABLE chat_history (
+    id BIGINT NOT NULL DEFAULT nextval('chat_history_id_seq'),
+    phone_number TEXT NOT NULL REFERENCES users(phone_number),
+    role TEXT NOT NULL,
+    mode TEXT,
+    scenario_id INT REFERENCES scenarios(id),
+    session_id UUID,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE chat_history_default PARTITION OF chat_history DEFAULT;
+
+CREATE TABLE chat_history_archive (
+    id BIGINT PRIMARY KEY,
+    phone_number TEXT NOT NULL,
+    role TEXT NOT NULL,
+    mode TEXT,
+    scenario_id INT,
+    session_id UUID,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    archived_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX idx_chat_history_lookup ON chat_history(phone_number, created_at DESC);
+CREATE INDEX idx_chat_history_session ON chat_history(phone_number, session_id, created_at DESC);
+CREATE INDEX idx_chat_history_archive_session ON chat_history_archive(session_id);
+
+-- 2. Functions
+-- Create monthly chat_history partitions for the current month and the next p_months_ahead
+CREATE OR REPLACE FUNCTION ensure_chat_history_partitions(p_months_ahead INT DEFAULT 3)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    month_start DATE := date_trunc('month', NOW())::date;
+    partition_name TEXT;
+BEGIN
+    FOR i IN 0..p_months_ahead LOOP
+        partition_name := format('chat_history_%s', to_char(month_start, 'YYYY_MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF chat_history FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, (month_start + INTERVAL '1 month')::date
+            );
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+END;
+$$;
+
+-- Move one batch of finished sessions (no messages since p_cutoff) to chat_history_archive.
+-- Sessionless rows older than p_cutoff are moved once no finished sessions remain.
+-- Returns the number of rows moved; call repeatedly until it returns 0.
+CREATE OR REPLACE FUNCTION archive_chat_sessions(p_cutoff TIMESTAMPTZ, p_batch_size INT DEFAULT 500)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    moved INT;
+BEGIN
+    WITH sessions AS (
+        SELECT DISTINCT old.phone_number, old.session_id
+        FROM chat_history old
+        WHERE old.created_at < p_cutoff
+          AND old.session_id IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM chat_history newer
+              WHERE newer.phone_number = old.phone_number
+                AND newer.session_id = old.session_id
+                AND newer.created_at >= p_cutoff
+          )
+        LIMIT p_batch_size
+    ), moved_rows AS (
+        DELETE FROM chat_history h
+        USING sessions s
+        WHERE h.phone_number = s.phone_number AND h.session_id = s.session_id
+        RETURNING h.id, h.phone_number, h.role, h.mode, h.scenario_id, h.session_id, h.content, h.created_at
+    )
+    INSERT INTO chat_history_archive (id, phone_number, role, mode, scenario_id, session_id, content, created_at)
+    SELECT * FROM moved_rows
+    ON CONFLICT (id) DO NOTHING;
+    GET DIAGNOSTICS moved = ROW_COUNT;
+
+    IF moved = 0 THEN
+        WITH old_rows AS (
+            SELECT id, created_at FROM chat_history
+            WHERE session_id IS NULL AND created_at < p_cutoff
+            LIMIT p_batch_size * 20
+        ), moved_rows AS (
+            DELETE FROM chat_history h
+            USING old_rows o
+            WHERE h.id = o.id AND h.created_at = o.created_at
+            RETURNING h.id, h.phone_number, h.role, h.mode, h.scenario_id, h.session_id, h.content, h.created_at
+        )
+        INSERT INTO chat_history_archive (id, phone_number, role, mode, scenario_id, session_id, content, created_at)
+        SELECT * FROM moved_rows
+        ON CONFLICT (id) DO NOTHING;
+        GET DIAGNOSTICS moved = ROW_COUNT;
+    END IF;
+
+    RETURN moved;
+END;
+$$;
+
+-- Drop monthly partitions that ended before p_cutoff and have been emptied by archival
+CREATE OR REPLACE FUNCTION drop_empty_chat_history_partitions(p_cutoff TIMESTAMPTZ)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    part RECORD;
+    dropped INT := 0;
+    is_empty BOOLEAN;
+BEGIN
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'chat_history'::regclass
+          AND c.relname ~ '^chat_history_\d{4}_\d{2}$'
+          AND to_date(substring(c.relname FROM '\d{4}_\d{2}$'), 'YYYY_MM') + INTERVAL '1 month' <= p_cutoff
+    LOOP
+        EXECUTE format('SELECT NOT EXISTS (SELECT 1 FROM %I)', part.relname) INTO is_empty;
+        IF is_empty THEN
+            EXECUTE format('DROP TABLE %I', part.relname);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    RETURN dropped;
+END;
+$$;
+
+-- 3. Monthly partitions covering the existing history plus the next three months
+DO $$
+DECLARE
+    month_start DATE;
+BEGIN
+    SELECT date_trunc('month', COALESCE(MIN(created_at), NOW()))::date INTO month_start FROM chat_history_legacy;
+    WHILE month_start < date_trunc('month', NOW())::date LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF chat_history FOR VALUES FROM (%L) TO (%L)',
+            format('chat_history_%s', to_char(month_start, 'YYYY_MM')),
+            month_start, (month_start + INTERVAL '1 month')::date
+        );
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+END;
+$$;
+
+SELECT ensure_chat_history_partitions(3);
+
+-- 4. Copy rows across and continue ids from where the old table left off
+INSERT INTO chat_history (id, phone_number, role, mode, scenario_id, session_id, content, created_at)
+SELECT id, phone_number, role, mode, scenario_id, session_id, content, COALESCE(created_at, NOW())
+FROM chat_history_legacy;
+
+SELECT setval('chat_history_id_seq', COALESCE((SELECT MAX(id) FROM chat_history_legacy), 0) + 1, false);
+
+DROP TABLE chat_history_legacy;
+
+COMMIT;
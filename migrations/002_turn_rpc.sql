@@ -0,0 +1,74 @@
+-- Migration 002: single-round-trip turn functions (begin_turn / complete_turn)
+--
+-- Called via RPC from supabase_service.begin_turn and supabase_service.complete_turn.
+
+-- Start a turn in one round trip: upsert the user, save their message and return
+-- user state, the current scenario and the bounded session history (oldest first).
+-- Without a session, history is the user's most recent messages.
+CREATE OR REPLACE FUNCTION begin_turn(p_phone TEXT, p_content TEXT, p_history_limit INT DEFAULT 50)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    u users%ROWTYPE;
+    scenario JSONB;
+    history JSONB;
+BEGIN
+    INSERT INTO users (phone_number, current_mode) VALUES (p_phone, 'menu')
+    ON CONFLICT (phone_number) DO NOTHING;
+
+    SELECT * INTO u FROM users WHERE phone_number = p_phone;
+
+    INSERT INTO chat_history (phone_number, role, content, mode, session_id, scenario_id)
+    VALUES (p_phone, 'user', p_content, u.current_mode, u.current_session_id, u.current_scenario_id);
+
+    IF u.current_scenario_id IS NOT NULL THEN
+        SELECT to_jsonb(s) INTO scenario FROM scenarios s WHERE s.id = u.current_scenario_id;
+    END IF;
+
+    IF p_history_limit > 0 THEN
+        SELECT jsonb_agg(jsonb_build_object('role', r.role, 'content', r.content) ORDER BY r.created_at, r.id)
+        INTO history
+        FROM (
+            SELECT id, role, content, created_at FROM chat_history
+            WHERE phone_number = p_phone
+              AND (u.current_session_id IS NULL OR session_id = u.current_session_id)
+            ORDER BY created_at DESC, id DESC
+            LIMIT p_history_limit
+        ) r;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'user', to_jsonb(u),
+        'scenario', scenario,
+        'history', COALESCE(history, '[]'::jsonb)
+    );
+END;
+$$;
+
+-- Finish a turn in one round trip: save the assistant reply and, if requested,
+-- move the user to the reply's mode/scenario/session in the same transaction.
+CREATE OR REPLACE FUNCTION complete_turn(
+    p_phone TEXT,
+    p_content TEXT,
+    p_mode TEXT,
+    p_session_id UUID DEFAULT NULL,
+    p_scenario_id INT DEFAULT NULL,
+    p_update_user BOOLEAN DEFAULT FALSE
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO chat_history (phone_number, role, content, mode, session_id, scenario_id)
+    VALUES (p_phone, 'assistant', p_content, p_mode, p_session_id, p_scenario_id);
+
+    IF p_update_user THEN
+        UPDATE users
+        SET current_mode = p_mode,
+            current_scenario_id = p_scenario_id,
+            current_session_id = COALESCE(p_session_id, current_session_id)
+        WHERE phone_number = p_phone;
+    END IF;
+END;
+$$;
@@ -0,0 +1,52 @@
+-- Migration 003: per-user token accounting and user tiers for daily budgets
+--
+-- Called via RPC from supabase_service.record_token_usage and supabase_service.get_top_token_users.
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS tier TEXT DEFAULT 'free';
+
+CREATE TABLE IF NOT EXISTS token_usage (
+    phone_number TEXT NOT NULL,
+    day DATE NOT NULL,
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    calls INT NOT NULL DEFAULT 0,
+    cost_usd NUMERIC(12, 6) NOT NULL DEFAULT 0,
+    PRIMARY KEY (phone_number, day)
+);
+
+CREATE INDEX IF NOT EXISTS idx_token_usage_day ON token_usage(day);
+
+-- Add a batch of per-user, per-day token usage deltas
+CREATE OR REPLACE FUNCTION record_token_usage(p_rows JSONB)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO token_usage (phone_number, day, prompt_tokens, completion_tokens, calls, cost_usd)
+    SELECT r.phone_number, r.day, r.prompt_tokens, r.completion_tokens, r.calls, r.cost_usd
+    FROM jsonb_to_recordset(p_rows) AS r(
+        phone_number TEXT, day DATE, prompt_tokens BIGINT, completion_tokens BIGINT, calls INT, cost_usd NUMERIC
+    )
+    ON CONFLICT (phone_number, day) DO UPDATE SET
+        prompt_tokens = token_usage.prompt_tokens + EXCLUDED.prompt_tokens,
+        completion_tokens = token_usage.completion_tokens + EXCLUDED.completion_tokens,
+        calls = token_usage.calls + EXCLUDED.calls,
+        cost_usd = token_usage.cost_usd + EXCLUDED.cost_usd;
+$$;
+
+-- Heaviest token consumers since p_since (inclusive)
+CREATE OR REPLACE FUNCTION top_token_users(p_since DATE, p_limit INT DEFAULT 20)
+RETURNS TABLE (
+    phone_number TEXT, tier TEXT, prompt_tokens BIGINT, completion_tokens BIGINT, calls BIGINT, cost_usd NUMERIC
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT t.phone_number, u.tier, SUM(t.prompt_tokens)::BIGINT, SUM(t.completion_tokens)::BIGINT,
+           SUM(t.calls)::BIGINT, SUM(t.cost_usd)
+    FROM token_usage t
+    LEFT JOIN users u ON u.phone_number = t.phone_number
+    WHERE t.day >= p_since
+    GROUP BY t.phone_number, u.tier
+    ORDER BY SUM(t.prompt_tokens + t.completion_tokens) DESC
+    LIMIT p_limit;
+$$;
@@ -0,0 +1,127 @@
+-- Migration 004: incrementally maintained learner statistics
+--
+-- Triggers on chat_history and user_progress keep learner_stats and learner_scenario_stats
+-- current. Existing history is counted once with: SELECT backfill_learner_stats();
+-- (or python cli.py --backfill-learner-stats).
+
+CREATE TABLE IF NOT EXISTS learner_stats (
+    phone_number TEXT PRIMARY KEY,
+    turns INT NOT NULL DEFAULT 0,  -- Messages sent by the learner
+    sessions INT NOT NULL DEFAULT 0,
+    completions INT NOT NULL DEFAULT 0,
+    first_active_at TIMESTAMP WITH TIME ZONE,
+    last_active_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE TABLE IF NOT EXISTS learner_scenario_stats (
+    phone_number TEXT NOT NULL,
+    scenario_id INT NOT NULL,
+    turns INT NOT NULL DEFAULT 0,
+    sessions INT NOT NULL DEFAULT 0,  -- Times the scenario was started
+    completions INT NOT NULL DEFAULT 0,
+    last_active_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (phone_number, scenario_id)
+);
+
+-- Count a new chat_history row into learner stats. A session is counted with its first message.
+CREATE OR REPLACE FUNCTION update_learner_stats()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    is_turn INT := (NEW.role = 'user')::INT;
+    new_session INT := 0;
+BEGIN
+    IF NEW.session_id IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM chat_history
+        WHERE phone_number = NEW.phone_number AND session_id = NEW.session_id AND id <> NEW.id
+    ) THEN
+        new_session := 1;
+    END IF;
+
+    INSERT INTO learner_stats (phone_number, turns, sessions, first_active_at, last_active_at)
+    VALUES (NEW.phone_number, is_turn, new_session, NEW.created_at, NEW.created_at)
+    ON CONFLICT (phone_number) DO UPDATE SET
+        turns = learner_stats.turns + EXCLUDED.turns,
+        sessions = learner_stats.sessions + EXCLUDED.sessions,
+        first_active_at = COALESCE(learner_stats.first_active_at, EXCLUDED.first_active_at),
+        last_active_at = GREATEST(learner_stats.last_active_at, EXCLUDED.last_active_at);
+
+    IF NEW.scenario_id IS NOT NULL THEN
+        INSERT INTO learner_scenario_stats (phone_number, scenario_id, turns, sessions, last_active_at)
+        VALUES (NEW.phone_number, NEW.scenario_id, is_turn, new_session, NEW.created_at)
+        ON CONFLICT (phone_number, scenario_id) DO UPDATE SET
+            turns = learner_scenario_stats.turns + EXCLUDED.turns,
+            sessions = learner_scenario_stats.sessions + EXCLUDED.sessions,
+            last_active_at = GREATEST(learner_scenario_stats.last_active_at, EXCLUDED.last_active_at);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- Count a scenario completion (repeats update the existing user_progress row and count too)
+CREATE OR REPLACE FUNCTION count_learner_completion()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF NEW.status = 'completed' THEN
+        INSERT INTO learner_stats (phone_number, completions) VALUES (NEW.phone_number, 1)
+        ON CONFLICT (phone_number) DO UPDATE SET completions = learner_stats.completions + 1;
+        INSERT INTO learner_scenario_stats (phone_number, scenario_id, completions) VALUES (NEW.phone_number, NEW.scenario_id, 1)
+        ON CONFLICT (phone_number, scenario_id) DO UPDATE SET completions = learner_scenario_stats.completions + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- Rebuild learner stats from live and archived history (one-time backfill; safe to re-run).
+-- Returns the number of learners.
+CREATE OR REPLACE FUNCTION backfill_learner_stats()
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    learners INT;
+BEGIN
+    -- Block concurrent writes so no message is counted twice or missed while rebuilding
+    LOCK TABLE chat_history, user_progress IN SHARE MODE;
+    DELETE FROM learner_stats;
+    DELETE FROM learner_scenario_stats;
+
+    CREATE TEMP TABLE all_history ON COMMIT DROP AS
+        SELECT phone_number, role, scenario_id, session_id, created_at FROM chat_history
+        UNION ALL
+        SELECT phone_number, role, scenario_id, session_id, created_at FROM chat_history_archive;
+
+    INSERT INTO learner_stats (phone_number, turns, sessions, completions, first_active_at, last_active_at)
+    SELECT h.phone_number, COUNT(*) FILTER (WHERE h.role = 'user'), COUNT(DISTINCT h.session_id),
+           (SELECT COUNT(*) FROM user_progress p WHERE p.phone_number = h.phone_number AND p.status = 'completed'),
+           MIN(h.created_at), MAX(h.created_at)
+    FROM all_history h
+    GROUP BY h.phone_number;
+
+    INSERT INTO learner_scenario_stats (phone_number, scenario_id, turns, sessions, completions, last_active_at)
+    SELECT h.phone_number, h.scenario_id, COUNT(*) FILTER (WHERE h.role = 'user'), COUNT(DISTINCT h.session_id),
+           (SELECT COUNT(*) FROM user_progress p
+            WHERE p.phone_number = h.phone_number AND p.scenario_id = h.scenario_id AND p.status = 'completed'),
+           MAX(h.created_at)
+    FROM all_history h
+    WHERE h.scenario_id IS NOT NULL
+    GROUP BY h.phone_number, h.scenario_id;
+
+    SELECT COUNT(*) INTO learners FROM learner_stats;
+    RETURN learners;
+END;
+$$;
+
+-- Keep learner stats current as messages and completions are written
+DROP TRIGGER IF EXISTS trg_learner_stats_message ON chat_history;
+CREATE TRIGGER trg_learner_stats_message
+    AFTER INSERT ON chat_history
+    FOR EACH ROW EXECUTE FUNCTION update_learner_stats();
+
+DROP TRIGGER IF EXISTS trg_learner_stats_completion ON user_progress;
+CREATE TRIGGER trg_learner_stats_completion
+    AFTER INSERT OR UPDATE OF completed_at ON user_progress
+    FOR EACH ROW EXECUTE FUNCTION count_learner_completion();
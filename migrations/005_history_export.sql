@@ -0,0 +1,32 @@
+-- Migration 005: keyset-paginated bulk export of chat history
+--
+-- Called via RPC from supabase_service.get_history_page (cli.py --export, /admin/export/chat-history).
+
+CREATE INDEX IF NOT EXISTS idx_chat_history_export ON chat_history(created_at, id);
+
+-- One page of chat history for bulk export, ordered by (created_at, id) and continuing
+-- after the keyset cursor (p_after_created_at, p_after_id). NULL filters match everything.
+CREATE OR REPLACE FUNCTION export_chat_history(
+    p_after_created_at TIMESTAMPTZ DEFAULT NULL,
+    p_after_id BIGINT DEFAULT NULL,
+    p_limit INT DEFAULT 1000,
+    p_since TIMESTAMPTZ DEFAULT NULL,
+    p_until TIMESTAMPTZ DEFAULT NULL,
+    p_phone TEXT DEFAULT NULL,
+    p_scenario_id INT DEFAULT NULL,
+    p_session_id UUID DEFAULT NULL
+)
+RETURNS SETOF chat_history
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT * FROM chat_history
+    WHERE (p_after_created_at IS NULL OR (created_at, id) > (p_after_created_at, p_after_id))
+      AND (p_since IS NULL OR created_at >= p_since)
+      AND (p_until IS NULL OR created_at < p_until)
+      AND (p_phone IS NULL OR phone_number = p_phone)
+      AND (p_scenario_id IS NULL OR scenario_id = p_scenario_id)
+      AND (p_session_id IS NULL OR session_id = p_session_id)
+    ORDER BY created_at, id
+    LIMIT p_limit;
+$$;
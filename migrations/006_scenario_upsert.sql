@@ -0,0 +1,25 @@
+-- Migration 006: batched scenario upserts
+--
+-- Called via RPC from supabase_service.upsert_scenarios (cli.py --import-scenarios).
+
+-- Insert or update a batch of scenarios by id. Explicit ids bypass the identity
+-- sequence, so it is moved past the highest id for later inserts without one.
+CREATE OR REPLACE FUNCTION upsert_scenarios(p_rows JSONB)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO scenarios (id, title, bot_persona, situation_seed, opening_line)
+    SELECT r.id, r.title, r.bot_persona, r.situation_seed, r.opening_line
+    FROM jsonb_to_recordset(p_rows) AS r(
+        id BIGINT, title TEXT, bot_persona TEXT, situation_seed TEXT, opening_line TEXT
+    )
+    ON CONFLICT (id) DO UPDATE SET
+        title = EXCLUDED.title,
+        bot_persona = EXCLUDED.bot_persona,
+        situation_seed = EXCLUDED.situation_seed,
+        opening_line = EXCLUDED.opening_line;
+
+    PERFORM setval(pg_get_serial_sequence('scenarios', 'id'), (SELECT MAX(id) FROM scenarios));
+END;
+$$;
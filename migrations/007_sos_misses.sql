@@ -0,0 +1,23 @@
+-- Migration 007: SOS Helper misses
+--
+-- Questions the local phrase index could not answer (answered by the LLM instead), counted
+-- per normalized question so the most common ones can be added to app/data/sos_phrases.json.
+-- Called via RPC from supabase_service.record_sos_miss.
+
+CREATE TABLE IF NOT EXISTS sos_misses (
+    query TEXT PRIMARY KEY,  -- Normalized question
+    times_asked INT NOT NULL DEFAULT 1,
+    first_asked_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    last_asked_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Count an SOS Helper question the phrase index could not answer
+CREATE OR REPLACE FUNCTION record_sos_miss(p_query TEXT)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO sos_misses (query) VALUES (p_query)
+    ON CONFLICT (query) DO UPDATE SET
+        times_asked = sos_misses.times_asked + 1,
+        last_asked_at = NOW();
+$$;
@@ -0,0 +1,115 @@
+-- Migration 008: Idempotent turns
+--
+-- Jobs are retried after a crash or failure, so begin_turn/complete_turn take the platform
+-- message id as a turn key: a key seen before does not save the user's message again, and
+-- the worker does not re-send a reply already recorded as sent. Keys older than the archive
+-- cutoff are pruned by supabase_service.archive_old_sessions.
+
+CREATE TABLE IF NOT EXISTS processed_turns (
+    turn_key TEXT PRIMARY KEY,  -- Platform message id, e.g. 'whatsapp:wamid...'
+    phone_number TEXT NOT NULL,
+    reply TEXT,  -- Assistant reply saved for the turn
+    reply_sent_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_processed_turns_created ON processed_turns(created_at);
+
+-- The signatures change, so drop the old overloads rather than adding new ones next to them
+DROP FUNCTION IF EXISTS begin_turn(TEXT, TEXT, INT);
+DROP FUNCTION IF EXISTS complete_turn(TEXT, TEXT, TEXT, UUID, INT, BOOLEAN);
+
+-- Start a turn in one round trip: upsert the user, save their message and return
+-- user state, the current scenario and the bounded session history (oldest first).
+-- Without a session, history is the user's most recent messages.
+-- A p_turn_key seen before (a retried job) does not save the message again; the
+-- result is marked 'replayed' with the reply saved for it and whether it was sent.
+CREATE OR REPLACE FUNCTION begin_turn(p_phone TEXT, p_content TEXT, p_history_limit INT DEFAULT 50, p_turn_key TEXT DEFAULT NULL)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    u users%ROWTYPE;
+    scenario JSONB;
+    history JSONB;
+    replayed BOOLEAN := FALSE;
+    turn processed_turns%ROWTYPE;
+BEGIN
+    INSERT INTO users (phone_number, current_mode) VALUES (p_phone, 'menu')
+    ON CONFLICT (phone_number) DO NOTHING;
+
+    SELECT * INTO u FROM users WHERE phone_number = p_phone;
+
+    IF p_turn_key IS NOT NULL THEN
+        INSERT INTO processed_turns (turn_key, phone_number) VALUES (p_turn_key, p_phone)
+        ON CONFLICT (turn_key) DO NOTHING;
+        IF NOT FOUND THEN
+            replayed := TRUE;
+            SELECT * INTO turn FROM processed_turns WHERE turn_key = p_turn_key;
+        END IF;
+    END IF;
+
+    IF NOT replayed THEN
+        INSERT INTO chat_history (phone_number, role, content, mode, session_id, scenario_id)
+        VALUES (p_phone, 'user', p_content, u.current_mode, u.current_session_id, u.current_scenario_id);
+    END IF;
+
+    IF u.current_scenario_id IS NOT NULL THEN
+        SELECT to_jsonb(s) INTO scenario FROM scenarios s WHERE s.id = u.current_scenario_id;
+    END IF;
+
+    IF p_history_limit > 0 THEN
+        SELECT jsonb_agg(jsonb_build_object('role', r.role, 'content', r.content) ORDER BY r.created_at, r.id)
+        INTO history
+        FROM (
+            SELECT id, role, content, created_at FROM chat_history
+            WHERE phone_number = p_phone
+              AND (u.current_session_id IS NULL OR session_id = u.current_session_id)
+            ORDER BY created_at DESC, id DESC
+            LIMIT p_history_limit
+        ) r;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'user', to_jsonb(u),
+        'scenario', scenario,
+        'history', COALESCE(history, '[]'::jsonb),
+        'replayed', replayed,
+        'reply', turn.reply,
+        'reply_sent', turn.reply_sent_at IS NOT NULL
+    );
+END;
+$$;
+
+-- Finish a turn in one round trip: save the assistant reply (as the reply of
+-- p_turn_key, if given) and, if requested, move the user to the reply's
+-- mode/scenario/session in the same transaction.
+CREATE OR REPLACE FUNCTION complete_turn(
+    p_phone TEXT,
+    p_content TEXT,
+    p_mode TEXT,
+    p_session_id UUID DEFAULT NULL,
+    p_scenario_id INT DEFAULT NULL,
+    p_update_user BOOLEAN DEFAULT FALSE,
+    p_turn_key TEXT DEFAULT NULL
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO chat_history (phone_number, role, content, mode, session_id, scenario_id)
+    VALUES (p_phone, 'assistant', p_content, p_mode, p_session_id, p_scenario_id);
+
+    IF p_turn_key IS NOT NULL THEN
+        UPDATE processed_turns SET reply = p_content WHERE turn_key = p_turn_key;
+    END IF;
+
+    IF p_update_user THEN
+        UPDATE users
+        SET current_mode = p_mode,
+            current_scenario_id = p_scenario_id,
+            current_session_id = COALESCE(p_session_id, current_session_id)
+        WHERE phone_number = p_phone;
+    END IF;
+END;
+$$;
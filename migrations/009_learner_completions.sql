@@ -0,0 +1,35 @@
+-- Migration 009: one completion per completed scenario
+--
+-- Completions used to count every repeat of a scenario in the triggers but one per scenario in
+-- backfill_learner_stats. Both now count scenarios completed (one user_progress row each), and a
+-- learner_stats row created by a completion gets its activity dates. Correct existing counts
+-- afterwards with: SELECT backfill_learner_stats(); (or python cli.py --backfill-learner-stats).
+
+-- Count a scenario completed for the first time. Repeats update the existing user_progress
+-- row and are not counted, so completions match the backfill (one per user_progress row).
+CREATE OR REPLACE FUNCTION count_learner_completion()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF NEW.status = 'completed' AND (TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM 'completed') THEN
+        INSERT INTO learner_stats (phone_number, completions, first_active_at, last_active_at)
+        VALUES (NEW.phone_number, 1, NEW.completed_at, NEW.completed_at)
+        ON CONFLICT (phone_number) DO UPDATE SET
+            completions = learner_stats.completions + 1,
+            first_active_at = COALESCE(learner_stats.first_active_at, EXCLUDED.first_active_at),
+            last_active_at = GREATEST(learner_stats.last_active_at, EXCLUDED.last_active_at);
+        INSERT INTO learner_scenario_stats (phone_number, scenario_id, completions, last_active_at)
+        VALUES (NEW.phone_number, NEW.scenario_id, 1, NEW.completed_at)
+        ON CONFLICT (phone_number, scenario_id) DO UPDATE SET
+            completions = learner_scenario_stats.completions + 1,
+            last_active_at = GREATEST(learner_scenario_stats.last_active_at, EXCLUDED.last_active_at);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_learner_stats_completion ON user_progress;
+CREATE TRIGGER trg_learner_stats_completion
+    AFTER INSERT OR UPDATE OF status ON user_progress
+    FOR EACH ROW EXECUTE FUNCTION count_learner_completion();
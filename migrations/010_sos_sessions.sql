@@ -0,0 +1,67 @@
+-- Migration 010: standalone SOS turns
+--
+-- Entering the SOS Helper now starts a session of its own (set by the app), and begin_turn no
+-- longer loads history for SOS turns, which answer one question at a time.
+
+-- Start a turn in one round trip: upsert the user, save their message and return
+-- user state, the current scenario and the bounded session history (oldest first).
+-- Without a session, history is the user's most recent messages; SOS turns get none.
+-- A p_turn_key seen before (a retried job) does not save the message again; the
+-- result is marked 'replayed' with the reply saved for it and whether it was sent.
+CREATE OR REPLACE FUNCTION begin_turn(p_phone TEXT, p_content TEXT, p_history_limit INT DEFAULT 50, p_turn_key TEXT DEFAULT NULL)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    u users%ROWTYPE;
+    scenario JSONB;
+    history JSONB;
+    replayed BOOLEAN := FALSE;
+    turn processed_turns%ROWTYPE;
+BEGIN
+    INSERT INTO users (phone_number, current_mode) VALUES (p_phone, 'menu')
+    ON CONFLICT (phone_number) DO NOTHING;
+
+    SELECT * INTO u FROM users WHERE phone_number = p_phone;
+
+    IF p_turn_key IS NOT NULL THEN
+        INSERT INTO processed_turns (turn_key, phone_number) VALUES (p_turn_key, p_phone)
+        ON CONFLICT (turn_key) DO NOTHING;
+        IF NOT FOUND THEN
+            replayed := TRUE;
+            SELECT * INTO turn FROM processed_turns WHERE turn_key = p_turn_key;
+        END IF;
+    END IF;
+
+    IF NOT replayed THEN
+        INSERT INTO chat_history (phone_number, role, content, mode, session_id, scenario_id)
+        VALUES (p_phone, 'user', p_content, u.current_mode, u.current_session_id, u.current_scenario_id);
+    END IF;
+
+    IF u.current_scenario_id IS NOT NULL THEN
+        SELECT to_jsonb(s) INTO scenario FROM scenarios s WHERE s.id = u.current_scenario_id;
+    END IF;
+
+    -- SOS questions stand alone, so no history is loaded for them
+    IF p_history_limit > 0 AND u.current_mode IS DISTINCT FROM 'sos' THEN
+        SELECT jsonb_agg(jsonb_build_object('role', r.role, 'content', r.content) ORDER BY r.created_at, r.id)
+        INTO history
+        FROM (
+            SELECT id, role, content, created_at FROM chat_history
+            WHERE phone_number = p_phone
+              AND (u.current_session_id IS NULL OR session_id = u.current_session_id)
+            ORDER BY created_at DESC, id DESC
+            LIMIT p_history_limit
+        ) r;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'user', to_jsonb(u),
+        'scenario', scenario,
+        'history', COALESCE(history, '[]'::jsonb),
+        'replayed', replayed,
+        'reply', turn.reply,
+        'reply_sent', turn.reply_sent_at IS NOT NULL
+    );
+END;
+$$;
@@ -5,6 +5,7 @@ CREATE TABLE users (
     current_mode TEXT DEFAULT 'menu',
     current_scenario_id INT,
     current_session_id UUID,
+    tier TEXT DEFAULT 'free',  -- Selects the daily token budget (TOKEN_BUDGETS)
     joined_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
@@ -17,17 +18,22 @@ CREATE TABLE scenarios (
     opening_line TEXT NOT NULL,
 );
 
--- 3. CHAT_HISTORY
+-- 3. CHAT_HISTORY (partitioned by month on created_at, see ensure_chat_history_partitions)
+CREATE SEQUENCE chat_history_id_seq;
+
 CREATE TABLE chat_history (
-    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    id BIGINT NOT NULL DEFAULT nextval('chat_history_id_seq'),
     phone_number TEXT NOT NULL REFERENCES users(phone_number),
     role TEXT NOT NULL,
     mode TEXT,
     scenario_id INT REFERENCES scenarios(id),
     session_id UUID,
     content TEXT NOT NULL,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-);
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE chat_history_default PARTITION OF chat_history DEFAULT;
 
 -- 4. USER_PROGRESS
 CREATE TABLE user_progress (
@@ -39,5 +45,481 @@ CREATE TABLE user_progress (
     UNIQUE(phone_number, scenario_id)
 );
 
--- 5. INDEXES
-CREATE INDEX idx_chat_history_lookup ON chat_history(phone_number, created_at DESC);
\ No newline at end of file
+-- 5. CHAT_HISTORY_ARCHIVE (cold storage for archived sessions)
+CREATE TABLE chat_history_archive (
+    id BIGINT PRIMARY KEY,
+    phone_number TEXT NOT NULL,
+    role TEXT NOT NULL,
+    mode TEXT,
+    scenario_id INT,
+    session_id UUID,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    archived_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 6. TOKEN_USAGE (per user and UTC day, flushed in batches by the app)
+CREATE TABLE token_usage (
+    phone_number TEXT NOT NULL,
+    day DATE NOT NULL,
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    calls INT NOT NULL DEFAULT 0,
+    cost_usd NUMERIC(12, 6) NOT NULL DEFAULT 0,
+    PRIMARY KEY (phone_number, day)
+);
+
+-- 7. LEARNER_STATS (progress counters kept up to date by triggers, see update_learner_stats)
+CREATE TABLE learner_stats (
+    phone_number TEXT PRIMARY KEY,
+    turns INT NOT NULL DEFAULT 0,  -- Messages sent by the learner
+    sessions INT NOT NULL DEFAULT 0,
+    completions INT NOT NULL DEFAULT 0,
+    first_active_at TIMESTAMP WITH TIME ZONE,
+    last_active_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE TABLE learner_scenario_stats (
+    phone_number TEXT NOT NULL,
+    scenario_id INT NOT NULL,
+    turns INT NOT NULL DEFAULT 0,
+    sessions INT NOT NULL DEFAULT 0,  -- Times the scenario was started
+    completions INT NOT NULL DEFAULT 0,
+    last_active_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (phone_number, scenario_id)
+);
+
+-- 8. SOS_MISSES (SOS Helper questions the phrase index could not answer, to grow it)
+CREATE TABLE sos_misses (
+    query TEXT PRIMARY KEY,  -- Normalized question
+    times_asked INT NOT NULL DEFAULT 1,
+    first_asked_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    last_asked_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 9. PROCESSED_TURNS (inbound messages already saved, so a retried job neither saves nor answers them twice)
+CREATE TABLE processed_turns (
+    turn_key TEXT PRIMARY KEY,  -- Platform message id, e.g. 'whatsapp:wamid...'
+    phone_number TEXT NOT NULL,
+    reply TEXT,  -- Assistant reply saved for the turn
+    reply_sent_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 10. INDEXES
+CREATE INDEX idx_chat_history_lookup ON chat_history(phone_number, created_at DESC);
+CREATE INDEX idx_chat_history_session ON chat_history(phone_number, session_id, created_at DESC);
+CREATE INDEX idx_chat_history_export ON chat_history(created_at, id);
+CREATE INDEX idx_chat_history_archive_session ON chat_history_archive(session_id);
+CREATE INDEX idx_token_usage_day ON token_usage(day);
+CREATE INDEX idx_processed_turns_created ON processed_turns(created_at);
+
+-- 11. FUNCTIONS (called from the app via RPC)
+
+-- Create monthly chat_history partitions for the current month and the next p_months_ahead
+CREATE OR REPLACE FUNCTION ensure_chat_history_partitions(p_months_ahead INT DEFAULT 3)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    month_start DATE := date_trunc('month', NOW())::date;
+    partition_name TEXT;
+BEGIN
+    FOR i IN 0..p_months_ahead LOOP
+        partition_name := format('chat_history_%s', to_char(month_start, 'YYYY_MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF chat_history FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, (month_start + INTERVAL '1 month')::date
+            );
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+END;
+$$;
+
+-- Move one batch of finished sessions (no messages since p_cutoff) to chat_history_archive.
+-- Sessionless rows older than p_cutoff are moved once no finished sessions remain.
+-- Returns the number of rows moved; call repeatedly until it returns 0.
+CREATE OR REPLACE FUNCTION archive_chat_sessions(p_cutoff TIMESTAMPTZ, p_batch_size INT DEFAULT 500)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    moved INT;
+BEGIN
+    WITH sessions AS (
+        SELECT DISTINCT old.phone_number, old.session_id
+        FROM chat_history old
+        WHERE old.created_at < p_cutoff
+          AND old.session_id IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM chat_history newer
+              WHERE newer.phone_number = old.phone_number
+                AND newer.session_id = old.session_id
+                AND newer.created_at >= p_cutoff
+          )
+        LIMIT p_batch_size
+    ), moved_rows AS (
+        DELETE FROM chat_history h
+        USING sessions s
+        WHERE h.phone_number = s.phone_number AND h.session_id = s.session_id
+        RETURNING h.id, h.phone_number, h.role, h.mode, h.scenario_id, h.session_id, h.content, h.created_at
+    )
+    INSERT INTO chat_history_archive (id, phone_number, role, mode, scenario_id, session_id, content, created_at)
+    SELECT * FROM moved_rows
+    ON CONFLICT (id) DO NOTHING;
+    GET DIAGNOSTICS moved = ROW_COUNT;
+
+    IF moved = 0 THEN
+        WITH old_rows AS (
+            SELECT id, created_at FROM chat_history
+            WHERE session_id IS NULL AND created_at < p_cutoff
+            LIMIT p_batch_size * 20
+        ), moved_rows AS (
+            DELETE FROM chat_history h
+            USING old_rows o
+            WHERE h.id = o.id AND h.created_at = o.created_at
+            RETURNING h.id, h.phone_number, h.role, h.mode, h.scenario_id, h.session_id, h.content, h.created_at
+        )
+        INSERT INTO chat_history_archive (id, phone_number, role, mode, scenario_id, session_id, content, created_at)
+        SELECT * FROM moved_rows
+        ON CONFLICT (id) DO NOTHING;
+        GET DIAGNOSTICS moved = ROW_COUNT;
+    END IF;
+
+    RETURN moved;
+END;
+$$;
+
+-- Drop monthly partitions that ended before p_cutoff and have been emptied by archival
+CREATE OR REPLACE FUNCTION drop_empty_chat_history_partitions(p_cutoff TIMESTAMPTZ)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    part RECORD;
+    dropped INT := 0;
+    is_empty BOOLEAN;
+BEGIN
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'chat_history'::regclass
+          AND c.relname ~ '^chat_history_\d{4}_\d{2}$'
+          AND to_date(substring(c.relname FROM '\d{4}_\d{2}$'), 'YYYY_MM') + INTERVAL '1 month' <= p_cutoff
+    LOOP
+        EXECUTE format('SELECT NOT EXISTS (SELECT 1 FROM %I)', part.relname) INTO is_empty;
+        IF is_empty THEN
+            EXECUTE format('DROP TABLE %I', part.relname);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    RETURN dropped;
+END;
+$$;
+
+-- Start a turn in one round trip: upsert the user, save their message and return
+-- user state, the current scenario and the bounded session history (oldest first).
+-- Without a session, history is the user's most recent messages; SOS turns get none.
+-- A p_turn_key seen before (a retried job) does not save the message again; the
+-- result is marked 'replayed' with the reply saved for it and whether it was sent.
+CREATE OR REPLACE FUNCTION begin_turn(p_phone TEXT, p_content TEXT, p_history_limit INT DEFAULT 50, p_turn_key TEXT DEFAULT NULL)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    u users%ROWTYPE;
+    scenario JSONB;
+    history JSONB;
+    replayed BOOLEAN := FALSE;
+    turn processed_turns%ROWTYPE;
+BEGIN
+    INSERT INTO users (phone_number, current_mode) VALUES (p_phone, 'menu')
+    ON CONFLICT (phone_number) DO NOTHING;
+
+    SELECT * INTO u FROM users WHERE phone_number = p_phone;
+
+    IF p_turn_key IS NOT NULL THEN
+        INSERT INTO processed_turns (turn_key, phone_number) VALUES (p_turn_key, p_phone)
+        ON CONFLICT (turn_key) DO NOTHING;
+        IF NOT FOUND THEN
+            replayed := TRUE;
+            SELECT * INTO turn FROM processed_turns WHERE turn_key = p_turn_key;
+        END IF;
+    END IF;
+
+    IF NOT replayed THEN
+        INSERT INTO chat_history (phone_number, role, content, mode, session_id, scenario_id)
+        VALUES (p_phone, 'user', p_content, u.current_mode, u.current_session_id, u.current_scenario_id);
+    END IF;
+
+    IF u.current_scenario_id IS NOT NULL THEN
+        SELECT to_jsonb(s) INTO scenario FROM scenarios s WHERE s.id = u.current_scenario_id;
+    END IF;
+
+    -- SOS questions stand alone, so no history is loaded for them
+    IF p_history_limit > 0 AND u.current_mode IS DISTINCT FROM 'sos' THEN
+        SELECT jsonb_agg(jsonb_build_object('role', r.role, 'content', r.content) ORDER BY r.created_at, r.id)
+        INTO history
+        FROM (
+            SELECT id, role, content, created_at FROM chat_history
+            WHERE phone_number = p_phone
+              AND (u.current_session_id IS NULL OR session_id = u.current_session_id)
+            ORDER BY created_at DESC, id DESC
+            LIMIT p_history_limit
+        ) r;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'user', to_jsonb(u),
+        'scenario', scenario,
+        'history', COALESCE(history, '[]'::jsonb),
+        'replayed', replayed,
+        'reply', turn.reply,
+        'reply_sent', turn.reply_sent_at IS NOT NULL
+    );
+END;
+$$;
+
+-- Finish a turn in one round trip: save the assistant reply (as the reply of
+-- p_turn_key, if given) and, if requested, move the user to the reply's
+-- mode/scenario/session in the same transaction.
+CREATE OR REPLACE FUNCTION complete_turn(
+    p_phone TEXT,
+    p_content TEXT,
+    p_mode TEXT,
+    p_session_id UUID DEFAULT NULL,
+    p_scenario_id INT DEFAULT NULL,
+    p_update_user BOOLEAN DEFAULT FALSE,
+    p_turn_key TEXT DEFAULT NULL
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO chat_history (phone_number, role, content, mode, session_id, scenario_id)
+    VALUES (p_phone, 'assistant', p_content, p_mode, p_session_id, p_scenario_id);
+
+    IF p_turn_key IS NOT NULL THEN
+        UPDATE processed_turns SET reply = p_content WHERE turn_key = p_turn_key;
+    END IF;
+
+    IF p_update_user THEN
+        UPDATE users
+        SET current_mode = p_mode,
+            current_scenario_id = p_scenario_id,
+            current_session_id = COALESCE(p_session_id, current_session_id)
+        WHERE phone_number = p_phone;
+    END IF;
+END;
+$$;
+
+-- Add a batch of per-user, per-day token usage deltas
+CREATE OR REPLACE FUNCTION record_token_usage(p_rows JSONB)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO token_usage (phone_number, day, prompt_tokens, completion_tokens, calls, cost_usd)
+    SELECT r.phone_number, r.day, r.prompt_tokens, r.completion_tokens, r.calls, r.cost_usd
+    FROM jsonb_to_recordset(p_rows) AS r(
+        phone_number TEXT, day DATE, prompt_tokens BIGINT, completion_tokens BIGINT, calls INT, cost_usd NUMERIC
+    )
+    ON CONFLICT (phone_number, day) DO UPDATE SET
+        prompt_tokens = token_usage.prompt_tokens + EXCLUDED.prompt_tokens,
+        completion_tokens = token_usage.completion_tokens + EXCLUDED.completion_tokens,
+        calls = token_usage.calls + EXCLUDED.calls,
+        cost_usd = token_usage.cost_usd + EXCLUDED.cost_usd;
+$$;
+
+-- Heaviest token consumers since p_since (inclusive)
+CREATE OR REPLACE FUNCTION top_token_users(p_since DATE, p_limit INT DEFAULT 20)
+RETURNS TABLE (
+    phone_number TEXT, tier TEXT, prompt_tokens BIGINT, completion_tokens BIGINT, calls BIGINT, cost_usd NUMERIC
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT t.phone_number, u.tier, SUM(t.prompt_tokens)::BIGINT, SUM(t.completion_tokens)::BIGINT,
+           SUM(t.calls)::BIGINT, SUM(t.cost_usd)
+    FROM token_usage t
+    LEFT JOIN users u ON u.phone_number = t.phone_number
+    WHERE t.day >= p_since
+    GROUP BY t.phone_number, u.tier
+    ORDER BY SUM(t.prompt_tokens + t.completion_tokens) DESC
+    LIMIT p_limit;
+$$;
+
+-- Count an SOS Helper question the phrase index could not answer
+CREATE OR REPLACE FUNCTION record_sos_miss(p_query TEXT)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO sos_misses (query) VALUES (p_query)
+    ON CONFLICT (query) DO UPDATE SET
+        times_asked = sos_misses.times_asked + 1,
+        last_asked_at = NOW();
+$$;
+
+-- Insert or update a batch of scenarios by id. Explicit ids bypass the identity
+-- sequence, so it is moved past the highest id for later inserts without one.
+CREATE OR REPLACE FUNCTION upsert_scenarios(p_rows JSONB)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO scenarios (id, title, bot_persona, situation_seed, opening_line)
+    SELECT r.id, r.title, r.bot_persona, r.situation_seed, r.opening_line
+    FROM jsonb_to_recordset(p_rows) AS r(
+        id BIGINT, title TEXT, bot_persona TEXT, situation_seed TEXT, opening_line TEXT
+    )
+    ON CONFLICT (id) DO UPDATE SET
+        title = EXCLUDED.title,
+        bot_persona = EXCLUDED.bot_persona,
+        situation_seed = EXCLUDED.situation_seed,
+        opening_line = EXCLUDED.opening_line;
+
+    PERFORM setval(pg_get_serial_sequence('scenarios', 'id'), (SELECT MAX(id) FROM scenarios));
+END;
+$$;
+
+-- One page of chat history for bulk export, ordered by (created_at, id) and continuing
+-- after the keyset cursor (p_after_created_at, p_after_id). NULL filters match everything.
+CREATE OR REPLACE FUNCTION export_chat_history(
+    p_after_created_at TIMESTAMPTZ DEFAULT NULL,
+    p_after_id BIGINT DEFAULT NULL,
+    p_limit INT DEFAULT 1000,
+    p_since TIMESTAMPTZ DEFAULT NULL,
+    p_until TIMESTAMPTZ DEFAULT NULL,
+    p_phone TEXT DEFAULT NULL,
+    p_scenario_id INT DEFAULT NULL,
+    p_session_id UUID DEFAULT NULL
+)
+RETURNS SETOF chat_history
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT * FROM chat_history
+    WHERE (p_after_created_at IS NULL OR (created_at, id) > (p_after_created_at, p_after_id))
+      AND (p_since IS NULL OR created_at >= p_since)
+      AND (p_until IS NULL OR created_at < p_until)
+      AND (p_phone IS NULL OR phone_number = p_phone)
+      AND (p_scenario_id IS NULL OR scenario_id = p_scenario_id)
+      AND (p_session_id IS NULL OR session_id = p_session_id)
+    ORDER BY created_at, id
+    LIMIT p_limit;
+$$;
+
+-- Count a new chat_history row into learner stats. A session is counted with its first message.
+CREATE OR REPLACE FUNCTION update_learner_stats()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    is_turn INT := (NEW.role = 'user')::INT;
+    new_session INT := 0;
+BEGIN
+    IF NEW.session_id IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM chat_history
+        WHERE phone_number = NEW.phone_number AND session_id = NEW.session_id AND id <> NEW.id
+    ) THEN
+        new_session := 1;
+    END IF;
+
+    INSERT INTO learner_stats (phone_number, turns, sessions, first_active_at, last_active_at)
+    VALUES (NEW.phone_number, is_turn, new_session, NEW.created_at, NEW.created_at)
+    ON CONFLICT (phone_number) DO UPDATE SET
+        turns = learner_stats.turns + EXCLUDED.turns,
+        sessions = learner_stats.sessions + EXCLUDED.sessions,
+        first_active_at = COALESCE(learner_stats.first_active_at, EXCLUDED.first_active_at),
+        last_active_at = GREATEST(learner_stats.last_active_at, EXCLUDED.last_active_at);
+
+    IF NEW.scenario_id IS NOT NULL THEN
+        INSERT INTO learner_scenario_stats (phone_number, scenario_id, turns, sessions, last_active_at)
+        VALUES (NEW.phone_number, NEW.scenario_id, is_turn, new_session, NEW.created_at)
+        ON CONFLICT (phone_number, scenario_id) DO UPDATE SET
+            turns = learner_scenario_stats.turns + EXCLUDED.turns,
+            sessions = learner_scenario_stats.sessions + EXCLUDED.sessions,
+            last_active_at = GREATEST(learner_scenario_stats.last_active_at, EXCLUDED.last_active_at);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- Count a scenario completed for the first time. Repeats update the existing user_progress
+-- row and are not counted, so completions match the backfill (one per user_progress row).
+CREATE OR REPLACE FUNCTION count_learner_completion()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF NEW.status = 'completed' AND (TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM 'completed') THEN
+        INSERT INTO learner_stats (phone_number, completions, first_active_at, last_active_at)
+        VALUES (NEW.phone_number, 1, NEW.completed_at, NEW.completed_at)
+        ON CONFLICT (phone_number) DO UPDATE SET
+            completions = learner_stats.completions + 1,
+            first_active_at = COALESCE(learner_stats.first_active_at, EXCLUDED.first_active_at),
+            last_active_at = GREATEST(learner_stats.last_active_at, EXCLUDED.last_active_at);
+        INSERT INTO learner_scenario_stats (phone_number, scenario_id, completions, last_active_at)
+        VALUES (NEW.phone_number, NEW.scenario_id, 1, NEW.completed_at)
+        ON CONFLICT (phone_number, scenario_id) DO UPDATE SET
+            completions = learner_scenario_stats.completions + 1,
+            last_active_at = GREATEST(learner_scenario_stats.last_active_at, EXCLUDED.last_active_at);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- Rebuild learner stats from live and archived history (one-time backfill; safe to re-run).
+-- Returns the number of learners.
+CREATE OR REPLACE FUNCTION backfill_learner_stats()
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    learners INT;
+BEGIN
+    -- Block concurrent writes so no message is counted twice or missed while rebuilding
+    LOCK TABLE chat_history, user_progress IN SHARE MODE;
+    DELETE FROM learner_stats;
+    DELETE FROM learner_scenario_stats;
+
+    CREATE TEMP TABLE all_history ON COMMIT DROP AS
+        SELECT phone_number, role, scenario_id, session_id, created_at FROM chat_history
+        UNION ALL
+        SELECT phone_number, role, scenario_id, session_id, created_at FROM chat_history_archive;
+
+    INSERT INTO learner_stats (phone_number, turns, sessions, completions, first_active_at, last_active_at)
+    SELECT h.phone_number, COUNT(*) FILTER (WHERE h.role = 'user'), COUNT(DISTINCT h.session_id),
+           (SELECT COUNT(*) FROM user_progress p WHERE p.phone_number = h.phone_number AND p.status = 'completed'),
+           MIN(h.created_at), MAX(h.created_at)
+    FROM all_history h
+    GROUP BY h.phone_number;
+
+    INSERT INTO learner_scenario_stats (phone_number, scenario_id, turns, sessions, completions, last_active_at)
+    SELECT h.phone_number, h.scenario_id, COUNT(*) FILTER (WHERE h.role = 'user'), COUNT(DISTINCT h.session_id),
+           (SELECT COUNT(*) FROM user_progress p
+            WHERE p.phone_number = h.phone_number AND p.scenario_id = h.scenario_id AND p.status = 'completed'),
+           MAX(h.created_at)
+    FROM all_history h
+    WHERE h.scenario_id IS NOT NULL
+    GROUP BY h.phone_number, h.scenario_id;
+
+    SELECT COUNT(*) INTO learners FROM learner_stats;
+    RETURN learners;
+END;
+$$;
+
+-- 12. TRIGGERS
+
+-- Keep learner stats current as messages and completions are written
+CREATE TRIGGER trg_learner_stats_message
+    AFTER INSERT ON chat_history
+    FOR EACH ROW EXECUTE FUNCTION update_learner_stats();
+
+CREATE TRIGGER trg_learner_stats_completion
+    AFTER INSERT OR UPDATE OF status ON user_progress
+    FOR EACH ROW EXECUTE FUNCTION count_learner_completion();
+
+SELECT ensure_chat_history_partitions(3);